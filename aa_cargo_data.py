@@ -8,7 +8,9 @@ import io
 import logging
 import pathlib
 import arrow
+import pandas as pd
 from airport_info import get_airport_info, get_airport_icao
+from schedule_utils import dates_by_month, describe_dates, schedule_dates
 import flight_data_source
 
 PWD = pathlib.Path(__file__).resolve().parent
@@ -26,6 +28,18 @@ _HEADER_ROWS = 8
 # Disclaimer line marks end of data.
 _DISCLAIMER_PREFIX = "Data shown in this schedule"
 
+# Fields of the rows returned by _read_csv_file().
+_ROW_FIELDS = [
+    "origin",
+    "dest",
+    "flight_number",
+    "dow",
+    "departs",
+    "arrives",
+    "eff_date",
+    "dis_date",
+]
+
 _AA_ICAO = "AAL"
 _AA_IATA = "AA"
 
@@ -88,106 +102,126 @@ def _read_csv_file(path: pathlib.Path) -> list[dict]:
     return _rows
 
 
+def _load_rows(path: pathlib.Path) -> pd.DataFrame:
+    return pd.DataFrame(_read_csv_file(path), columns=_ROW_FIELDS, dtype=str)
+
+
 def _process_row(
     row: dict,
-    utc: arrow.Arrow,
+    dates: list[arrow.Arrow],
     unknown_airports: set[str],
-) -> dict | None:
+) -> list[dict]:
+    """Returns the flights of a schedule row on the dates it operates."""
     if not row["flight_number"].isdigit():
-        return None
+        return []
     flight_number = int(row["flight_number"])
 
     _eff = _parse_date(row["eff_date"])
     _dis = _parse_date(row["dis_date"])
     if _eff is None:
-        return None
+        return []
     if _dis is None:
         _dis = _eff.shift(months=1)
-    if not _eff <= utc <= _dis.ceil("day"):
-        return None
-
+    _dis = _dis.ceil("day")
     _days = _parse_dow(row["dow"])
-    if utc.isoweekday() not in _days:
-        return None
+    _dates = [
+        _utc
+        for _utc in dates
+        if _eff <= _utc <= _dis and _utc.isoweekday() in _days
+    ]
+    if not _dates:
+        return []
 
     origin_icao = get_airport_icao(row["origin"])
     dest_icao = get_airport_icao(row["dest"])
     if origin_icao is None:
         unknown_airports.add(row["origin"])
-        return None
+        return []
     if dest_icao is None:
         unknown_airports.add(row["dest"])
-        return None
+        return []
 
     origin_info = get_airport_info(origin_icao)
     dest_info = get_airport_info(dest_icao)
     if origin_info is None or dest_info is None:
-        return None
-
-    _date = utc.format("YYYY-MM-DD")
-    _departure = arrow.get(
-        f"{_date}T{row['departs']}", tzinfo=origin_info["Timezone"]
-    )
-    _arrival = arrow.get(
-        f"{_date}T{row['arrives']}", tzinfo=dest_info["Timezone"]
-    )
-    if _arrival < _departure:
-        _arrival = _arrival.shift(days=1)
+        return []
 
     _route = f"{origin_icao}-{dest_icao}"
-    return {
-        "_id": f"{_AA_IATA}_{flight_number}_{_route}_{utc.format('YYYYMMDD')}",
-        "airline_iata": _AA_IATA,
-        "airline_icao": _AA_ICAO,
-        "flight_number": flight_number,
-        "route": _route,
-        "departure": int(_departure.timestamp()),
-        "arrival": int(_arrival.timestamp()),
-        "segment_number": 0,
-    }
+    flights = []
+    for _utc in _dates:
+        _date = _utc.format("YYYY-MM-DD")
+        _departure = arrow.get(
+            f"{_date}T{row['departs']}", tzinfo=origin_info["Timezone"]
+        )
+        _arrival = arrow.get(
+            f"{_date}T{row['arrives']}", tzinfo=dest_info["Timezone"]
+        )
+        if _arrival < _departure:
+            _arrival = _arrival.shift(days=1)
+        flights.append(
+            {
+                "_id": f"{_AA_IATA}_{flight_number}_{_route}_{_utc.format('YYYYMMDD')}",
+                "airline_iata": _AA_IATA,
+                "airline_icao": _AA_ICAO,
+                "flight_number": flight_number,
+                "route": _route,
+                "departure": int(_departure.timestamp()),
+                "arrival": int(_arrival.timestamp()),
+                "segment_number": 0,
+            }
+        )
+    return flights
 
 
 class Airline(flight_data_source.FlightDataSource):
     def __init__(self):
         super().__init__("AACargo", category="airlines")
 
-    def update_data(self, utc=None) -> None:
+    def update_data(self, utc=None, days: int = 1) -> None:
         if utc is None:
             _utc = arrow.utcnow()
         else:
             _utc = arrow.get(utc)
 
-        _path = PWD / _FILE_PATTERN.format(
-            month=_utc.format("MMM"), year=_utc.format("YYYY")
-        )
-        if not _path.exists():
-            logger.warning(
-                f"Schedule file not found: {_path.name} — download from "
-                f"https://www.aacargo.com/ship/schedules.html"
-            )
-            return
-
-        _rows = _read_csv_file(_path)
-        logger.debug(f"Read {len(_rows)} rows from {_path.name}")
-
         _unknown_airports: set[str] = set()
         _flights = []
-        for _row in _rows:
-            _flight = _process_row(_row, _utc, _unknown_airports)
-            if _flight is not None:
-                _flights.append(_flight)
+        _dates = []
+        # Each monthly file covers the dates of its month.
+        for _month_dates in dates_by_month(schedule_dates(_utc, days)):
+            _path = PWD / _FILE_PATTERN.format(
+                month=_month_dates[0].format("MMM"),
+                year=_month_dates[0].format("YYYY"),
+            )
+            if not _path.exists():
+                logger.warning(
+                    f"Schedule file not found: {_path.name} — download from "
+                    f"https://www.aacargo.com/ship/schedules.html"
+                )
+                continue
+
+            _rows = flight_data_source.load_cached_schedule(
+                _path, _load_rows
+            ).to_dict("records")
+            logger.debug(f"Read {len(_rows)} rows from {_path.name}")
+            for _row in _rows:
+                _flights.extend(
+                    _process_row(_row, _month_dates, _unknown_airports)
+                )
+            _dates.extend(_month_dates)
+        if not _dates:
+            return
 
         for _iata in sorted(_unknown_airports):
             logger.warning(f"Unknown airport IATA: {_iata}")
 
-        _stored = 0
-        for _flight in _flights:
-            self.update_flight(_flight)
-            _stored += 1
+        _counts = flight_data_source.UpsertCounts.sum(
+            self.update_flights(_flights)
+        )
 
         logger.info(
-            f"AA Cargo: stored {_stored} flights for "
-            f"{_utc.format('YYYY-MM-DD')}."
+            f"AA Cargo: stored {_counts.flights} flights for "
+            f"{describe_dates(_dates)} ({_counts.upserted} new, "
+            f"{_counts.modified} modified)."
         )
 
 
@@ -203,10 +237,16 @@ if __name__ == "__main__":
         default=None,
         help="Target date in YYYY-MM-DD format (default: tomorrow UTC).",
     )
+    parser.add_argument(
+        "--days",
+        type=int,
+        default=1,
+        help="Number of days to import from the target date (default: 1).",
+    )
     args = parser.parse_args()
     _target = (
         arrow.get(args.date) if args.date else arrow.utcnow().shift(days=1)
     )
     logger.info(f"Targeting date: {_target.format('YYYY-MM-DD')}")
     airline = Airline()
-    airline.update_data(_target)
+    airline.update_data(_target, days=args.days)
@@ -2,7 +2,11 @@ import pathlib
 import math
 import logging
 import sqlite3
+import sys
+import time
 from functools import lru_cache
+from typing import NamedTuple
+import numpy as np
 
 PWD = pathlib.Path(__file__).resolve().parent
 URI = f"file:{PWD}/airports.sqb?mode=ro"
@@ -22,31 +26,266 @@ def get_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     return 6.370e6 * math.acos(max(-1.0, min(1.0, dot_product)))
 
 
-# 1 degree of latitude is approximately 111 km. The latitude window
-# is a fast pre-filter to avoid calling get_distance on every row.
-_LOCATION_QUERY = (
-    "SELECT *, CAST(DistanceBetween(?, ?, Latitude, Longitude) AS INTEGER)"
-    " AS Distance "
-    "FROM Airports "
-    "WHERE Latitude > ? - 1 AND Latitude < ? + 1{iata_filter} "
-    "ORDER BY Distance ASC LIMIT {limit}"
+_EARTH_RADIUS = 6.370e6
+# Number of positions compared against all airports at once in
+# get_nearest_airports_batch. Limits the size of the distance matrix.
+_BATCH_CHUNK_SIZE = 512
+
+
+# Serves get_airport_info, get_airport_icao and get_airport_iata from the
+# in-memory airport table instead of querying airports.sqb on cache misses.
+USE_AIRPORT_TABLE = True
+
+_AIRPORT_KEYS = (
+    "Name",
+    "City",
+    "Country",
+    "IATA",
+    "ICAO",
+    "Latitude",
+    "Longitude",
+    "Altitude",
+    "Timezone",
 )
 
 
+class _AirportIndex(NamedTuple):
+    records: list[tuple]
+    icao_positions: dict[str, int]
+    iata_positions: dict[str, int]
+    located: int
+    latitudes: np.ndarray
+    sin_latitudes: np.ndarray
+    cos_latitudes: np.ndarray
+    longitudes: np.ndarray
+    vectors: np.ndarray
+    iata: np.ndarray
+
+
+_airport_index = None
+
+
+def _unit_vectors(latitudes, longitudes) -> np.ndarray:
+    _lat = np.radians(np.asarray(latitudes, dtype=float))
+    _lon = np.radians(np.asarray(longitudes, dtype=float))
+    return np.stack(
+        (
+            np.cos(_lat) * np.cos(_lon),
+            np.cos(_lat) * np.sin(_lon),
+            np.sin(_lat),
+        ),
+        axis=-1,
+    )
+
+
+def _load_airport_index() -> _AirportIndex:
+    with sqlite3.connect(URI, uri=True) as connection:
+        cursor = connection.cursor()
+        cursor.execute(
+            "SELECT Name, City, Country, IATA, ICAO, Latitude, Longitude, "
+            "Altitude, Timezone FROM Airports ORDER BY rowid"
+        )
+        records = cursor.fetchall()
+        cursor.close()
+    latitudes = np.array([_row[5] for _row in records], dtype=float)
+    longitudes = np.array([_row[6] for _row in records], dtype=float)
+    _located = np.isfinite(latitudes) & np.isfinite(longitudes)
+    # Sorting by latitude allows to select latitude bands by bisection.
+    # Airports without coordinates are moved to the end. The stable sort
+    # keeps the rowid order of airports at equal latitude.
+    order = np.argsort(np.where(_located, latitudes, np.inf), kind="stable")
+    latitudes = latitudes[order]
+    longitudes = longitudes[order]
+    records = [
+        _row[:5]
+        + (_latitude, _longitude, _row[7])
+        + ((sys.intern(_row[8]) if _row[8] else _row[8]),)
+        for _row, _latitude, _longitude in zip(
+            (records[_i] for _i in order),
+            latitudes.tolist(),
+            longitudes.tolist(),
+        )
+    ]
+    icao_positions = {}
+    iata_positions = {}
+    # The first airport by rowid wins for duplicate codes, as it would in a
+    # query using the IATA index.
+    for _position in np.argsort(order).tolist():
+        _row = records[_position]
+        icao_positions.setdefault(_row[4], _position)
+        if _row[3]:
+            iata_positions.setdefault(_row[3], _position)
+    return _AirportIndex(
+        records=records,
+        icao_positions=icao_positions,
+        iata_positions=iata_positions,
+        located=int(_located.sum()),
+        latitudes=latitudes,
+        sin_latitudes=np.sin(np.radians(latitudes)),
+        cos_latitudes=np.cos(np.radians(latitudes)),
+        longitudes=longitudes,
+        vectors=_unit_vectors(latitudes, longitudes),
+        iata=np.array(
+            [len(_row[3] or "") == 3 for _row in records], dtype=bool
+        ),
+    )
+
+
+def _get_airport_index() -> _AirportIndex:
+    global _airport_index
+    if _airport_index is None:
+        _airport_index = _load_airport_index()
+    return _airport_index
+
+
+def reload_airport_data() -> None:
+    """Reloads the in-memory airport table and clears the query caches.
+    To be called by long-running processes after prepare_airport_data.py
+    has rewritten airports.sqb."""
+    global _airport_index
+    _airport_index = _load_airport_index()
+    _query_airport_by_icao.cache_clear()
+    _query_icao_by_iata.cache_clear()
+
+
+def _band_candidates(
+    index: _AirportIndex,
+    latitude: float,
+    longitude: float,
+    half_width: float,
+    iata_only: bool,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the index positions of all airports within the open latitude
+    band latitude +/- half_width together with their distances."""
+    _latitudes = index.latitudes[: index.located]
+    _start = np.searchsorted(_latitudes, latitude - half_width, "right")
+    _stop = np.searchsorted(_latitudes, latitude + half_width, "left")
+    positions = np.arange(_start, _stop)
+    if iata_only:
+        positions = positions[index.iata[_start:_stop]]
+    deg_rad = math.pi / 180
+    dot_product = math.sin(latitude * deg_rad) * index.sin_latitudes[
+        positions
+    ] + math.cos(latitude * deg_rad) * index.cos_latitudes[positions] * np.cos(
+        (index.longitudes[positions] - longitude) * deg_rad
+    )
+    distances = _EARTH_RADIUS * np.arccos(np.clip(dot_product, -1.0, 1.0))
+    return positions, distances
+
+
+def _airport_results(
+    index: _AirportIndex, positions: np.ndarray, distances: np.ndarray
+) -> list[dict]:
+    return [
+        dict(
+            zip(_AIRPORT_KEYS, index.records[_position]),
+            Distance=int(_distance),
+        )
+        for _position, _distance in zip(positions, distances)
+    ]
+
+
 def get_closest_airports(
     latitude: float, longitude: float, iata_only: bool = False
 ) -> list[dict]:
-    iata_filter = " AND LENGTH(IATA)=3" if iata_only else ""
+    """Returns the airports within +/-1 degree of latitude ordered by their
+    distance. The number of results is limited to 5 for iata_only and to
+    15 otherwise."""
     limit = 5 if iata_only else 15
-    query = _LOCATION_QUERY.format(iata_filter=iata_filter, limit=limit)
-    with sqlite3.connect(URI, uri=True) as connection:
-        connection.create_function("DistanceBetween", 4, get_distance)
-        connection.row_factory = sqlite3.Row
-        cursor = connection.cursor()
-        cursor.execute(query, (latitude, longitude, latitude, latitude))
-        results = cursor.fetchall()
-        cursor.close()
-    return [dict(_row) for _row in results]
+    index = _get_airport_index()
+    positions, distances = _band_candidates(
+        index, latitude, longitude, 1.0, iata_only
+    )
+    # Distances are compared as truncated integers in metres. Airports with
+    # equal distance keep their latitude order.
+    order = np.argsort(distances.astype(np.int64), kind="stable")[:limit]
+    return _airport_results(index, positions[order], distances[order])
+
+
+def get_nearest_airports(
+    latitude: float, longitude: float, k: int = 1, iata_only: bool = False
+) -> list[dict]:
+    """Returns the k airports nearest to the given position ordered by their
+    distance, regardless of how far away they are."""
+    index = _get_airport_index()
+    if k < 1 or latitude is None or longitude is None:
+        return []
+    # Airports outside of the latitude band are at least
+    # half_width * deg_rad * _EARTH_RADIUS away. The band is widened until
+    # the k nearest candidates inside of it are closer than that.
+    half_width = 1.0
+    while True:
+        positions, distances = _band_candidates(
+            index, latitude, longitude, half_width, iata_only
+        )
+        order = np.argsort(distances, kind="stable")[:k]
+        if half_width >= 180 or (
+            len(order) == k
+            and distances[order[-1]]
+            <= half_width * math.pi / 180 * _EARTH_RADIUS
+        ):
+            break
+        half_width *= 4
+    return _airport_results(index, positions[order], distances[order])
+
+
+def get_airports_within(
+    latitude: float, longitude: float, radius: float, iata_only: bool = False
+) -> list[dict]:
+    """Returns all airports within radius metres of the given position ordered
+    by their distance."""
+    index = _get_airport_index()
+    if latitude is None or longitude is None:
+        return []
+    # The small margin keeps airports exactly on the band border.
+    half_width = min(180.0, radius / _EARTH_RADIUS * 180 / math.pi + 1e-6)
+    positions, distances = _band_candidates(
+        index, latitude, longitude, half_width, iata_only
+    )
+    _selection = distances <= radius
+    positions = positions[_selection]
+    distances = distances[_selection]
+    order = np.argsort(distances, kind="stable")
+    return _airport_results(index, positions[order], distances[order])
+
+
+def get_nearest_airports_batch(
+    latitudes, longitudes, iata_only: bool = False
+) -> tuple[np.ndarray, np.ndarray]:
+    """Resolves the nearest airport for arrays of positions, e.g. all
+    positions of an OpenSky state snapshot. Returns an object array of ICAO
+    codes and an array of distances in metres. Positions containing NaN
+    yield None and NaN."""
+    index = _get_airport_index()
+    latitudes, longitudes = np.broadcast_arrays(
+        np.asarray(latitudes, dtype=float), np.asarray(longitudes, dtype=float)
+    )
+    shape = latitudes.shape
+    vectors = _unit_vectors(latitudes.ravel(), longitudes.ravel())
+    airport_positions = np.arange(index.located)
+    if iata_only:
+        airport_positions = airport_positions[index.iata[: index.located]]
+    airport_vectors = index.vectors[airport_positions]
+    icaos = np.full(vectors.shape[0], None, dtype=object)
+    distances = np.full(vectors.shape[0], np.nan)
+    valid = np.isfinite(vectors).all(axis=1)
+    if len(airport_vectors) == 0 or not valid.any():
+        return icaos.reshape(shape), distances.reshape(shape)
+    icao_codes = np.array(
+        [index.records[_position][4] for _position in airport_positions],
+        dtype=object,
+    )
+    _valid_rows = np.flatnonzero(valid)
+    for _start in range(0, len(_valid_rows), _BATCH_CHUNK_SIZE):
+        _rows = _valid_rows[_start : _start + _BATCH_CHUNK_SIZE]
+        # The nearest airport has the largest scalar product of unit vectors.
+        _dot = vectors[_rows] @ airport_vectors.T
+        _nearest = np.argmax(_dot, axis=1)
+        icaos[_rows] = icao_codes[_nearest]
+        distances[_rows] = _EARTH_RADIUS * np.arccos(
+            np.clip(_dot[np.arange(len(_rows)), _nearest], -1.0, 1.0)
+        )
+    return icaos.reshape(shape), distances.reshape(shape)
 
 
 def get_closest_airport(
@@ -85,20 +324,15 @@ def get_airport_info(icao: str) -> dict | None:
         raise ValueError(
             f"ICAO code must be a 4-character string, got: {icao!r}"
         )
+    if USE_AIRPORT_TABLE:
+        index = _get_airport_index()
+        position = index.icao_positions.get(icao)
+        if position is not None:
+            return dict(zip(_AIRPORT_KEYS, index.records[position]))
+        return None
     result = _query_airport_by_icao(icao)
     if result is not None:
-        keys = (
-            "Name",
-            "City",
-            "Country",
-            "IATA",
-            "ICAO",
-            "Latitude",
-            "Longitude",
-            "Altitude",
-            "Timezone",
-        )
-        airport = dict(zip(keys, result))
+        airport = dict(zip(_AIRPORT_KEYS, result))
         airport["Latitude"] = float(airport["Latitude"])
         airport["Longitude"] = float(airport["Longitude"])
         return airport
@@ -112,6 +346,10 @@ def get_airport_label(icao: str) -> str:
 
 
 def get_airport_iata(icao: str) -> str | None:
+    if USE_AIRPORT_TABLE and icao is not None and len(icao) == 4:
+        index = _get_airport_index()
+        position = index.icao_positions.get(icao)
+        return None if position is None else index.records[position][3]
     result = get_airport_info(icao)
     if result is not None:
         return result["IATA"]
@@ -122,7 +360,63 @@ def get_airport_icao(iata: str) -> str | None:
         raise ValueError(
             f"IATA code must be a 3-character string, got: {iata!r}"
         )
-    result = _query_icao_by_iata(iata)
+    if USE_AIRPORT_TABLE:
+        index = _get_airport_index()
+        position = index.iata_positions.get(iata)
+        result = None if position is None else index.records[position][4]
+    else:
+        result = _query_icao_by_iata(iata)
     if result is None:
         logger.warning(f"{iata} is unknown to database and may be a station.")
     return result
+
+
+def get_iata_airports() -> list[tuple[str, str, str | None]]:
+    """Returns (IATA, ICAO, Timezone) of all airports with an IATA code as
+    resolved by get_airport_icao, for bulk lookups."""
+    index = _get_airport_index()
+    return [
+        (_iata, index.records[_position][4], index.records[_position][8])
+        for _iata, _position in index.iata_positions.items()
+    ]
+
+
+def _benchmark(repetitions: int = 20) -> None:
+    global USE_AIRPORT_TABLE
+    index = _get_airport_index()
+    icaos = list(index.icao_positions)
+    iatas = list(index.iata_positions)
+    for _mode in (False, True):
+        USE_AIRPORT_TABLE = _mode
+        _query_airport_by_icao.cache_clear()
+        _query_icao_by_iata.cache_clear()
+        _start = time.perf_counter()
+        for _icao in icaos:
+            get_airport_info(_icao)
+        for _iata in iatas:
+            get_airport_icao(_iata)
+        _cold = time.perf_counter() - _start
+        _start = time.perf_counter()
+        for _ in range(repetitions):
+            for _icao in icaos:
+                get_airport_info(_icao)
+                get_airport_iata(_icao)
+            for _iata in iatas:
+                get_airport_icao(_iata)
+        _warm = (time.perf_counter() - _start) / repetitions
+        _lookups = 2 * len(icaos) + len(iatas)
+        logger.info(
+            f"{'airport table' if _mode else 'lru_cache'}: "
+            f"first pass {_cold:.3f}s, "
+            f"{_warm / _lookups * 1e6:.2f} us per cached lookup."
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    _start = time.perf_counter()
+    reload_airport_data()
+    logger.info(
+        f"airport table loaded in {time.perf_counter() - _start:.3f}s."
+    )
+    _benchmark()
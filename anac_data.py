@@ -1,10 +1,16 @@
 #!/usr/bin/env python3
 import csv
+import itertools
 import logging
 import pathlib
 import arrow
 import requests
 from airline_info import get_airline_iata
+from schedule_utils import (
+    describe_dates,
+    drop_multi_segment_totals,
+    schedule_dates,
+)
 import flight_data_source
 
 URL = "https://siros.anac.gov.br/siros/registros/diario/diario.csv"
@@ -28,23 +34,28 @@ class Agency(flight_data_source.FlightDataSource):
         super().__init__("ANAC", category="agencies")
         self.allow_alphanumerical_candidates = False
 
-    def update_data(self, utc=None) -> None:
+    def update_data(self, utc=None, days: int = 1) -> None:
         if utc is None:
             _utc = arrow.utcnow()
         else:
             _utc = arrow.get(utc)
+        _dates = schedule_dates(_utc, days)
 
         rows = _fetch_schedule()
-        flights = []
+        flights = {_date.format("YYYYMMDD"): [] for _date in _dates}
         _unknown_airlines: dict[str, str] = {}
 
         for _row in rows:
             _start_operation = arrow.get(_row["Início Operação"])
             _end_operation = arrow.get(_row["Fim Operação"]).ceil("day")
-            if not _start_operation <= _utc <= _end_operation:
-                continue
             _frequency = "".join([_row[_day] for _day in _day_labels])
-            if str(_utc.isoweekday()) not in _frequency:
+            _operating_days = [
+                _day
+                for _day, _date in enumerate(_dates)
+                if _start_operation <= _date <= _end_operation
+                and str(_date.isoweekday()) in _frequency
+            ]
+            if not _operating_days:
                 continue
             _airline_icao = _row["Cód. Empresa"]
             _airline_iata = get_airline_iata(_airline_icao)
@@ -58,48 +69,63 @@ class Agency(flight_data_source.FlightDataSource):
             _origin = _row["Cód Origem"]
             _destination = _row["Cód Destino"]
             _date = _utc.format("YYYY-MM-DD")
-            # Times are already UTC as stated in the file header.
+            # Times are already UTC as stated in the file header, so the
+            # times of the other dates are whole days apart.
             _departure = arrow.get(f"{_date}T{_row['Partida Prevista']}")
             _arrival = arrow.get(f"{_date}T{_row['Chegada Prevista']}")
             if _departure > _arrival:
                 _arrival = _arrival.shift(days=1)
+            _departure = int(_departure.timestamp())
+            _arrival = int(_arrival.timestamp())
             _route = f"{_origin}-{_destination}"
-            flights.append(
-                {
-                    "_id": f"{_airline_iata}_{_flight_number}_{_route}_{_utc.format('YYYYMMDD')}",
-                    "airline_iata": _airline_iata,
-                    "airline_icao": _airline_icao,
-                    "flight_number": _flight_number,
-                    "route": _route,
-                    "departure": int(_departure.timestamp()),
-                    "arrival": int(_arrival.timestamp()),
-                    "segment_number": _segment_number,
-                }
-            )
+            for _day in _operating_days:
+                _yyyymmdd = _dates[_day].format("YYYYMMDD")
+                flights[_yyyymmdd].append(
+                    {
+                        "_id": f"{_airline_iata}_{_flight_number}_{_route}_{_yyyymmdd}",
+                        "airline_iata": _airline_iata,
+                        "airline_icao": _airline_icao,
+                        "flight_number": _flight_number,
+                        "route": _route,
+                        "departure": _departure + _day * 86400,
+                        "arrival": _arrival + _day * 86400,
+                        "segment_number": _segment_number,
+                    }
+                )
 
         # Filter out segment-0 records for flights that have higher-numbered
-        # segments, consistent with lh_cargo_data.py handling.
-        _multi_segment = {
-            (_flight["airline_iata"], _flight["flight_number"])
-            for _flight in flights
-            if _flight["segment_number"] > 0
-        }
-        for _flight in flights:
-            if (
-                _flight["airline_iata"],
-                _flight["flight_number"],
-            ) in _multi_segment and _flight["segment_number"] == 0:
-                continue
-            self.update_flight(_flight)
+        # segments per date, consistent with lh_cargo_data.py handling.
+        _counts = flight_data_source.UpsertCounts.sum(
+            self.update_flights(
+                itertools.chain.from_iterable(
+                    drop_multi_segment_totals(_date_flights)
+                    for _date_flights in flights.values()
+                )
+            )
+        )
 
         for _icao, _name in sorted(_unknown_airlines.items()):
             logger.warning(f"unknown airline ICAO: {_icao} ({_name}), skipping")
         logger.info(
-            f"ANAC: processed {len(flights)} flights for {_utc.format('YYYY-MM-DD')}"
+            f"ANAC: processed {sum(map(len, flights.values()))} flights for "
+            f"{describe_dates(_dates)}, stored {_counts.flights} "
+            f"({_counts.upserted} new, {_counts.modified} modified)."
         )
 
 
 if __name__ == "__main__":
+    import argparse
+
     logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Import the ANAC flight schedule into MongoDB."
+    )
+    parser.add_argument(
+        "--days",
+        type=int,
+        default=1,
+        help="Number of days to import starting tomorrow (default: 1).",
+    )
+    args = parser.parse_args()
     agency = Agency()
-    agency.update_data(arrow.utcnow().shift(days=1))
+    agency.update_data(arrow.utcnow().shift(days=1), days=args.days)
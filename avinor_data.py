@@ -1,7 +1,11 @@
 #!/usr/bin/env python3
+import os
+import json
 import logging
 import pathlib
-from itertools import permutations
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+from xml.parsers.expat import ExpatError
 import arrow
 import requests
 import xmltodict
@@ -57,6 +61,10 @@ avinor_airports_iata = (
 )
 
 URL = "https://asrv.avinor.no/XmlFeed/v1.0"
+_TIMEOUT = 10
+PWD = pathlib.Path(__file__).resolve().parent
+# Validators and flights of the last received feed of each airport.
+FEEDS_FILE = PWD / "avinor_feeds.json"
 logger = logging.getLogger(pathlib.Path(__file__).name)
 
 
@@ -88,139 +96,277 @@ _status_codes = {
 }
 
 
-def request_airport_data(airport_iata):
-    airport_icao = get_airport_icao(airport_iata)
-    params = {"airport": airport_iata, "TimeTo": 36, "TimeFrom": 36}
-    response = requests.get(URL, params=params, timeout=10)
-    # force_list ensures a single flight is still returned as a list,
-    # not a dict, which would cause xmltodict to iterate over key names.
-    data = xmltodict.parse(response.text, force_list={"flight": True})
-    _flights_el = data["airport"].get("flights")
-    flight_list = (
-        _flights_el.get("flight") if isinstance(_flights_el, dict) else None
-    )
-    if flight_list is None:
-        logger.debug(f"{airport_iata}: no flights")
-        return
-    logger.debug(f"{airport_iata}: {len(flight_list)} flights")
-    for flight in flight_list:
-        if not isinstance(flight, dict):
-            continue
-        airline = flight["airline"]
-        if flight["flight_id"][2:].isdigit():
-            flight_number = int(flight["flight_id"][2:])
-        elif flight["flight_id"][3:].isdigit():
-            flight_number = int(flight["flight_id"][3:])
-        else:
-            continue
-        if len(airline) == 3:
-            operator_icao = airline
-            operator_iata = get_airline_iata(operator_icao)
-        elif len(airline) == 2:
-            operator_iata = airline
-            operator_icao = get_airline_icao(
-                airline, flight_number=flight_number
+def _process_flight(flight, airport_iata, airport_icao):
+    # Empty flight elements are parsed as None.
+    if not isinstance(flight, dict):
+        return None
+    airline = flight["airline"]
+    if flight["flight_id"][2:].isdigit():
+        flight_number = int(flight["flight_id"][2:])
+    elif flight["flight_id"][3:].isdigit():
+        flight_number = int(flight["flight_id"][3:])
+    else:
+        return None
+    if len(airline) == 3:
+        operator_icao = airline
+        operator_iata = get_airline_iata(operator_icao)
+    elif len(airline) == 2:
+        operator_iata = airline
+        operator_icao = get_airline_icao(airline, flight_number=flight_number)
+    else:
+        return None
+    if operator_iata == "QF":
+        operator_icao = "QFA"
+    elif operator_iata == "BA":
+        operator_icao = "BAW"
+    elif operator_iata == "NO":
+        operator_icao = "NOS"
+    elif operator_iata == "C3":
+        operator_icao = "TDR"
+    elif operator_iata == "4Y":
+        operator_icao = "BGA"
+    elif operator_icao == "WGH":
+        return None
+    if None in (operator_icao, operator_iata):
+        logger.warning(
+            "operator information incomplete {}, {}, {}".format(
+                operator_icao, operator_iata, flight["flight_id"]
             )
-        else:
-            continue
-        if operator_iata == "QF":
-            operator_icao = "QFA"
-        elif operator_iata == "BA":
-            operator_icao = "BAW"
-        elif operator_iata == "NO":
-            operator_icao = "NOS"
-        elif operator_iata == "C3":
-            operator_icao = "TDR"
-        elif operator_iata == "4Y":
-            operator_icao = "BGA"
-        elif operator_icao == "WGH":
-            continue
-        if None in (operator_icao, operator_iata):
-            logger.warning(
-                "operator information incomplete {}, {}, {}".format(
-                    operator_icao, operator_iata, flight["flight_id"]
+        )
+        return None
+    other_airport_iata = flight["airport"]
+    other_airport_icao = get_airport_icao(other_airport_iata)
+    if other_airport_icao is None:
+        logger.warning(
+            "missing airport icao for {}".format(other_airport_iata)
+        )
+    stopovers_iata = flight.get("via_airport")
+    stopovers_icao = []
+    if stopovers_iata is not None:
+        for stopover_iata in stopovers_iata.split(","):
+            stopover_icao = get_airport_icao(stopover_iata.strip())
+            stopovers_icao.append(stopover_icao)
+            if stopover_icao is None:
+                logger.warning(
+                    "missing airport icao for {}".format(stopover_iata)
                 )
+    direction = flight["arr_dep"]
+    if any(
+        _icao is None
+        for _icao in stopovers_icao + [other_airport_icao, airport_icao]
+    ):
+        return None
+    response = {
+        "airline_iata": operator_iata,
+        "airline_icao": operator_icao,
+        "flight_number": flight_number,
+    }
+    if "status" in flight:
+        response["status"] = _status_codes[flight["status"]["@code"]]
+    route_items = []
+    if direction == "A":
+        route_items = [other_airport_icao] + stopovers_icao + [airport_icao]
+        _date, _arrival = _get_date_and_time(flight)
+        if _date is None:
+            return None
+        response["arrival"] = _arrival
+    elif direction == "D":
+        route_items = [airport_icao] + stopovers_icao + [other_airport_icao]
+        _date, _departure = _get_date_and_time(flight)
+        if _date is None:
+            return None
+        response["departure"] = _departure
+    else:
+        return None
+    response["route"] = "-".join(route_items)
+    response["_id"] = "{}_{}_{}_{}".format(
+        operator_iata, flight_number, _date, response["route"]
+    )
+    return response
+
+
+def _parse_airport_data(airport_iata, xml_input) -> list[dict]:
+    """Parses the XML feed of an airport from a string or a binary file
+    object. The flights are converted one by one while the document is
+    read, without building the whole document first."""
+    airport_icao = get_airport_icao(airport_iata)
+    flights = []
+
+    def _handle_flight(_path, flight):
+        _flight = _process_flight(flight, airport_iata, airport_icao)
+        if _flight is not None:
+            flights.append(_flight)
+        return True
+
+    xmltodict.parse(xml_input, item_depth=3, item_callback=_handle_flight)
+    logger.debug(f"{airport_iata}: {len(flights)} flights")
+    return flights
+
+
+def _request_params(airport_iata) -> dict:
+    return {"airport": airport_iata, "TimeTo": 36, "TimeFrom": 36}
+
+
+def request_airport_data(airport_iata):
+    response = requests.get(
+        URL, params=_request_params(airport_iata), timeout=_TIMEOUT
+    )
+    yield from _parse_airport_data(airport_iata, response.text)
+
+
+class _Feed(NamedTuple):
+    etag: str | None
+    last_modified: str | None
+    flights: list[dict]
+
+
+def _load_feeds() -> dict[str, _Feed]:
+    try:
+        with open(FEEDS_FILE, encoding="utf-8") as _f:
+            return {
+                _iata: _Feed(**_feed) for _iata, _feed in json.load(_f).items()
+            }
+    except FileNotFoundError:
+        return {}
+    except (ValueError, TypeError):
+        logger.warning(f"Ignoring invalid {FEEDS_FILE.name}.")
+        return {}
+
+
+def _save_feeds(feeds: dict[str, _Feed]) -> None:
+    _staging = FEEDS_FILE.with_suffix(f".{os.getpid()}.tmp")
+    with open(_staging, "w", encoding="utf-8") as _f:
+        json.dump(
+            {_iata: _feed._asdict() for _iata, _feed in feeds.items()}, _f
+        )
+    os.replace(_staging, FEEDS_FILE)
+
+
+def _fetch_airport_feed(session, airport_iata, feed: _Feed | None) -> _Feed:
+    """Requests the feed of an airport unless it is unchanged since the
+    cached feed was received."""
+    _headers = {}
+    if feed is not None and feed.etag is not None:
+        _headers["If-None-Match"] = feed.etag
+    if feed is not None and feed.last_modified is not None:
+        _headers["If-Modified-Since"] = feed.last_modified
+    with session.get(
+        URL,
+        params=_request_params(airport_iata),
+        headers=_headers,
+        timeout=_TIMEOUT,
+        stream=True,
+    ) as response:
+        if response.status_code == 304 and feed is not None:
+            logger.debug(f"{airport_iata}: unchanged")
+            return feed
+        response.raise_for_status()
+        response.raw.decode_content = True
+        return _Feed(
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+            _parse_airport_data(airport_iata, response.raw),
+        )
+
+
+def fetch_airport_feeds(
+    airports_iata, feeds: dict[str, _Feed], workers: int = 8, session=None
+) -> dict[str, _Feed]:
+    """Fetches the feeds of all airports concurrently over one pooled
+    session. The cached feed of an airport is kept if its request fails."""
+    if session is None:
+        session = requests.Session()
+        session.mount(
+            "https://",
+            requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=workers
+            ),
+        )
+    updated = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        _futures = {
+            _iata: executor.submit(
+                _fetch_airport_feed, session, _iata, feeds.get(_iata)
             )
-            continue
-        other_airport_iata = flight["airport"]
-        other_airport_icao = get_airport_icao(other_airport_iata)
-        if other_airport_icao is None:
-            logger.warning(
-                "missing airport icao for {}".format(other_airport_iata)
-            )
-        stopovers_iata = flight.get("via_airport")
-        stopovers_icao = []
-        if stopovers_iata is not None:
-            for stopover_iata in stopovers_iata.split(","):
-                stopover_icao = get_airport_icao(stopover_iata.strip())
-                stopovers_icao.append(stopover_icao)
-                if stopover_icao is None:
-                    logger.warning(
-                        "missing airport icao for {}".format(stopover_iata)
-                    )
-        direction = flight["arr_dep"]
-        if any(
-            _icao is None
-            for _icao in stopovers_icao + [other_airport_icao, airport_icao]
-        ):
-            continue
-        response = {
-            "airline_iata": operator_iata,
-            "airline_icao": operator_icao,
-            "flight_number": flight_number,
+            for _iata in airports_iata
         }
-        if "status" in flight:
-            response["status"] = _status_codes[flight["status"]["@code"]]
-        route_items = []
-        if direction == "A":
-            route_items = [other_airport_icao] + stopovers_icao + [airport_icao]
-            _date, _arrival = _get_date_and_time(flight)
-            if _date is None:
-                continue
-            response["arrival"] = _arrival
-        elif direction == "D":
-            route_items = [airport_icao] + stopovers_icao + [other_airport_icao]
-            _date, _departure = _get_date_and_time(flight)
-            if _date is None:
-                continue
-            response["departure"] = _departure
-        else:
+        for _iata, _future in _futures.items():
+            try:
+                updated[_iata] = _future.result()
+            except (requests.RequestException, ExpatError) as e:
+                logger.warning(f"{_iata}: request failed: {e}")
+                if _iata in feeds:
+                    updated[_iata] = feeds[_iata]
+    return updated
+
+
+def _mark_redundant(flights) -> None:
+    """Marks the flights whose route is a contiguous part of the route of
+    another flight of the same set. Routes are visited from the longest, so
+    only the parts of routes not already covered need to be collected."""
+    _parts = set()
+    for _flight in sorted(
+        flights, key=lambda _f: _f["route"].count("-"), reverse=True
+    ):
+        _airports = tuple(_flight["route"].split("-"))
+        if _airports in _parts:
+            _flight["redundant"] = True
             continue
-        response["route"] = "-".join(route_items)
-        response["_id"] = "{}_{}_{}_{}".format(
-            operator_iata, flight_number, _date, response["route"]
+        _count = len(_airports)
+        _parts.update(
+            _airports[_begin:_end]
+            for _begin in range(_count - 1)
+            for _end in range(_begin + 2, _count + 1)
+            if _end - _begin < _count
         )
-        yield response
 
 
 class Airport(flight_data_source.FlightDataSource):
     def __init__(self):
         super().__init__("Avinor")
 
-    def update_data(self):
+    def update_data(self, workers: int = 8):
+        feeds = fetch_airport_feeds(
+            avinor_airports_iata, _load_feeds(), workers=workers
+        )
+        _save_feeds(feeds)
         all_flights = {}
         for _airport_iata in avinor_airports_iata:
-            logger.debug(f"fetching {_airport_iata}")
-            for _flight in request_airport_data(_airport_iata):
+            if _airport_iata not in feeds:
+                continue
+            for _flight in feeds[_airport_iata].flights:
                 _key = _flight["_id"].replace(_flight["route"], "")
                 all_flights.setdefault(_key, {})
                 all_flights[_key].setdefault(_flight["_id"], {})
                 all_flights[_key][_flight["_id"]].update(_flight)
         for _flight_set in all_flights.values():
-            for _flight1, _flight2 in permutations(_flight_set.values(), 2):
-                if _flight2["route"] == _flight1["route"]:
-                    pass
-                elif _flight2["route"].startswith(_flight1["route"]):
-                    _flight1["redundant"] = True
-                elif _flight2["route"].endswith(_flight1["route"]):
-                    _flight1["redundant"] = True
-                elif _flight1["route"] in _flight2["route"]:
-                    _flight1["redundant"] = True
-            for _flight in _flight_set.values():
-                self.update_flight(_flight)
+            _mark_redundant(_flight_set.values())
+        _counts = flight_data_source.UpsertCounts.sum(
+            self.update_flights(
+                _flight
+                for _flight_set in all_flights.values()
+                for _flight in _flight_set.values()
+            )
+        )
+        logger.info(
+            f"Avinor: stored {_counts.flights} flights ({_counts.upserted} "
+            f"new, {_counts.modified} modified)."
+        )
 
 
 if __name__ == "__main__":
+    import argparse
+
     logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Import the Avinor flight feeds into MongoDB."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="number of airport feeds fetched concurrently (default: 8)",
+    )
+    args = parser.parse_args()
     airport = Airport()
-    airport.update_data()
+    airport.update_data(workers=args.workers)
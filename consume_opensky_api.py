@@ -1,5 +1,4 @@
 # encoding=utf8
-import json
 import time
 import arrow
 import redis
@@ -7,7 +6,12 @@ import requests
 import logging
 
 from opensky_api import OpenSkyApi, TokenManager
-from opensky_utils import validated_position, update_icao24s_from_redis
+from opensky_utils import (
+    validated_positions,
+    update_icao24s_from_redis,
+    registration_resolver,
+)
+from opensky_positions import PositionPublisher
 
 from config import *
 
@@ -23,16 +27,20 @@ class OpenSkyApiConsumer:
 
     def __init__(self):
         self._initialize_connection()
+        # The position deltas contain binary data.
+        self.publisher = PositionPublisher(redis.Redis(host=REDIS_HOST))
 
     def _initialize_connection(self):
         self.api = OpenSkyApi(
             token_manager=TokenManager.from_json_file("credentials.json")
         )
 
-    def worker(self, interval=45):
+    def worker(self, interval=45, json_compatible=True):
+        # With json_compatible, the JSON snapshot is stored next to the
+        # position deltas for consumers not reading them yet.
+        self.publisher.json_compatible = json_compatible
         while True:
             update_icao24s_from_redis()
-            positions = {}
             t_start = arrow.utcnow()
             self.logger.info(
                 "UTC {}".format(t_start.format("YYYY-MM-DD HH:mm:ss"))
@@ -62,43 +70,43 @@ class OpenSkyApiConsumer:
                 continue
             t_data_received = arrow.utcnow()
 
-            for _state in _all_states:
-                position = validated_position(
-                    _state,
-                    accepted_operators=None,
-                    allow_numerical_callsign=True,
-                    allow_alphanumerical_callsign=True,
-                    allow_on_ground=False,
-                )
-                if position is None:
-                    continue
-                age = states_time - position["time_position"]
-                if age > 60:
-                    continue
-                callsign = position["callsign"]
-                positions[callsign] = position
+            positions = validated_positions(
+                _all_states,
+                states_time,
+                max_age=60,
+                accepted_operators=None,
+                allow_numerical_callsign=True,
+                allow_alphanumerical_callsign=True,
+                allow_on_ground=False,
+            )
+            t_data_validated = arrow.utcnow()
             try:
-                self.redis_connection.set(
-                    "opensky_positions",
-                    json.dumps(
-                        {"positions": positions, "states_time": states_time}
-                    ),
-                )
+                self.publisher.publish(positions, states_time)
             except (
                 redis.exceptions.TimeoutError,
                 redis.exceptions.ConnectionError,
             ):
                 self.logger.exception("Cannot store positions in redis db.")
+                self.publisher.reset()
             t_data_processed = arrow.utcnow()
             duration_receiving = (t_data_received - t_start).total_seconds()
+            duration_validating = (
+                t_data_validated - t_data_received
+            ).total_seconds()
             duration_processing = (
                 t_data_processed - t_data_received
             ).total_seconds()
             duration_total = (t_data_processed - t_start).total_seconds()
             self.logger.info(
-                "{} states received ({:.1f}s) and processed ({:.1f}s)."
+                "{} states received ({:.1f}s) and processed ({:.1f}s), "
+                "{} positions validated ({:.3f}s), {} registrations pending."
                 "".format(
-                    len(_all_states), duration_receiving, duration_processing
+                    len(_all_states),
+                    duration_receiving,
+                    duration_processing,
+                    len(positions),
+                    duration_validating,
+                    len(registration_resolver),
                 )
             )
             time.sleep(max(0, interval - duration_total))
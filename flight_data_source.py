@@ -1,18 +1,238 @@
+import hashlib
+import io
+import itertools
+import logging
+import os
+import pathlib
+import time
+import zipfile
+from typing import Callable, NamedTuple
+import numpy as np
+import pandas as pd
 import pymongo
 import arrow
 from route_utils import estimate_max_flight_duration, get_route_length
 
+# Number of flights sent to MongoDB in one bulk_write by update_flights().
+BULK_WRITE_CHUNK_SIZE = 1000
+# Flights are searched within this time from their departure or arrival.
+_SEARCH_WINDOW = 24 * 3600
+# Scheduled times without the other end are accepted this early or late.
+_SCHEDULE_TOLERANCE = 300
+# Name of the partial index on the active windows of non-redundant flights.
+ACTIVE_WINDOW_INDEX = "active_window"
+# Seconds between checks of the collection version by get_active_flights().
+VERSION_CHECK_INTERVAL = 60.0
+# Flights ending up to this long before the requested time are cached too.
+_CACHE_MARGIN = 3600
+# Database holding the version counters of the flight collections.
+VERSIONS_DATABASE = "flight_data_sources"
+# Directory of the parsed schedule files cached by load_cached_schedule().
+SCHEDULE_CACHE_DIRECTORY = (
+    pathlib.Path(__file__).resolve().parent / "schedule_cache"
+)
+# Fields used by the matcher, returned by get_active_flights().
+ACTIVE_FLIGHT_PROJECTION = {
+    "airline_iata": True,
+    "airline_icao": True,
+    "flight_number": True,
+    "route": True,
+    "departure": True,
+    "arrival": True,
+    "status": True,
+}
 
-def _in_bounds(flight, utc):
+logger = logging.getLogger(__name__)
+
+
+def _active_window(flight) -> tuple[float, float] | None:
+    """Returns the interval in which a flight is considered airborne. Flights
+    with a single scheduled time use the estimated maximum flight duration
+    of their route for the other end."""
     _departure = flight.get("departure")
     _arrival = flight.get("arrival")
-    _length = get_route_length(flight["route"])
     if _departure is not None and _arrival is not None:
-        return _departure < utc < _arrival
-    elif _departure is not None:
-        return _departure + estimate_max_flight_duration(_length) > utc
-    elif _arrival is not None:
-        return _arrival - estimate_max_flight_duration(_length) < utc
+        return _departure, _arrival
+    if _departure is None and _arrival is None:
+        return None
+    _max_duration = min(
+        estimate_max_flight_duration(get_route_length(flight["route"])),
+        _SEARCH_WINDOW,
+    )
+    if _departure is not None:
+        return _departure - _SCHEDULE_TOLERANCE, _departure + _max_duration
+    return _arrival - _max_duration, _arrival + _SCHEDULE_TOLERANCE
+
+
+def _flight_update(flight) -> dict:
+    """Returns the update storing a flight together with its active window.
+    Redundant flights get no window and are left out of the partial index."""
+    _window = None if flight.get("redundant") else _active_window(flight)
+    if _window is None:
+        return {
+            "$set": flight,
+            "$unset": {"active_from": "", "active_until": ""},
+        }
+    return {
+        "$set": dict(flight, active_from=_window[0], active_until=_window[1])
+    }
+
+
+class _ActiveFlightIndex(NamedTuple):
+    version: int
+    # Flights ending before this time are not included.
+    since: float
+    # Window starts in ascending order, window ends in the same order.
+    starts: np.ndarray
+    ends: np.ndarray
+    max_length: float
+    flights: list[dict]
+
+
+def _active_index_filter(since) -> dict:
+    return {
+        "active_until": {"$gt": since},
+        "redundant": {"$exists": False},
+    }
+
+
+def _load_active_index(collection, version: int, since) -> _ActiveFlightIndex:
+    """Reads the flights with a window ending after since into an index
+    sorted by window start."""
+    flights = list(
+        collection.find(
+            _active_index_filter(since),
+            dict(
+                ACTIVE_FLIGHT_PROJECTION, active_from=True, active_until=True
+            ),
+        )
+    )
+    starts = np.array(
+        [_flight.pop("active_from") for _flight in flights], dtype=float
+    )
+    ends = np.array(
+        [_flight.pop("active_until") for _flight in flights], dtype=float
+    )
+    _order = np.argsort(starts, kind="stable")
+    return _ActiveFlightIndex(
+        version=version,
+        since=since,
+        starts=starts[_order],
+        ends=ends[_order],
+        max_length=float((ends - starts).max()) if len(flights) else 0.0,
+        flights=[flights[_i] for _i in _order.tolist()],
+    )
+
+
+def _query_active_index(index: _ActiveFlightIndex, utc) -> list[dict]:
+    """Returns copies of the flights with active_from < utc < active_until.
+    Only windows starting less than the longest window before utc need to
+    be checked."""
+    _begin = index.starts.searchsorted(utc - index.max_length, side="right")
+    _end = index.starts.searchsorted(utc, side="left")
+    _active = np.flatnonzero(index.ends[_begin:_end] > utc) + _begin
+    return [dict(index.flights[_i]) for _i in _active.tolist()]
+
+
+def _schedule_digest(path: pathlib.Path, load: Callable, args: tuple) -> str:
+    """Hashes the content of a schedule file together with the loader and
+    its arguments, which determine the parsed rows."""
+    _hash = hashlib.sha256(
+        f"{load.__module__}.{load.__qualname__}{args!r}".encode()
+    )
+    with open(path, "rb") as _f:
+        for _chunk in iter(lambda: _f.read(1 << 20), b""):
+            _hash.update(_chunk)
+    return _hash.hexdigest()
+
+
+def _schedule_arrays(schedule: pd.DataFrame) -> dict[str, np.ndarray] | None:
+    """Returns the columns of a schedule as arrays for np.savez, None if a
+    column cannot be stored without pickling."""
+    arrays = {"columns": np.array(list(schedule.columns), dtype=str)}
+    for _i, (_name, _column) in enumerate(schedule.items()):
+        _values = _column.to_numpy()
+        if _values.dtype.kind not in "biufmM":
+            if not all(isinstance(_value, str) for _value in _values):
+                return None
+            _values = np.array(_values.tolist(), dtype=str)
+        arrays[f"column_{_i}"] = _values
+    return arrays
+
+
+def _read_schedule_cache(cache_path: pathlib.Path) -> pd.DataFrame:
+    with np.load(cache_path) as _data:
+        _columns = _data["columns"].tolist()
+        return pd.DataFrame(
+            {
+                _name: _data[f"column_{_i}"]
+                for _i, _name in enumerate(_columns)
+            },
+            columns=_columns,
+        )
+
+
+def _write_schedule_cache(
+    cache_path: pathlib.Path, arrays: dict[str, np.ndarray]
+) -> None:
+    """Writes the arrays to a .npz file, replacing it atomically, and removes
+    the entries of older versions of the same schedule file."""
+    _buffer = io.BytesIO()
+    np.savez(_buffer, **arrays)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    _staging = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+    with open(_staging, "wb") as _f:
+        _f.write(_buffer.getbuffer())
+    os.replace(_staging, cache_path)
+    _source_name = cache_path.name.rsplit(".", 2)[0]
+    for _stale in cache_path.parent.glob(f"{_source_name}.*.npz"):
+        if _stale != cache_path:
+            _stale.unlink(missing_ok=True)
+
+
+def load_cached_schedule(
+    path: pathlib.Path,
+    load: Callable[..., pd.DataFrame],
+    *args,
+    cache_directory: pathlib.Path | None = None,
+) -> pd.DataFrame:
+    """Returns load(path, *args), the parsed rows of a schedule file. The
+    rows are cached as .npz keyed by the hash of the file content, so an
+    unchanged file is not parsed again."""
+    if cache_directory is None:
+        cache_directory = SCHEDULE_CACHE_DIRECTORY
+    _digest = _schedule_digest(path, load, args)
+    cache_path = cache_directory / f"{path.name}.{_digest[:32]}.npz"
+    if cache_path.exists():
+        try:
+            schedule = _read_schedule_cache(cache_path)
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+            logger.warning(f"Ignoring schedule cache {cache_path.name}: {e}")
+        else:
+            logger.info(f"Schedule cache hit for {path.name}.")
+            return schedule
+    logger.info(f"Schedule cache miss for {path.name}, parsing.")
+    schedule = load(path, *args)
+    _arrays = _schedule_arrays(schedule)
+    if _arrays is None:
+        logger.warning(f"Schedule of {path.name} cannot be cached.")
+        return schedule
+    try:
+        _write_schedule_cache(cache_path, _arrays)
+    except OSError as e:
+        logger.warning(f"Failed to write schedule cache for {path.name}: {e}")
+    return schedule
+
+
+class UpsertCounts(NamedTuple):
+    flights: int = 0
+    matched: int = 0
+    modified: int = 0
+    upserted: int = 0
+
+    @classmethod
+    def sum(cls, counts) -> "UpsertCounts":
+        return cls(*(sum(_values) for _values in zip(cls(), *counts)))
 
 
 class FlightDataSource:
@@ -21,38 +241,70 @@ class FlightDataSource:
         self.myclient = pymongo.MongoClient("mongodb://localhost:27017/")
         self.mydb = self.myclient[category]
         self.mycol = self.mydb[self.source.lower()]
+        self._versions = self.myclient[VERSIONS_DATABASE]["versions"]
+        self._version_key = f"{category}.{self.mycol.name}"
+        self._active_index = None
+        self._next_version_check = 0.0
         if "departure_1" not in self.mycol.index_information():
             self.mycol.create_index("departure")
         if "arrival_1" not in self.mycol.index_information():
             self.mycol.create_index("arrival")
+        if ACTIVE_WINDOW_INDEX not in self.mycol.index_information():
+            self.backfill_active_windows()
+            self.mycol.create_index(
+                [("active_until", 1), ("active_from", 1)],
+                name=ACTIVE_WINDOW_INDEX,
+                partialFilterExpression={"active_until": {"$exists": True}},
+            )
         self.allow_numerical_candidates = False
         self.allow_alphanumerical_candidates = True
 
     def update_data(self):
         pass
 
+    def _get_version(self) -> int:
+        _document = self._versions.find_one({"_id": self._version_key})
+        return 0 if _document is None else _document["version"]
+
+    def _increase_version(self) -> None:
+        """Invalidates the cached active flights of all processes."""
+        self._versions.update_one(
+            {"_id": self._version_key}, {"$inc": {"version": 1}}, upsert=True
+        )
+        self._active_index = None
+
+    def _get_active_index(self, utc) -> _ActiveFlightIndex:
+        _now = time.monotonic()
+        _index = self._active_index
+        if (
+            _index is not None
+            and _now < self._next_version_check
+            and utc >= _index.since
+        ):
+            return _index
+        # The version is read before the flights, a concurrent write is
+        # detected by the next check.
+        _version = self._get_version()
+        self._next_version_check = _now + VERSION_CHECK_INTERVAL
+        if _index is None or _index.version != _version or utc < _index.since:
+            _start = time.monotonic()
+            _index = _load_active_index(
+                self.mycol, _version, utc - _CACHE_MARGIN
+            )
+            self._active_index = _index
+            logger.debug(
+                f"{self.source}: cached {len(_index.flights)} flights of "
+                f"version {_version} "
+                f"({(time.monotonic() - _start) * 1000:.0f} ms)."
+            )
+        return _index
+
     def get_active_flights(self, utc=None):
+        """Returns the flights airborne at utc from an in-memory index of the
+        collection, which is reloaded when the collection version changes."""
         if utc is None:
             utc = int(arrow.utcnow().timestamp())
-        flights = [
-            _flight
-            for _flight in self.mycol.find(
-                {
-                    "redundant": {"$exists": False},
-                    "$or": [
-                        {
-                            "departure": {
-                                "$gt": utc - 24 * 3600,
-                                "$lt": utc + 300,
-                            }
-                        },
-                        {"arrival": {"$gt": utc - 300, "$lt": utc + 24 * 3600}},
-                    ],
-                }
-            )
-            if _in_bounds(_flight, utc)
-        ]
-        return flights
+        return _query_active_index(self._get_active_index(utc), utc)
 
     def get_flights_of_day(self, date=None):
         if date is None:
@@ -88,6 +340,82 @@ class FlightDataSource:
         return self.mycol.distinct("airline_icao")
 
     def update_flight(self, flight):
-        self.mycol.update_one(
-            {"_id": flight["_id"]}, {"$set": flight}, upsert=True
+        _result = self.mycol.update_one(
+            {"_id": flight["_id"]}, _flight_update(flight), upsert=True
         )
+        if _result.modified_count or _result.upserted_id is not None:
+            self._increase_version()
+
+    def update_flights(
+        self, flights, chunk_size: int = BULK_WRITE_CHUNK_SIZE
+    ) -> list[UpsertCounts]:
+        """Upserts the flights by _id using unordered bulk writes of up to
+        chunk_size flights. Returns the counts of each bulk write."""
+        counts = []
+        _flights = iter(flights)
+        while _chunk := list(itertools.islice(_flights, chunk_size)):
+            _result = self.mycol.bulk_write(
+                [
+                    pymongo.UpdateOne(
+                        {"_id": _flight["_id"]},
+                        _flight_update(_flight),
+                        upsert=True,
+                    )
+                    for _flight in _chunk
+                ],
+                ordered=False,
+            )
+            counts.append(
+                UpsertCounts(
+                    len(_chunk),
+                    _result.matched_count,
+                    _result.modified_count,
+                    _result.upserted_count,
+                )
+            )
+            logger.debug(f"{self.source}: {counts[-1]}")
+        if any(_counts.modified or _counts.upserted for _counts in counts):
+            self._increase_version()
+        return counts
+
+    def backfill_active_windows(self) -> int:
+        """Stores the active windows of flights written before they were
+        introduced. Returns the number of updated flights."""
+        _updated = 0
+        _requests = []
+        for _flight in self.mycol.find(
+            {
+                "active_until": {"$exists": False},
+                "redundant": {"$exists": False},
+                "$or": [
+                    {"departure": {"$ne": None}},
+                    {"arrival": {"$ne": None}},
+                ],
+            },
+            {"route": True, "departure": True, "arrival": True},
+        ):
+            _window = _active_window(_flight)
+            _requests.append(
+                pymongo.UpdateOne(
+                    {"_id": _flight["_id"]},
+                    {
+                        "$set": {
+                            "active_from": _window[0],
+                            "active_until": _window[1],
+                        }
+                    },
+                )
+            )
+            if len(_requests) == BULK_WRITE_CHUNK_SIZE:
+                self.mycol.bulk_write(_requests, ordered=False)
+                _updated += len(_requests)
+                _requests = []
+        if _requests:
+            self.mycol.bulk_write(_requests, ordered=False)
+            _updated += len(_requests)
+        if _updated:
+            self._increase_version()
+            logger.info(
+                f"{self.source}: stored active windows of {_updated} flights."
+            )
+        return _updated
@@ -39,6 +39,7 @@ class Airport(flight_data_source.FlightDataSource):
         super().__init__("FMO")
 
     def update_data(self):
+        fmo_flights = []
         url = "https://service.fmo.de/arrdep1.xml"
         response = requests.get(url)
         response.raise_for_status()
@@ -79,7 +80,14 @@ class Airport(flight_data_source.FlightDataSource):
                 _fmo_flight["status"] = _status_codes[_status_code]
             elif _status_code is not None:
                 _fmo_flight["status"] = _status_code
-            self.update_flight(_fmo_flight)
+            fmo_flights.append(_fmo_flight)
+        _counts = flight_data_source.UpsertCounts.sum(
+            self.update_flights(fmo_flights)
+        )
+        logging.info(
+            f"FMO: stored {_counts.flights} flights ({_counts.upserted} new, "
+            f"{_counts.modified} modified)."
+        )
 
 
 if __name__ == "__main__":
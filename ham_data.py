@@ -180,30 +180,33 @@ class Airport(flight_data_source.FlightDataSource):
         data = request_ham_data()
         _overlapping = data["overlapping_flight_numbers"]
         _unknown_airports: set[str] = set()
-        _stored = 0
+        _flights = []
 
         for _flight in data["arrivals"]:
             _result = _process_flight(
                 _flight, "A", _overlapping, _unknown_airports
             )
-            if _result is None:
-                continue
-            self.update_flight(_result)
-            _stored += 1
+            if _result is not None:
+                _flights.append(_result)
 
         for _flight in data["departures"]:
             _result = _process_flight(
                 _flight, "D", _overlapping, _unknown_airports
             )
-            if _result is None:
-                continue
-            self.update_flight(_result)
-            _stored += 1
+            if _result is not None:
+                _flights.append(_result)
+
+        _counts = flight_data_source.UpsertCounts.sum(
+            self.update_flights(_flights)
+        )
 
         for _iata in sorted(_unknown_airports):
             logger.warning(f"Unknown airport IATA: {_iata}")
 
-        logger.info(f"HAM: stored {_stored} flights.")
+        logger.info(
+            f"HAM: stored {_counts.flights} flights ({_counts.upserted} new, "
+            f"{_counts.modified} modified)."
+        )
 
 
 if __name__ == "__main__":
@@ -1,10 +1,17 @@
 #!/usr/bin/env python3
 import csv
+import itertools
 import logging
 import pathlib
 import arrow
+import pandas as pd
 from airport_info import get_airport_info, get_airport_icao
 from airline_info import get_airline_icao
+from schedule_utils import (
+    describe_dates,
+    drop_multi_segment_totals,
+    schedule_dates,
+)
 import flight_data_source
 
 PWD = pathlib.Path(__file__).resolve().parent
@@ -15,15 +22,17 @@ _day_labels = ["Mo", "Tu", "We", "Th", "Fr", "Sa", "Su"]
 
 def _process_flight(
     flight: dict,
-    utc: arrow.Arrow,
+    dates: list[arrow.Arrow],
     unknown_airlines: set[str],
     unknown_airports: set[str],
-) -> dict | None:
+) -> list[tuple[str, dict]]:
+    """Returns the flights of a schedule row on the dates it operates, each
+    with its date as YYYYMMDD."""
     if flight["ACtype"] in ["RFC", "RFS"]:
-        return None
+        return []
     airline_iata = flight["AL"]
     if not flight["FNR"][2:].isdigit():
-        return None
+        return []
     flight_number = int(flight["FNR"][2:])
 
     if airline_iata == "4Y":
@@ -34,7 +43,7 @@ def _process_flight(
         )
     if airline_icao is None:
         unknown_airlines.add(airline_iata)
-        return None
+        return []
 
     origin_iata = flight["DEP"]
     destination_iata = flight["ARR"]
@@ -42,15 +51,15 @@ def _process_flight(
     destination_icao = get_airport_icao(destination_iata)
     if origin_icao is None:
         unknown_airports.add(origin_iata)
-        return None
+        return []
     if destination_icao is None:
         unknown_airports.add(destination_iata)
-        return None
+        return []
 
     origin_info = get_airport_info(origin_icao)
     destination_info = get_airport_info(destination_icao)
     if origin_info is None or destination_info is None:
-        return None
+        return []
 
     _start_operation = arrow.get(
         flight["Start_Op"], "DDMMMYY", tzinfo=origin_info["Timezone"]
@@ -58,56 +67,82 @@ def _process_flight(
     _end_operation = arrow.get(
         flight["End_Op"], "DDMMMYY", tzinfo=origin_info["Timezone"]
     ).ceil("day")
-    if not _start_operation <= utc <= _end_operation:
-        return None
-
     _frequency = "".join([flight[_day] for _day in _day_labels])
-    if str(utc.isoweekday()) not in _frequency:
-        return None
-
-    _departure_date = utc.shift(days=int(flight["DDC"])).format("YYYYMMDD")
-    _departure = arrow.get(
-        f"{_departure_date}T{flight['STD']}", tzinfo=origin_info["Timezone"]
-    )
-    _arrival_date = utc.shift(days=int(flight["ADC"])).format("YYYYMMDD")
-    _arrival = arrow.get(
-        f"{_arrival_date}T{flight['STA']}", tzinfo=destination_info["Timezone"]
-    )
+    _departure_days = int(flight["DDC"])
+    _arrival_days = int(flight["ADC"])
     _route = f"{origin_icao}-{destination_icao}"
-    return {
-        "_id": f"{airline_iata}_{flight_number}_{_route}_{utc.format('YYYYMMDD')}",
-        "airline_iata": airline_iata,
-        "airline_icao": airline_icao,
-        "flight_number": flight_number,
-        "route": _route,
-        "departure": int(_departure.timestamp()),
-        "arrival": int(_arrival.timestamp()),
-        "segment_number": int(flight["SNR"]),
-    }
-
-
-def extract_flights_from_csv(utc: arrow.Arrow) -> list[dict]:
-    file_name = "LHcargo_FlightSchedule.csv"
-    _unknown_airlines: set[str] = set()
-    _unknown_airports: set[str] = set()
-    _flights = []
-    with open(PWD / file_name, encoding="utf-8") as _f:
+
+    flights = []
+    for _utc in dates:
+        if not _start_operation <= _utc <= _end_operation:
+            continue
+        if str(_utc.isoweekday()) not in _frequency:
+            continue
+        _departure_date = _utc.shift(days=_departure_days)
+        _departure = arrow.get(
+            f"{_departure_date.format('YYYYMMDD')}T{flight['STD']}",
+            tzinfo=origin_info["Timezone"],
+        )
+        _arrival_date = _utc.shift(days=_arrival_days)
+        _arrival = arrow.get(
+            f"{_arrival_date.format('YYYYMMDD')}T{flight['STA']}",
+            tzinfo=destination_info["Timezone"],
+        )
+        _date = _utc.format("YYYYMMDD")
+        flights.append(
+            (
+                _date,
+                {
+                    "_id": f"{airline_iata}_{flight_number}_{_route}_{_date}",
+                    "airline_iata": airline_iata,
+                    "airline_icao": airline_icao,
+                    "flight_number": flight_number,
+                    "route": _route,
+                    "departure": int(_departure.timestamp()),
+                    "arrival": int(_arrival.timestamp()),
+                    "segment_number": int(flight["SNR"]),
+                },
+            )
+        )
+    return flights
+
+
+def _read_schedule(path: pathlib.Path) -> pd.DataFrame:
+    """Reads the flight rows of the schedule CSV, all values as strings."""
+    with open(path, encoding="utf-8") as _f:
         _reader = csv.reader(_f, delimiter=";")
         # First line is the schedule creation date (e.g. "SCD;05APR26").
         next(_reader)
         _header = next(_reader)
-        for _row in _reader:
-            if not _row[0].isdigit():
-                continue
-            _flight = _process_flight(
-                dict(zip(_header, _row)),
-                utc,
-                _unknown_airlines,
-                _unknown_airports,
-            )
-            if _flight is None:
-                continue
-            _flights.append(_flight)
+        _rows = [
+            dict(zip(_header, _row)) for _row in _reader if _row[0].isdigit()
+        ]
+    _columns = list(dict.fromkeys(_header))
+    return pd.DataFrame(
+        [[_row.get(_column, "") for _column in _columns] for _row in _rows],
+        columns=_columns,
+        dtype=str,
+    )
+
+
+def extract_flights_from_csv(
+    utc: arrow.Arrow, days: int = 1
+) -> dict[str, list[dict]]:
+    """Returns the flights operated on utc and the following days, by date
+    as YYYYMMDD."""
+    file_name = "LHcargo_FlightSchedule.csv"
+    _dates = schedule_dates(utc, days)
+    _unknown_airlines: set[str] = set()
+    _unknown_airports: set[str] = set()
+    _flights = {_utc.format("YYYYMMDD"): [] for _utc in _dates}
+    _schedule = flight_data_source.load_cached_schedule(
+        PWD / file_name, _read_schedule
+    )
+    for _row in _schedule.to_dict("records"):
+        for _date, _flight in _process_flight(
+            _row, _dates, _unknown_airlines, _unknown_airports
+        ):
+            _flights[_date].append(_flight)
     for _iata in sorted(_unknown_airlines):
         logger.warning(f"Airline ICAO for {_iata} not found.")
     for _iata in sorted(_unknown_airports):
@@ -119,38 +154,45 @@ class Airline(flight_data_source.FlightDataSource):
     def __init__(self):
         super().__init__("LH_Cargo", category="airlines")
 
-    def update_data(self, utc=None) -> None:
+    def update_data(self, utc=None, days: int = 1) -> None:
         if utc is None:
             _utc = arrow.utcnow()
         else:
             _utc = arrow.get(utc)
 
-        _flights = extract_flights_from_csv(_utc)
+        _flights = extract_flights_from_csv(_utc, days)
 
         # Filter out segment-0 records for flights that have higher-numbered
         # segments, keeping only the individual legs.
-        _multi_segment = {
-            (_flight["airline_iata"], _flight["flight_number"])
-            for _flight in _flights
-            if _flight["segment_number"] > 0
-        }
-        _stored = 0
-        for _flight in _flights:
-            if (
-                _flight["airline_iata"],
-                _flight["flight_number"],
-            ) in _multi_segment and _flight["segment_number"] == 0:
-                continue
-            self.update_flight(_flight)
-            _stored += 1
+        _counts = flight_data_source.UpsertCounts.sum(
+            self.update_flights(
+                itertools.chain.from_iterable(
+                    drop_multi_segment_totals(_date_flights)
+                    for _date_flights in _flights.values()
+                )
+            )
+        )
 
         logger.info(
-            f"LH Cargo: stored {_stored} flights for "
-            f"{_utc.format('YYYY-MM-DD')}."
+            f"LH Cargo: stored {_counts.flights} flights for "
+            f"{describe_dates(schedule_dates(_utc, days))} "
+            f"({_counts.upserted} new, {_counts.modified} modified)."
         )
 
 
 if __name__ == "__main__":
+    import argparse
+
     logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Import LH Cargo schedule into MongoDB."
+    )
+    parser.add_argument(
+        "--days",
+        type=int,
+        default=1,
+        help="Number of days to import starting tomorrow (default: 1).",
+    )
+    args = parser.parse_args()
     airline = Airline()
-    airline.update_data(arrow.utcnow().shift(days=1))
+    airline.update_data(arrow.utcnow().shift(days=1), days=args.days)
@@ -0,0 +1,479 @@
+import json
+import struct
+import logging
+from collections.abc import Mapping
+import numpy as np
+import redis
+
+logger = logging.getLogger(__name__)
+
+# JSON snapshot kept for compatibility with existing consumers.
+POSITIONS_KEY = "opensky_positions"
+# Columnar binary snapshot, to be read with decode_responses=False.
+COLUMNAR_POSITIONS_KEY = "opensky_positions_columnar"
+
+# Stream of per-cycle position deltas and the stream ID up to which the
+# columnar snapshot is compacted.
+POSITION_DELTAS_KEY = "opensky_position_deltas"
+SNAPSHOT_ID_KEY = "opensky_positions_snapshot_id"
+_DELTA_STREAM_MAXLEN = 200
+
+# Changes of a position below these thresholds, accumulated since the last
+# significant change, are not considered significant by PositionStreamReader.
+SIGNIFICANT_DISTANCE = 5e3
+SIGNIFICANT_HEADING = 5.0
+SIGNIFICANT_VERTICAL_RATE = 1.0
+
+_MAGIC = b"OSPC"
+_VERSION = 1
+# magic, version, number of positions, states_time, length of column table
+_HEADER = struct.Struct("<4sHxxIqI")
+_ALIGNMENT = 8
+
+# Position fields stored as columns. Numerical fields are stored as float64
+# with NaN for None, "int" fields are converted back to int when a position
+# dict is rebuilt. Strings are stored as fixed-width UTF-8 and an empty
+# string stands for a missing value. The sensors list is not stored.
+POSITION_COLUMNS = (
+    ("utc", "int"),
+    ("latitude", "float"),
+    ("longitude", "float"),
+    ("altitude", "float"),
+    ("heading", "float"),
+    ("icao24", "str"),
+    ("vertical_rate", "float"),
+    ("velocity", "float"),
+    ("time_position", "int"),
+    ("on_ground", "bool"),
+    ("category", "int"),
+    ("flight_level", "int"),
+    ("registration", "str"),
+    ("callsign", "str"),
+    ("operator_icao", "str"),
+    ("callsign_number", "int"),
+)
+
+
+def _padding(length: int) -> bytes:
+    return b"\0" * (-length % _ALIGNMENT)
+
+
+def _column_array(values: list, kind: str) -> np.ndarray:
+    if kind == "bool":
+        return np.array([bool(_value) for _value in values], dtype=bool)
+    if kind == "str":
+        _values = [(_value or "").encode() for _value in values]
+        _width = max((len(_value) for _value in _values), default=0)
+        return np.array(_values, dtype=f"S{max(_width, 1)}")
+    return np.array(
+        [np.nan if _value is None else _value for _value in values],
+        dtype=np.float64,
+    )
+
+
+def encode_positions(positions: dict, states_time: int) -> bytes:
+    """Encodes a dict of validated positions keyed by callsign as columnar
+    binary snapshot."""
+    _positions = list(positions.values())
+    columns = []
+    offset = 0
+    buffers = []
+    for _name, _kind in POSITION_COLUMNS:
+        _array = _column_array(
+            [_position.get(_name) for _position in _positions], _kind
+        )
+        _data = _array.tobytes()
+        columns.append([_name, _kind, _array.dtype.str, offset])
+        buffers.append(_data + _padding(len(_data)))
+        offset += len(buffers[-1])
+    column_table = json.dumps(columns, separators=(",", ":")).encode()
+    # Padded with whitespace, which is valid JSON.
+    column_table += b" " * (-(_HEADER.size + len(column_table)) % _ALIGNMENT)
+    header = _HEADER.pack(
+        _MAGIC, _VERSION, len(_positions), states_time, len(column_table)
+    )
+    return b"".join([header, column_table, *buffers])
+
+
+def decode_positions(data: bytes) -> tuple[dict[str, np.ndarray], int]:
+    """Maps a columnar snapshot into NumPy arrays without copying. Returns
+    the columns and the states_time of the snapshot."""
+    magic, version, count, states_time, table_length = _HEADER.unpack_from(
+        data
+    )
+    if magic != _MAGIC or version != _VERSION:
+        raise ValueError(f"unsupported snapshot format: {magic!r} {version}")
+    _start = _HEADER.size
+    column_table = json.loads(bytes(data[_start : _start + table_length]))
+    _start += table_length
+    columns = {
+        _name: np.frombuffer(
+            data, dtype=np.dtype(_dtype), count=count, offset=_start + _offset
+        )
+        for _name, _kind, _dtype, _offset in column_table
+    }
+    return columns, states_time
+
+
+class PositionTable(Mapping):
+    """Read-only mapping of callsign to position backed by column arrays.
+    Position dicts are only built for the callsigns accessed."""
+
+    def __init__(self, columns: dict[str, np.ndarray], states_time: int):
+        self.columns = columns
+        self.states_time = states_time
+        self.callsigns = [
+            _callsign.decode() for _callsign in columns["callsign"].tolist()
+        ]
+        self._rows = {
+            _callsign: _row for _row, _callsign in enumerate(self.callsigns)
+        }
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "PositionTable":
+        return cls(*decode_positions(data))
+
+    @classmethod
+    def from_positions(
+        cls, positions: dict, states_time: int
+    ) -> "PositionTable":
+        return cls.from_bytes(encode_positions(positions, states_time))
+
+    def __getitem__(self, callsign: str) -> dict:
+        _row = self._rows[callsign]
+        position = {}
+        for _name, _kind in POSITION_COLUMNS:
+            _value = self.columns[_name][_row]
+            if _kind == "str":
+                if _value:
+                    position[_name] = _value.decode()
+                elif _name != "registration":
+                    position[_name] = None
+            elif _kind == "bool":
+                position[_name] = bool(_value)
+            elif np.isnan(_value):
+                if _name != "flight_level":
+                    position[_name] = None
+            else:
+                position[_name] = (
+                    int(_value) if _kind == "int" else float(_value)
+                )
+        return position
+
+    def __iter__(self):
+        return iter(self.callsigns)
+
+    def __len__(self) -> int:
+        return len(self.callsigns)
+
+    def __contains__(self, callsign) -> bool:
+        return callsign in self._rows
+
+    def take(self, callsigns: list[str]) -> dict[str, np.ndarray]:
+        """Returns the columns of the given callsigns, e.g. as input for
+        route_utils.route_check_batch."""
+        _rows = np.array(
+            [self._rows[_callsign] for _callsign in callsigns], dtype=np.intp
+        )
+        return {_name: _array[_rows] for _name, _array in self.columns.items()}
+
+    def merged(self, delta: "PositionTable", removed) -> "PositionTable":
+        """Returns a new table with the positions of delta added or replaced
+        and the removed callsigns dropped."""
+        _dropped = set(removed).union(delta.callsigns)
+        _keep = np.array(
+            [_callsign not in _dropped for _callsign in self.callsigns],
+            dtype=bool,
+        )
+        columns = {
+            _name: np.concatenate((_array[_keep], delta.columns[_name]))
+            for _name, _array in self.columns.items()
+        }
+        return PositionTable(columns, delta.states_time)
+
+
+def store_positions(
+    redis_connection: redis.Redis,
+    positions: dict,
+    states_time: int,
+    json_compatible: bool = True,
+) -> None:
+    """Stores the columnar snapshot and, if json_compatible, the JSON
+    snapshot in a single round trip."""
+    pipeline = redis_connection.pipeline(transaction=False)
+    pipeline.set(
+        COLUMNAR_POSITIONS_KEY, encode_positions(positions, states_time)
+    )
+    if json_compatible:
+        pipeline.set(
+            POSITIONS_KEY,
+            json.dumps({"positions": positions, "states_time": states_time}),
+        )
+    else:
+        # Consumers of the JSON snapshot must not see outdated positions.
+        pipeline.delete(POSITIONS_KEY)
+    pipeline.execute()
+
+
+def load_position_table(
+    redis_connection: redis.Redis,
+) -> PositionTable | None:
+    """Loads the columnar snapshot and falls back to the JSON snapshot if it
+    is not available. The connection must use decode_responses=False."""
+    data = redis_connection.get(COLUMNAR_POSITIONS_KEY)
+    if data is not None:
+        return PositionTable.from_bytes(data)
+    data = redis_connection.get(POSITIONS_KEY)
+    if data is None:
+        return None
+    logger.debug("columnar snapshot not available, using JSON snapshot.")
+    _snapshot = json.loads(data)
+    return PositionTable.from_positions(
+        _snapshot["positions"], _snapshot["states_time"]
+    )
+
+
+def _position_delta(previous: dict, positions: dict) -> tuple[dict, list[str]]:
+    """Returns the new or changed positions and the removed callsigns."""
+    changed = {}
+    for _callsign, _position in positions.items():
+        _previous = previous.get(_callsign)
+        if _previous is None or any(
+            _previous.get(_key) != _value
+            for _key, _value in _position.items()
+            if _key != "sensors"
+        ):
+            changed[_callsign] = _position
+    removed = [
+        _callsign for _callsign in previous if _callsign not in positions
+    ]
+    return changed, removed
+
+
+class PositionPublisher:
+    """Publishes the positions of each consumer cycle as a delta of new,
+    changed and removed callsigns on a Redis stream. The columnar snapshot
+    is compacted every snapshot_interval cycles. With json_compatible, the
+    full JSON snapshot is still stored every cycle. The connection must use
+    decode_responses=False."""
+
+    def __init__(
+        self,
+        redis_connection: redis.Redis,
+        snapshot_interval: int = 20,
+        json_compatible: bool = True,
+    ):
+        self.redis_connection = redis_connection
+        self.snapshot_interval = snapshot_interval
+        self.json_compatible = json_compatible
+        self._previous = None
+        self._last_id = None
+        self._cycles = 0
+
+    def _next_id(self, states_time: int) -> tuple[int, int]:
+        if self._last_id is None:
+            _last_entries = self.redis_connection.xrevrange(
+                POSITION_DELTAS_KEY, count=1
+            )
+            self._last_id = (0, 0)
+            if _last_entries:
+                self._last_id = tuple(
+                    int(_part) for _part in _last_entries[0][0].split(b"-")
+                )
+        _milliseconds = int(states_time) * 1000
+        if _milliseconds > self._last_id[0]:
+            return _milliseconds, 0
+        return self._last_id[0], self._last_id[1] + 1
+
+    def publish(self, positions: dict, states_time: int) -> None:
+        _next_id = self._next_id(states_time)
+        stream_id = "{}-{}".format(*_next_id)
+        # Without a previous state, the delta replaces all positions.
+        full = self._previous is None
+        changed, removed = _position_delta(self._previous or {}, positions)
+        pipeline = self.redis_connection.pipeline(transaction=True)
+        pipeline.xadd(
+            POSITION_DELTAS_KEY,
+            {
+                "previous_id": "{}-{}".format(*self._last_id),
+                "full": int(full),
+                "removed": json.dumps(removed),
+                "positions": encode_positions(changed, states_time),
+            },
+            id=stream_id,
+            maxlen=_DELTA_STREAM_MAXLEN,
+            approximate=True,
+        )
+        if full or self._cycles % self.snapshot_interval == 0:
+            pipeline.set(
+                COLUMNAR_POSITIONS_KEY,
+                encode_positions(positions, states_time),
+            )
+            pipeline.set(SNAPSHOT_ID_KEY, stream_id)
+        if self.json_compatible:
+            pipeline.set(
+                POSITIONS_KEY,
+                json.dumps(
+                    {"positions": positions, "states_time": states_time}
+                ),
+            )
+        pipeline.execute()
+        logger.debug(
+            f"published delta {stream_id}: {len(changed)} changed, "
+            f"{len(removed)} removed."
+        )
+        self._previous = positions
+        self._last_id = _next_id
+        self._cycles += 1
+
+    def reset(self) -> None:
+        """Makes the next delta replace all positions, e.g. after a failed
+        publish."""
+        self._previous = None
+        self._last_id = None
+
+
+class PositionStreamReader:
+    """Follows the position deltas published by PositionPublisher.
+
+    After update(), table holds the current positions and changed the
+    callsigns which are new or whose position changed significantly since
+    they were last reported as changed. removed holds the callsigns which
+    disappeared. After a resync from the snapshot, all callsigns are
+    reported as changed. The connection must use decode_responses=False."""
+
+    def __init__(self, redis_connection: redis.Redis):
+        self.redis_connection = redis_connection
+        self.table = None
+        self.changed = set()
+        self.removed = set()
+        self.resynced = False
+        self._last_id = None
+        self._references = {}
+
+    def _entries_after(self, stream_id: bytes) -> list | None:
+        """Returns the delta entries following stream_id or None if they do
+        not continue it."""
+        entries = self.redis_connection.xrange(
+            POSITION_DELTAS_KEY, min=b"(" + stream_id
+        )
+        _previous_id = stream_id
+        for _entry_id, _fields in entries:
+            if _fields[b"previous_id"] != _previous_id:
+                return None
+            _previous_id = _entry_id
+        return entries
+
+    def _resync(self) -> list | None:
+        pipeline = self.redis_connection.pipeline(transaction=True)
+        pipeline.get(COLUMNAR_POSITIONS_KEY)
+        pipeline.get(SNAPSHOT_ID_KEY)
+        data, snapshot_id = pipeline.execute()
+        self.resynced = True
+        self._references = {}
+        if data is None or snapshot_id is None:
+            # No delta publisher is running, the plain snapshot is used.
+            self.table = load_position_table(self.redis_connection)
+            self._last_id = None
+            return []
+        self.table = PositionTable.from_bytes(data)
+        self._last_id = snapshot_id
+        return self._entries_after(snapshot_id)
+
+    def update(self) -> PositionTable | None:
+        previous = self.table
+        self.resynced = False
+        entries = None
+        if self._last_id is not None:
+            entries = self._entries_after(self._last_id)
+        if entries is None:
+            entries = self._resync()
+        if entries is None:
+            logger.warning("position deltas do not continue the snapshot.")
+            entries = []
+            self._last_id = None
+        updated = set()
+        for _entry_id, _fields in entries:
+            _delta = PositionTable.from_bytes(_fields[b"positions"])
+            if _fields[b"full"] == b"1":
+                self.table = _delta
+                updated = set(_delta.callsigns)
+            else:
+                self.table = self.table.merged(
+                    _delta, json.loads(_fields[b"removed"])
+                )
+                updated.update(_delta.callsigns)
+            self._last_id = _entry_id
+        if self.table is None:
+            self.changed = set()
+            self.removed = set()
+            return None
+        if self.resynced or previous is None:
+            self.removed = set()
+            self._references = {}
+            updated = set(self.table.callsigns)
+        else:
+            self.removed = {
+                _callsign
+                for _callsign in previous.callsigns
+                if _callsign not in self.table
+            }
+        for _callsign in self.removed:
+            self._references.pop(_callsign, None)
+        self.changed = self._significant(
+            [_callsign for _callsign in updated if _callsign in self.table]
+        )
+        return self.table
+
+    def _significant(self, callsigns: list[str]) -> set[str]:
+        """Returns the callsigns which are new or changed significantly
+        compared to their reference state and updates the references."""
+        if not callsigns:
+            return set()
+        columns = self.table.take(callsigns)
+        current = np.stack(
+            [
+                columns["latitude"],
+                columns["longitude"],
+                columns["heading"],
+                columns["vertical_rate"],
+                columns["on_ground"].astype(float),
+            ],
+            axis=-1,
+        )
+        reference = np.array(
+            [
+                self._references.get(_callsign, (np.nan,) * 5)
+                for _callsign in callsigns
+            ],
+            dtype=float,
+        ).reshape(-1, 5)
+        _lat = np.radians(current[:, 0])
+        _reference_lat = np.radians(reference[:, 0])
+        # The equirectangular approximation is sufficient for short moves.
+        _x = np.radians(
+            (current[:, 1] - reference[:, 1] + 180) % 360 - 180
+        ) * np.cos((_lat + _reference_lat) / 2)
+        _y = _lat - _reference_lat
+        distance = 6.370e6 * np.hypot(_x, _y)
+        heading_change = np.abs(
+            (current[:, 2] - reference[:, 2] + 180) % 360 - 180
+        )
+        vertical_rate_change = np.abs(current[:, 3] - reference[:, 3])
+        with np.errstate(invalid="ignore"):
+            significant = (
+                np.isnan(reference[:, 0])
+                | ~(distance <= SIGNIFICANT_DISTANCE)
+                | (heading_change > SIGNIFICANT_HEADING)
+                | (vertical_rate_change > SIGNIFICANT_VERTICAL_RATE)
+                | (np.isnan(current[:, 3]) != np.isnan(reference[:, 3]))
+                | (current[:, 4] != reference[:, 4])
+            )
+        changed = set()
+        for _callsign, _significant, _state in zip(
+            callsigns, significant.tolist(), current.tolist()
+        ):
+            if _significant:
+                changed.add(_callsign)
+                self._references[_callsign] = tuple(_state)
+        return changed
@@ -1,9 +1,16 @@
 import re
 import json
 import logging
+import functools
+import operator
 import pathlib
+import queue
+import threading
+import time
 import redis
 import requests
+import numpy as np
+from registration_store import RegistrationStore
 
 PWD = pathlib.Path(__file__).resolve().parent
 
@@ -20,43 +27,104 @@ suffix_validator = re.compile("^[1-9]")
 # Mapping between icao24 and aircraft registration loaded from the frozen
 # OpenSky aircraft database snapshot. Refresh using prepare_aircraft_data.py
 # followed by reload_icao24_to_registration().
-icao24_to_registration = {}
+icao24_to_registration = RegistrationStore()
+
+# Registrations added to the icao24s hash are also appended to this stream,
+# so that they can be merged incrementally.
+ICAO24S_UPDATES_KEY = "icao24s_updates"
+_ICAO24S_UPDATES_MAXLEN = 10000
+# Id of the last merged entry of the updates stream and the number of
+# entries added to the stream until then, None before the whole icao24s
+# hash has been merged.
+_icao24s_stream = None
 
 
 def reload_icao24_to_registration() -> None:
-    with open(PWD / "icao24_to_registration.json", encoding="utf-8") as _f:
-        _data = json.load(_f)
-    icao24_to_registration.clear()
-    icao24_to_registration.update(_data)
+    """Loads the store from its binary cache file, which is rebuilt if
+    icao24_to_registration.json is newer."""
+    global icao24_to_registration, _icao24s_stream
+    _json_file = PWD / "icao24_to_registration.json"
+    _cache_file = PWD / "icao24_to_registration.npz"
+    if (
+        _cache_file.exists()
+        and _cache_file.stat().st_mtime >= _json_file.stat().st_mtime
+    ):
+        icao24_to_registration = RegistrationStore.load(_cache_file)
+    else:
+        icao24_to_registration = RegistrationStore.from_json(_json_file)
+        try:
+            icao24_to_registration.save(_cache_file)
+        except OSError:
+            logger.exception(f"Cannot write {_cache_file.name}.")
+    _icao24s_stream = None
 
 
 def update_icao24s_from_redis() -> None:
-    icao24_to_registration.update(redis_connection.hgetall("icao24s"))
+    """Merges the registrations added to the icao24s hash since the last
+    call. The whole hash is only read on the first call and if updates were
+    trimmed from the stream before being merged."""
+    global _icao24s_stream
+    if _icao24s_stream is not None:
+        _last_id, _entries_added = _icao24s_stream
+        _pipeline = redis_connection.pipeline()
+        _pipeline.xinfo_stream(ICAO24S_UPDATES_KEY)
+        _pipeline.xrange(ICAO24S_UPDATES_KEY, min=f"({_last_id}")
+        _info, _entries = _pipeline.execute(raise_on_error=False)
+        if isinstance(_info, redis.exceptions.ResponseError):
+            # The stream does not exist (anymore).
+            _info = {"entries-added": 0}
+        # The entries added counter is not available with Redis < 7.
+        _entries_added += len(_entries)
+        if _info.get("entries-added", _entries_added) == _entries_added:
+            if _entries:
+                icao24_to_registration.update(
+                    (_fields["icao24"], _fields["registration"])
+                    for _, _fields in _entries
+                )
+                _icao24s_stream = (_entries[-1][0], _entries_added)
+            return
+        logger.warning("icao24s updates incomplete, reading whole hash.")
+    _pipeline = redis_connection.pipeline()
+    _pipeline.xinfo_stream(ICAO24S_UPDATES_KEY)
+    _pipeline.hgetall("icao24s")
+    _info, _icao24s = _pipeline.execute(raise_on_error=False)
+    icao24_to_registration.update(_icao24s)
+    if isinstance(_info, redis.exceptions.ResponseError):
+        _icao24s_stream = ("0-0", 0)
+    else:
+        _icao24s_stream = (
+            _info["last-generated-id"],
+            _info.get("entries-added", 0),
+        )
 
 
 def dump_icao24_to_registration() -> None:
     _staging = PWD / "icao24_to_registration_new.json"
     _target = PWD / "icao24_to_registration.json"
     with open(_staging, "w", encoding="utf-8") as _f:
-        json.dump(icao24_to_registration, _f)
+        json.dump(dict(icao24_to_registration), _f)
     _staging.rename(_target)
 
 
-def request_icao24_from_opensky(icao24: str) -> str | None:
-    if redis_connection.sismember("unknown_icao24s", icao24):
-        return None
-    url = "https://opensky-network.org/api/metadata/aircraft/icao/"
-    try:
-        response = requests.get(url + icao24)
-    except requests.exceptions.ConnectionError:
-        logger.exception(f"Problem getting registration for {icao24}.")
-        return None
+METADATA_URL = "https://opensky-network.org/api/metadata/aircraft/icao/"
+_METADATA_TIMEOUT = 10.0
+
+
+def _store_metadata_response(icao24: str, response) -> str | None:
     if response.status_code == 200:
         _data = response.json()
         registration = _data["registration"].replace("-", "").replace(".", "")
         if registration != "":
-            redis_connection.hset("icao24s", icao24, registration)
-            redis_connection.sadd("icao24s_from_api", icao24)
+            _pipeline = redis_connection.pipeline()
+            _pipeline.hset("icao24s", icao24, registration)
+            _pipeline.sadd("icao24s_from_api", icao24)
+            _pipeline.xadd(
+                ICAO24S_UPDATES_KEY,
+                {"icao24": icao24, "registration": registration},
+                maxlen=_ICAO24S_UPDATES_MAXLEN,
+                approximate=True,
+            )
+            _pipeline.execute()
             logger.info(
                 f"icao24 {icao24} ({registration}) retrieved from API — "
                 f"not present in frozen aircraft database."
@@ -66,6 +134,142 @@ def request_icao24_from_opensky(icao24: str) -> str | None:
     return None
 
 
+def request_icao24_from_opensky(icao24: str) -> str | None:
+    if redis_connection.sismember("unknown_icao24s", icao24):
+        return None
+    try:
+        response = requests.get(
+            METADATA_URL + icao24, timeout=_METADATA_TIMEOUT
+        )
+    except requests.exceptions.RequestException:
+        logger.exception(f"Problem getting registration for {icao24}.")
+        return None
+    return _store_metadata_response(icao24, response)
+
+
+class RegistrationResolver:
+    """Resolves the registrations of unknown icao24s via the OpenSky metadata
+    API in background threads. Results are written to the icao24s hash in
+    Redis and picked up by update_icao24s_from_redis on a later cycle.
+    Requests are limited to rate_limit per second over all workers. Rate
+    limited, failed and timed out requests are retried max_retries times
+    with exponential backoff."""
+
+    def __init__(
+        self,
+        workers: int = 4,
+        rate_limit: float = 2.0,
+        timeout: float = _METADATA_TIMEOUT,
+        max_retries: int = 3,
+        backoff: float = 5.0,
+    ):
+        self.workers = workers
+        self.rate_limit = rate_limit
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        # icao24s queued or being resolved and those already resolved by
+        # this process.
+        self._pending = set()
+        self._done = set()
+        self._threads = []
+        self._session = None
+        self._next_request = 0.0
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def submit(self, icao24: str) -> None:
+        """Queues an icao24 for resolution without blocking."""
+        with self._lock:
+            if icao24 in self._pending or icao24 in self._done:
+                return
+            self._pending.add(icao24)
+            if not self._threads:
+                self._start()
+        self._queue.put(icao24)
+
+    def join(self) -> None:
+        """Blocks until all queued icao24s are processed."""
+        self._queue.join()
+
+    def _start(self) -> None:
+        self._session = requests.Session()
+        _adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.workers
+        )
+        self._session.mount("https://", _adapter)
+        for _ in range(self.workers):
+            _thread = threading.Thread(target=self._worker, daemon=True)
+            _thread.start()
+            self._threads.append(_thread)
+
+    def _wait_for_slot(self) -> None:
+        with self._lock:
+            _now = time.monotonic()
+            _slot = max(_now, self._next_request)
+            self._next_request = _slot + 1 / self.rate_limit
+        time.sleep(_slot - _now)
+
+    def _pause(self, seconds: float) -> None:
+        with self._lock:
+            self._next_request = max(
+                self._next_request, time.monotonic() + seconds
+            )
+
+    def _worker(self) -> None:
+        while True:
+            icao24 = self._queue.get()
+            done = False
+            try:
+                done = self._resolve(icao24)
+            except Exception:
+                logger.exception(f"Problem resolving icao24 {icao24}.")
+            with self._lock:
+                self._pending.discard(icao24)
+                if done:
+                    self._done.add(icao24)
+            self._queue.task_done()
+
+    def _resolve(self, icao24: str) -> bool:
+        """Returns False if the icao24 could not be resolved, so that it
+        may be submitted again later."""
+        if redis_connection.sismember("unknown_icao24s", icao24):
+            return True
+        for _attempt in range(self.max_retries + 1):
+            if _attempt > 0:
+                time.sleep(self.backoff * 2 ** (_attempt - 1))
+            self._wait_for_slot()
+            try:
+                response = self._session.get(
+                    METADATA_URL + icao24, timeout=self.timeout
+                )
+            except requests.exceptions.RequestException as e:
+                logger.warning(
+                    f"Problem getting registration for {icao24}: {e}"
+                )
+                continue
+            if response.status_code == 429:
+                _retry_after = response.headers.get("Retry-After", "")
+                self._pause(
+                    float(_retry_after)
+                    if _retry_after.isdigit()
+                    else self.backoff
+                )
+                continue
+            if response.status_code >= 500:
+                continue
+            _store_metadata_response(icao24, response)
+            return True
+        logger.warning(f"Giving up on registration for {icao24} for now.")
+        return False
+
+
+registration_resolver = RegistrationResolver()
+
+
 reload_icao24_to_registration()
 
 
@@ -156,13 +360,141 @@ def validated_position(
     if use_registration:
         registration = icao24_to_registration.get(position["icao24"])
         if registration is None:
-            registration = request_icao24_from_opensky(position["icao24"])
-        if registration is not None:
+            registration_resolver.submit(position["icao24"])
+        else:
             position["registration"] = registration
     position.update(callsign_check)
     return position
 
 
+# Keys of the position dict and the state vector attributes they are taken
+# from, followed by the callsign and the sensors.
+_POSITION_KEYS = (
+    "utc",
+    "latitude",
+    "longitude",
+    "altitude",
+    "heading",
+    "icao24",
+    "vertical_rate",
+    "velocity",
+    "time_position",
+    "on_ground",
+    "category",
+)
+_ICAO24_COLUMN = _POSITION_KEYS.index("icao24")
+_get_state_fields = operator.attrgetter(
+    "time_position",
+    "latitude",
+    "longitude",
+    "baro_altitude",
+    "true_track",
+    "icao24",
+    "vertical_rate",
+    "velocity",
+    "time_position",
+    "on_ground",
+    "category",
+    "callsign",
+    "sensors",
+)
+# Fields which may be None for positions on ground.
+_OPTIONAL_ON_GROUND = ("altitude", "vertical_rate")
+
+
+@functools.lru_cache(maxsize=65536)
+def _cached_validated_callsign(
+    callsign,
+    accepted_operators,
+    allow_numerical_callsign,
+    allow_alphanumerical_callsign,
+):
+    return validated_callsign(
+        callsign,
+        accepted_operators,
+        allow_numerical_callsign,
+        allow_alphanumerical_callsign,
+    )
+
+
+def validated_positions(
+    opensky_states,
+    states_time=None,
+    max_age=60,
+    accepted_operators=None,
+    allow_numerical_callsign=True,
+    allow_alphanumerical_callsign=True,
+    allow_on_ground=False,
+    use_registration=True,
+) -> dict:
+    """Validates a list of OpenSky state vectors at once and returns the
+    positions by callsign, as validated_position would for each state.
+    Positions older than max_age seconds relative to states_time are
+    dropped. The callsign checks are cached across calls."""
+    if len(opensky_states) == 0:
+        return {}
+    if accepted_operators is not None:
+        accepted_operators = frozenset(accepted_operators)
+    rows = list(map(_get_state_fields, opensky_states))
+    columns = dict(zip(_POSITION_KEYS + ("callsign",), zip(*rows)))
+    callsign_checks = [
+        _cached_validated_callsign(
+            _callsign,
+            accepted_operators,
+            allow_numerical_callsign,
+            allow_alphanumerical_callsign,
+        )
+        for _callsign in columns["callsign"]
+    ]
+    valid = np.not_equal(np.array(callsign_checks, dtype=object), None)
+    valid &= np.not_equal(np.array(columns["icao24"], dtype=object), None)
+    # None is converted to NaN.
+    numerical = {
+        _key: np.array(columns[_key], dtype=float)
+        for _key in _POSITION_KEYS
+        if _key != "icao24"
+    }
+    on_ground = numerical["on_ground"] == 1
+    for _key, _values in numerical.items():
+        if _key in _OPTIONAL_ON_GROUND:
+            valid &= on_ground | ~np.isnan(_values)
+        else:
+            valid &= ~np.isnan(_values)
+    if not allow_on_ground:
+        valid &= ~on_ground
+    flight_levels = np.rint(numerical["altitude"] / 0.3048 / 100)
+    with np.errstate(invalid="ignore"):
+        # Maximum FL for Concorde.
+        valid &= on_ground | (flight_levels <= 600)
+        if states_time is not None and max_age is not None:
+            valid &= states_time - numerical["time_position"] <= max_age
+
+    # The last state of a callsign wins, as in a loop over the states.
+    selected = {}
+    for _index in np.flatnonzero(valid).tolist():
+        selected[callsign_checks[_index]["callsign"]] = _index
+    if use_registration:
+        registrations = icao24_to_registration.get_many(
+            [rows[_index][_ICAO24_COLUMN] for _index in selected.values()]
+        )
+    positions = {}
+    for _i, (_callsign, _index) in enumerate(selected.items()):
+        _row = rows[_index]
+        position = dict(zip(_POSITION_KEYS, _row))
+        if not on_ground[_index]:
+            position["flight_level"] = int(flight_levels[_index])
+        position["sensors"] = [] if _row[-1] is None else _row[-1]
+        if use_registration:
+            registration = registrations[_i]
+            if registration is None:
+                registration_resolver.submit(position["icao24"])
+            else:
+                position["registration"] = registration
+        position.update(callsign_checks[_index])
+        positions[_callsign] = position
+    return positions
+
+
 if __name__ == "__main__":
     update_icao24s_from_redis()
     dump_icao24_to_registration()
@@ -7,6 +7,7 @@ import sqlite3
 import requests
 from collections import Counter
 from timezonefinder import TimezoneFinder
+from prepare_route_lengths import ROUTE_LENGTH_DB_FILE, refresh_route_lengths
 
 OURAIRPORTS_URL = "https://davidmegginson.github.io/ourairports-data/"
 PWD = pathlib.Path(__file__).resolve().parent
@@ -111,6 +112,10 @@ def main() -> None:
         db_connection.commit()
         db_connection.execute("VACUUM")
 
+    # Segment lengths of airports with changed coordinates are recomputed.
+    if ROUTE_LENGTH_DB_FILE.exists():
+        refresh_route_lengths()
+
 
 if __name__ == "__main__":
     main()
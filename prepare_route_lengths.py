@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+import sqlite3
+import pathlib
+import logging
+import numpy as np
+import pymongo
+from route_utils import geodesic_inverse_batch
+
+PWD = pathlib.Path(__file__).resolve().parent
+ROUTE_LENGTH_DB_FILE = PWD / "route_lengths.sqb"
+AIRPORT_DB_FILE = PWD / "airports.sqb"
+VRS_ROUTES_DB_FILE = PWD / "vrs_routes.sqb"
+
+# MongoDB databases holding the collections of the flight data sources.
+_SCHEDULE_DATABASES = ("airports", "airlines", "agencies")
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _ensure_schema(db_connection: sqlite3.Connection) -> None:
+    _cursor = db_connection.cursor()
+    _cursor.execute(
+        "SELECT count(name) FROM sqlite_master "
+        "WHERE type='table' AND name='route_lengths'"
+    )
+    if _cursor.fetchone()[0] == 0:
+        with open(PWD / "route_lengths.sql", encoding="utf-8") as f:
+            db_connection.executescript(f.read())
+    _cursor.close()
+
+
+def _route_segments(routes) -> set[tuple[str, str]]:
+    segments = set()
+    for _route in routes:
+        icaos = _route.split("-")
+        for i in range(len(icaos) - 1):
+            if icaos[i] != icaos[i + 1]:
+                segments.add((icaos[i], icaos[i + 1]))
+    return segments
+
+
+def collect_segments() -> set[tuple[str, str]]:
+    """Returns all (origin, destination) pairs of the VRS routes and of the
+    flight data source collections in MongoDB."""
+    routes = set()
+    if VRS_ROUTES_DB_FILE.exists():
+        with sqlite3.connect(
+            f"file:{VRS_ROUTES_DB_FILE}?mode=ro", uri=True
+        ) as connection:
+            _cursor = connection.cursor()
+            _cursor.execute("SELECT DISTINCT Route FROM flight_routes")
+            routes.update(_row[0] for _row in _cursor.fetchall())
+            _cursor.close()
+    else:
+        logger.warning(f"{VRS_ROUTES_DB_FILE.name} not found.")
+    client = pymongo.MongoClient(
+        "mongodb://localhost:27017/", serverSelectionTimeoutMS=5000
+    )
+    try:
+        for _database in _SCHEDULE_DATABASES:
+            for _collection in client[_database].list_collection_names():
+                routes.update(
+                    client[_database][_collection].distinct(
+                        "route", {"redundant": {"$exists": False}}
+                    )
+                )
+    except pymongo.errors.ServerSelectionTimeoutError:
+        logger.warning("MongoDB not available, using VRS routes only.")
+    finally:
+        client.close()
+    return _route_segments(_route for _route in routes if _route)
+
+
+def refresh_route_lengths(segments=()) -> None:
+    """Adds the given segments to route_lengths.sqb and recomputes all stored
+    segments whose airport coordinates differ from airports.sqb. Segments
+    with airports no longer in airports.sqb are removed."""
+    with sqlite3.connect(
+        f"file:{AIRPORT_DB_FILE}?mode=ro", uri=True
+    ) as connection:
+        _cursor = connection.cursor()
+        _cursor.execute("SELECT ICAO, Latitude, Longitude FROM Airports")
+        coordinates = {
+            _row[0]: (float(_row[1]), float(_row[2]))
+            for _row in _cursor.fetchall()
+        }
+        _cursor.close()
+
+    with sqlite3.connect(ROUTE_LENGTH_DB_FILE) as db_connection:
+        _ensure_schema(db_connection)
+        _cursor = db_connection.cursor()
+        _cursor.execute(
+            "SELECT Origin, Destination, OriginLatitude, OriginLongitude, "
+            "DestinationLatitude, DestinationLongitude FROM route_lengths"
+        )
+        stored = {(_row[0], _row[1]): _row[2:] for _row in _cursor.fetchall()}
+        _cursor.close()
+
+        outdated = []
+        removed = []
+        for _segment in set(stored) | set(segments):
+            _origin = coordinates.get(_segment[0])
+            _destination = coordinates.get(_segment[1])
+            if _origin is None or _destination is None:
+                if _segment in stored:
+                    removed.append(_segment)
+                continue
+            if stored.get(_segment) != _origin + _destination:
+                outdated.append(_segment + _origin + _destination)
+
+        if outdated:
+            _values = np.array([_row[2:] for _row in outdated], dtype=float)
+            lengths = geodesic_inverse_batch(*_values.T)[0]
+            db_connection.executemany(
+                "REPLACE INTO route_lengths(Origin, Destination, "
+                "OriginLatitude, OriginLongitude, DestinationLatitude, "
+                "DestinationLongitude, Length) VALUES(?, ?, ?, ?, ?, ?, ?)",
+                (
+                    _row + (float(_length),)
+                    for _row, _length in zip(outdated, lengths)
+                ),
+            )
+        db_connection.executemany(
+            "DELETE FROM route_lengths WHERE Origin=? AND Destination=?",
+            removed,
+        )
+        db_connection.commit()
+
+    logger.info(
+        f"route lengths: {len(outdated)} computed, {len(removed)} removed."
+    )
+
+
+def main() -> None:
+    refresh_route_lengths(collect_segments())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,14 @@
 #!/usr/bin/env python3
 import time
-import json
 import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
+from typing import NamedTuple
 import arrow
 import redis
+import numpy as np
 import fmo_data
 import ham_data
 import avinor_data
@@ -13,17 +18,29 @@ import sia_cargo_data
 import aa_cargo_data
 import united_cargo_data
 from airline_info import get_airline_icaos
-from route_utils import route_check_simple, estimate_progress
+from route_utils import (
+    route_check_simple,
+    route_check_batch,
+    estimate_progress,
+)
 from route_info import (
-    set_checked_flightroute,
+    queue_checked_flightroute,
     get_recent_callsigns,
-    increase_error_count,
+    queue_error_count_increase,
+    flush_queued_writes,
 )
 import flight_data_source
 import vrs_standing_data as vsd
+from opensky_positions import PositionTable, PositionStreamReader
 
 logging.basicConfig(level=logging.INFO)
 redis_connection = redis.Redis(decode_responses=True)
+# The columnar position snapshot is binary data.
+redis_binary_connection = redis.Redis()
+position_reader = PositionStreamReader(redis_binary_connection)
+# Number of requests sent to Redis in the current cycle, each of them
+# being a single command or a whole pipeline.
+redis_round_trips = 0
 
 
 def _filter_candidates(candidates, route):
@@ -36,10 +53,146 @@ def _filter_candidates(candidates, route):
     ]
 
 
-def process_data_source(
+def _execute_pipeline(pipeline: redis.client.Pipeline) -> list:
+    global redis_round_trips
+    if len(pipeline) == 0:
+        return []
+    redis_round_trips += 1
+    return pipeline.execute()
+
+
+def _index_candidates(
+    positions: PositionTable, excluded_callsigns: set
+) -> dict[str, dict[str, list[str]]]:
+    """Maps operator ICAO codes to the callsigns of their active flights,
+    split into numerical and alphanumerical callsigns. Excluded callsigns
+    are omitted."""
+    candidate_index = {}
+    _numerical = ~np.isnan(positions.columns["callsign_number"])
+    for _callsign, _is_numerical in zip(
+        positions.callsigns, _numerical.tolist()
+    ):
+        if _callsign in excluded_callsigns:
+            continue
+        _operator_candidates = candidate_index.setdefault(
+            _callsign[:3], {"numerical": [], "alphanumerical": []}
+        )
+        if _is_numerical:
+            _operator_candidates["numerical"].append(_callsign)
+        else:
+            _operator_candidates["alphanumerical"].append(_callsign)
+    return candidate_index
+
+
+_MISSING = object()
+
+
+class RouteCheckCache:
+    """Route check results per callsign and route. The results of a callsign
+    are kept until its position changes significantly."""
+
+    def __init__(self):
+        self._results = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, callsign: str, key: tuple):
+        _result = self._results.get(callsign, {}).get(key, _MISSING)
+        with self._lock:
+            if _result is _MISSING:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return _result
+
+    def set(self, callsign: str, key: tuple, result) -> None:
+        with self._lock:
+            self._results.setdefault(callsign, {})[key] = result
+
+    def invalidate(self, callsigns) -> None:
+        with self._lock:
+            for _callsign in callsigns:
+                self._results.pop(_callsign, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._results.clear()
+
+    def reset_statistics(self) -> None:
+        self.hits = 0
+        self.misses = 0
+
+
+route_check_cache = RouteCheckCache()
+
+
+def _cached_route_check_simple(
+    position_table: PositionTable, callsign: str, route: str
+):
+    result = route_check_cache.get(callsign, ("simple", route))
+    if result is _MISSING:
+        result = route_check_simple(position_table[callsign], route)
+        route_check_cache.set(callsign, ("simple", route), result)
+    return result
+
+
+def _cached_route_check_batch(
+    position_table: PositionTable, callsigns: list[str], route: str
+) -> list:
+    results = [
+        route_check_cache.get(_callsign, ("batch", route))
+        for _callsign in callsigns
+    ]
+    _missing = [
+        _callsign
+        for _callsign, _result in zip(callsigns, results)
+        if _result is _MISSING
+    ]
+    if not _missing:
+        return results
+    # Only callsigns without a valid cached result are checked.
+    _new_results = iter(
+        route_check_batch(position_table.take(_missing), [route])[:, 0]
+    )
+    for _i, _callsign in enumerate(callsigns):
+        if results[_i] is _MISSING:
+            results[_i] = next(_new_results)
+            route_check_cache.set(_callsign, ("batch", route), results[_i])
+    return results
+
+
+class PositionSnapshot(NamedTuple):
+    """Immutable state of one matcher cycle shared by all data sources."""
+
+    utc: int
+    active_flights: PositionTable
+    recent_callsigns: set
+    candidate_index: dict
+    callsign_translation: dict
+
+
+class Evaluation(NamedTuple):
+    """Result of evaluate_data_source to be applied by a single writer.
+    writes holds ("route", flight, quality) and ("error", callsign, route)
+    entries in their original order. candidate_updates holds the candidate
+    bookkeeping per flight as (flight, key, failed, matching, decide)."""
+
+    writes: list[tuple]
+    candidate_updates: list[tuple]
+
+
+def evaluate_data_source(
     data_source: flight_data_source.FlightDataSource,
-) -> None:
-    for _flight in data_source.get_active_flights(utc):
+    snapshot: PositionSnapshot,
+) -> Evaluation:
+    """Matches the active flights of a data source against the snapshot
+    without writing to SQLite or Redis. Safe to run in worker threads."""
+    active_flights = snapshot.active_flights
+    recent_callsigns = snapshot.recent_callsigns
+    writes = []
+    candidate_updates = []
+    for _flight in data_source.get_active_flights(snapshot.utc):
         if _flight.get("status") == "cancelled":
             logging.debug("skipping cancelled flight: {_flight}")
             continue
@@ -65,8 +218,8 @@ def process_data_source(
         assumed_callsign = "{}{}".format(
             _flight["airline_icao"], _flight["flight_number"]
         )
-        translated_callsign = redis_connection.hget(
-            "callsign_translation", assumed_callsign
+        translated_callsign = snapshot.callsign_translation.get(
+            assumed_callsign
         )
         _callsign = None
         _quality = 0
@@ -96,15 +249,15 @@ def process_data_source(
             continue
         if _callsign is not None:
             # We need to validate our match.
-            check_result = route_check_simple(
-                active_flights[_callsign], _flight["route"]
+            check_result = _cached_route_check_simple(
+                active_flights, _callsign, _flight["route"]
             )
             if check_result is None:
                 continue
             if not check_result["check_failed"]:
                 _flight["callsign"] = _callsign
-                _flight["source"] = _data_source.source
-                set_checked_flightroute(_flight, quality=_quality)
+                _flight["source"] = data_source.source
+                writes.append(("route", _flight, _quality))
             else:
                 logging.warning(
                     f"check failed for: {_callsign} {_flight['route']}"
@@ -114,28 +267,27 @@ def process_data_source(
                         _callsign, check_result, active_flights[_callsign]
                     )
                 )
-                increase_error_count(_callsign, _flight["route"])
+                writes.append(("error", _callsign, _flight["route"]))
             continue
-        _my_progress = float("nan")
-        _time_progress = estimate_progress(_flight, utc)
+        _time_progress = estimate_progress(_flight, snapshot.utc)
         # At this point, we compare aircraft positions of the target operator
-        # to the wanted flight.
-        for _candidate in active_flights:
-            if _candidate[:3] != _airline_icao:
-                continue
-            if _candidate in recent_callsigns:
-                # If a simple fit for this flight has been seen recently,
-                # we skip the following process.
-                continue
-            if active_flights[_candidate].get("callsign_number") is not None:
-                if not data_source.allow_numerical_candidates:
-                    continue
-            elif not data_source.allow_alphanumerical_candidates:
-                continue
-            _check_result = route_check_simple(
-                active_flights[_candidate], _flight["route"]
-            )
-            if _check_result is None:
+        # to the wanted flight. Callsigns with a simple fit seen recently
+        # are not part of the candidate index.
+        _operator_candidates = snapshot.candidate_index.get(_airline_icao, {})
+        _candidates = []
+        if data_source.allow_numerical_candidates:
+            _candidates.extend(_operator_candidates.get("numerical", []))
+        if data_source.allow_alphanumerical_candidates:
+            _candidates.extend(_operator_candidates.get("alphanumerical", []))
+        # All candidates of the operator without a cached result are checked
+        # in one vectorized call.
+        _check_results = _cached_route_check_batch(
+            active_flights, _candidates, _flight["route"]
+        )
+        _failed_candidates = []
+        _matching_candidates = []
+        for _candidate, _check_result in zip(_candidates, _check_results):
+            if not _check_result["valid"]:
                 logging.warning(
                     "check not possible for {} {}".format(
                         active_flights[_candidate], _flight
@@ -143,47 +295,118 @@ def process_data_source(
                 )
                 continue
             if _check_result["check_failed"] == True:
-                redis_connection.sadd(f"failed_candidates:{_key}", _candidate)
-                redis_connection.expire(f"failed_candidates:{_key}", 24 * 3600)
-                increase_error_count(_candidate, _flight["route"])
+                _failed_candidates.append(_candidate)
+                writes.append(("error", _candidate, _flight["route"]))
                 continue
             elif _check_result["check_failed"] == False:
                 if -0.4 < _check_result["progress"] - _time_progress < 0.2:
-                    redis_connection.sadd(f"candidates:{_key}", _candidate)
-                    redis_connection.expire(f"candidates:{_key}", 24 * 3600)
-        if 1 > _time_progress > 0.1:
-            _first_choice = redis_connection.sdiff(
-                f"candidates:{_key}", f"failed_candidates:{_key}"
-            ).difference(recent_callsigns)
-            _second_choice = (
-                redis_connection.smembers(f"candidates:{_key}")
-                .difference(recent_callsigns)
-                .difference(_first_choice)
+                    _matching_candidates.append(_candidate)
+        candidate_updates.append(
+            (
+                _flight,
+                _key,
+                _failed_candidates,
+                _matching_candidates,
+                1 > _time_progress > 0.1,
             )
-            _first_candidates = _filter_candidates(
-                _first_choice, _flight["route"]
+        )
+    return Evaluation(writes, candidate_updates)
+
+
+def apply_evaluation(
+    data_source: flight_data_source.FlightDataSource,
+    snapshot: PositionSnapshot,
+    evaluation: Evaluation,
+) -> None:
+    """Queues the route writes of an evaluation and performs its candidate
+    bookkeeping in Redis. Must only be called from the single writer."""
+    for _write in evaluation.writes:
+        if _write[0] == "route":
+            queue_checked_flightroute(_write[1], quality=_write[2])
+        else:
+            queue_error_count_increase(_write[1], _write[2])
+    # The candidate bookkeeping of all flights is sent as a single pipeline.
+    # Flights due for a candidate decision are evaluated afterwards.
+    pipeline = redis_connection.pipeline(transaction=False)
+    pending_flights = []
+    for (
+        _flight,
+        _key,
+        _failed,
+        _matching,
+        _decide,
+    ) in evaluation.candidate_updates:
+        if _failed:
+            pipeline.sadd(f"failed_candidates:{_key}", *_failed)
+            pipeline.expire(f"failed_candidates:{_key}", 24 * 3600)
+        if _matching:
+            pipeline.sadd(f"candidates:{_key}", *_matching)
+            pipeline.expire(f"candidates:{_key}", 24 * 3600)
+        if _decide:
+            # The position of the replies within the pipeline results.
+            pending_flights.append((_flight, len(pipeline)))
+            pipeline.sdiff(f"candidates:{_key}", f"failed_candidates:{_key}")
+            pipeline.smembers(f"candidates:{_key}")
+    results = _execute_pipeline(pipeline)
+    recent_callsigns = snapshot.recent_callsigns
+    for _flight, _position in pending_flights:
+        _first_choice = results[_position].difference(recent_callsigns)
+        _second_choice = (
+            results[_position + 1]
+            .difference(recent_callsigns)
+            .difference(_first_choice)
+        )
+        _first_candidates = _filter_candidates(_first_choice, _flight["route"])
+        if len(_first_candidates) == 1:
+            _quality = 1
+            _callsign = _first_candidates[0]
+            _flight["callsign"] = _callsign
+            _flight["source"] = data_source.source
+            queue_checked_flightroute(_flight, quality=_quality)
+            continue
+        elif len(_first_candidates) == 0:
+            _second_candidates = _filter_candidates(
+                _second_choice, _flight["route"]
             )
-            if len(_first_candidates) == 1:
-                _quality = 1
-                _callsign = _first_candidates[0]
+            if len(_second_candidates) == 1:
+                _quality = 0
+                _callsign = _second_candidates[0]
                 _flight["callsign"] = _callsign
-                _flight["source"] = _data_source.source
-                set_checked_flightroute(_flight, quality=_quality)
+                _flight["source"] = data_source.source
+                queue_checked_flightroute(_flight, quality=_quality)
                 continue
-            elif len(_first_candidates) == 0:
-                _second_candidates = _filter_candidates(
-                    _second_choice, _flight["route"]
-                )
-                if len(_second_candidates) == 1:
-                    _quality = 0
-                    _callsign = _second_candidates[0]
-                    _flight["callsign"] = _callsign
-                    _flight["source"] = _data_source.source
-                    set_checked_flightroute(_flight, quality=_quality)
-                    continue
+
+
+def process_data_source(
+    data_source: flight_data_source.FlightDataSource,
+    snapshot: PositionSnapshot,
+) -> None:
+    apply_evaluation(
+        data_source, snapshot, evaluate_data_source(data_source, snapshot)
+    )
+
+
+def _timed_evaluation(
+    data_source: flight_data_source.FlightDataSource,
+    snapshot: PositionSnapshot,
+) -> tuple[Evaluation, float]:
+    _start = time.time()
+    evaluation = evaluate_data_source(data_source, snapshot)
+    return evaluation, time.time() - _start
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Match flights of all data sources to OpenSky positions."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of data sources evaluated concurrently (default: 1)",
+    )
+    args = parser.parse_args()
+
     data_sources = [
         fmo_data.Airport(),
         ham_data.Airport(),
@@ -194,37 +417,94 @@ if __name__ == "__main__":
         aa_cargo_data.Airline(),
         united_cargo_data.Airline(),
     ]
+    # Data sources are evaluated by worker threads while the main thread
+    # remains the single writer to SQLite and Redis.
+    executor = (
+        ThreadPoolExecutor(max_workers=args.workers)
+        if args.workers > 1
+        else None
+    )
 
     supported_airlines = set()
     while True:
         t_start = time.time()
         for _data_source in data_sources:
             supported_airlines.update(_data_source.get_supported_airlines())
-        recent_callsigns = get_recent_callsigns()
-        opensky_data = redis_connection.get("opensky_positions")
-        if opensky_data is None:
+        recent_callsigns = set(get_recent_callsigns())
+        # The position deltas are read in a single round trip unless the
+        # reader needs to resync from the snapshot.
+        redis_round_trips = 1
+        active_flights = position_reader.update()
+        if active_flights is None:
             time.sleep(5)
             continue
-        opensky_data = json.loads(opensky_data)
-        active_flights = opensky_data["positions"]
-        for _flight in active_flights.values():
-            operator_icao = _flight["operator_icao"]
+        if position_reader.resynced:
+            route_check_cache.clear()
+        else:
+            route_check_cache.invalidate(
+                position_reader.changed | position_reader.removed
+            )
+        route_check_cache.reset_statistics()
+        pipeline = redis_connection.pipeline(transaction=False)
+        # The translation table is read once per cycle.
+        pipeline.hgetall("callsign_translation")
+        for operator_icao, _icao24 in zip(
+            active_flights.columns["operator_icao"].tolist(),
+            active_flights.columns["icao24"].tolist(),
+        ):
+            operator_icao = operator_icao.decode()
             if operator_icao not in supported_airlines:
                 continue
-            redis_connection.sadd(
-                f"aircraft_icao24s:{operator_icao}", _flight["icao24"]
+            pipeline.sadd(
+                f"aircraft_icao24s:{operator_icao}", _icao24.decode()
             )
-        utc = opensky_data["states_time"]
+        callsign_translation = _execute_pipeline(pipeline)[0]
+        snapshot = PositionSnapshot(
+            utc=active_flights.states_time,
+            active_flights=active_flights,
+            recent_callsigns=recent_callsigns,
+            candidate_index=_index_candidates(
+                active_flights, recent_callsigns
+            ),
+            callsign_translation=callsign_translation,
+        )
         logging.info(
             "### UTC {} ###".format(
-                arrow.get(utc).format("YYYY-MM-DD HH:mm:ss")
+                arrow.get(snapshot.utc).format("YYYY-MM-DD HH:mm:ss")
             )
         )
-        for _data_source in data_sources:
-            process_data_source(_data_source)
+        if executor is None:
+            evaluations = (
+                _timed_evaluation(_data_source, snapshot)
+                for _data_source in data_sources
+            )
+        else:
+            evaluations = executor.map(
+                _timed_evaluation, data_sources, repeat(snapshot)
+            )
+        # Evaluations are applied in the order of data_sources, each one as
+        # soon as it is available.
+        for _data_source, (_evaluation, _evaluation_time) in zip(
+            data_sources, evaluations
+        ):
+            _start = time.time()
+            apply_evaluation(_data_source, snapshot, _evaluation)
+            logging.info(
+                f"{_data_source.source}: evaluated in "
+                f"{_evaluation_time:.2f}s, applied in "
+                f"{time.time() - _start:.2f}s."
+            )
+        # All route updates of this cycle are written in one transaction.
+        flush_queued_writes()
         t_end = time.time()
         processing_time = t_end - t_start
         logging.info(f"processing time: {processing_time:.2f}s")
+        logging.info(f"redis round trips: {redis_round_trips}")
+        logging.info(
+            f"route checks: {route_check_cache.hits} cached, "
+            f"{route_check_cache.misses} computed, "
+            f"{len(position_reader.changed)} positions changed."
+        )
         sleep_time = max((45 - processing_time), 0)
         logging.info(f"### sleeping for {sleep_time:.2f} seconds. ###")
         time.sleep(sleep_time)
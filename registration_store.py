@@ -0,0 +1,186 @@
+import io
+import os
+import re
+import json
+from collections.abc import Mapping
+import numpy as np
+
+# icao24s in this format are stored as 24-bit integers, others are kept in
+# the overlay dict.
+_HEX_KEY = re.compile("[0-9a-f]{6}")
+_HEX_VALUES = np.full(128, 255, dtype=np.uint8)
+for _i, _char in enumerate("0123456789abcdef"):
+    _HEX_VALUES[ord(_char)] = _i
+_HEX_SHIFTS = np.arange(20, -1, -4, dtype=np.uint32)
+
+
+def _compact_key(icao24: str) -> int | None:
+    if _HEX_KEY.fullmatch(icao24) is None:
+        return None
+    return int(icao24, 16)
+
+
+def _compact_keys(icao24s) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the integer keys of a list of icao24s and a mask of the
+    icao24s which can be stored as integer keys."""
+    _codes = np.array(icao24s, dtype="U7").view(np.uint32).reshape(-1, 7)
+    _values = _HEX_VALUES[np.minimum(_codes[:, :6], 127)]
+    valid = (_values != 255).all(axis=1) & (_codes[:, 6] == 0)
+    keys = (_values.astype(np.uint32) << _HEX_SHIFTS).sum(
+        axis=1, dtype=np.uint32
+    )
+    return keys, valid
+
+
+class RegistrationStore(Mapping):
+    """Read-mostly mapping of icao24 to registration. The entries are stored
+    as sorted 24-bit integer keys with offsets into one string of all
+    registrations. Entries added by update() go to an overlay dict first and
+    are merged into the arrays by compact()."""
+
+    # Size of the overlay dict triggering compact() in update().
+    COMPACT_THRESHOLD = 4096
+
+    def __init__(self, mapping=None):
+        self._keys = np.empty(0, dtype=np.uint32)
+        self._offsets = np.zeros(1, dtype=np.uint32)
+        self._registrations = ""
+        self._overlay = {}
+        if mapping:
+            self.update(mapping)
+            self.compact()
+
+    @classmethod
+    def from_json(cls, path) -> "RegistrationStore":
+        with open(path, encoding="utf-8") as _f:
+            return cls(json.load(_f))
+
+    @classmethod
+    def load(cls, path) -> "RegistrationStore":
+        """Loads a store written by save()."""
+        store = cls()
+        with np.load(path) as _data:
+            store._keys = _data["keys"]
+            store._offsets = _data["offsets"]
+            store._registrations = _data["registrations"].tobytes().decode()
+            store._overlay = json.loads(_data["overlay"].tobytes())
+        return store
+
+    def save(self, path) -> None:
+        """Writes the store to a .npz file, replacing it atomically."""
+        _buffer = io.BytesIO()
+        np.savez(
+            _buffer,
+            keys=self._keys,
+            offsets=self._offsets,
+            registrations=np.frombuffer(
+                self._registrations.encode(), dtype=np.uint8
+            ),
+            overlay=np.frombuffer(
+                json.dumps(self._overlay).encode(), dtype=np.uint8
+            ),
+        )
+        _staging = f"{path}.{os.getpid()}.tmp"
+        with open(_staging, "wb") as _f:
+            _f.write(_buffer.getbuffer())
+        os.replace(_staging, path)
+
+    def _index(self, key: int) -> int | None:
+        _index = int(self._keys.searchsorted(np.uint32(key)))
+        if _index < len(self._keys) and self._keys[_index] == key:
+            return _index
+        return None
+
+    def _in_arrays(self, icao24: str) -> int | None:
+        _key = _compact_key(icao24)
+        return None if _key is None else self._index(_key)
+
+    def _registration(self, index: int) -> str:
+        return self._registrations[
+            self._offsets[index] : self._offsets[index + 1]
+        ]
+
+    def __getitem__(self, icao24: str) -> str:
+        registration = self._overlay.get(icao24)
+        if registration is not None:
+            return registration
+        _index = self._in_arrays(icao24)
+        if _index is None:
+            raise KeyError(icao24)
+        return self._registration(_index)
+
+    def __iter__(self):
+        for _key in self._keys.tolist():
+            _icao24 = f"{_key:06x}"
+            if _icao24 not in self._overlay:
+                yield _icao24
+        yield from self._overlay
+
+    def __len__(self) -> int:
+        return len(self._keys) + sum(
+            1 for _icao24 in self._overlay if self._in_arrays(_icao24) is None
+        )
+
+    def get_many(self, icao24s: list[str]) -> list[str | None]:
+        """Returns the registrations of a list of icao24s, None for unknown
+        icao24s."""
+        registrations = [None] * len(icao24s)
+        if len(icao24s) > 0 and len(self._keys) > 0:
+            keys, valid = _compact_keys(icao24s)
+            _indices = np.minimum(
+                self._keys.searchsorted(keys), len(self._keys) - 1
+            )
+            _found = np.flatnonzero(valid & (self._keys[_indices] == keys))
+            _indices = _indices[_found]
+            for _i, _start, _end in zip(
+                _found.tolist(),
+                self._offsets[_indices].tolist(),
+                self._offsets[_indices + 1].tolist(),
+            ):
+                registrations[_i] = self._registrations[_start:_end]
+        if self._overlay:
+            for _i, _icao24 in enumerate(icao24s):
+                _registration = self._overlay.get(_icao24)
+                if _registration is not None:
+                    registrations[_i] = _registration
+        return registrations
+
+    def update(self, mapping) -> None:
+        self._overlay.update(mapping)
+        if len(self._overlay) >= self.COMPACT_THRESHOLD:
+            self.compact()
+
+    def compact(self) -> None:
+        """Merges the overlay entries with valid icao24s into the arrays."""
+        _icao24s = list(self._overlay)
+        _registrations = list(self._overlay.values())
+        keys, valid = _compact_keys(_icao24s)
+        self._overlay = {
+            _icao24s[_i]: _registrations[_i]
+            for _i in np.flatnonzero(~valid).tolist()
+        }
+        # Entries from the overlay come last and replace existing ones.
+        keys = np.concatenate([self._keys, keys[valid]])
+        registrations = [
+            self._registrations[_start:_end]
+            for _start, _end in zip(
+                self._offsets[:-1].tolist(), self._offsets[1:].tolist()
+            )
+        ]
+        registrations.extend(
+            _registrations[_i] for _i in np.flatnonzero(valid).tolist()
+        )
+        _order = np.argsort(keys, kind="stable")
+        keys = keys[_order]
+        _last = np.ones(len(keys), dtype=bool)
+        _last[:-1] = keys[1:] != keys[:-1]
+        keys = keys[_last]
+        registrations = [registrations[_i] for _i in _order[_last].tolist()]
+        offsets = np.zeros(len(keys) + 1, dtype=np.uint32)
+        np.cumsum(
+            [len(_registration) for _registration in registrations],
+            out=offsets[1:],
+        )
+        self._keys = keys
+        self._offsets = offsets
+        self._registrations = "".join(registrations)
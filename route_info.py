@@ -2,12 +2,26 @@ import os
 import time
 import sqlite3
 import logging
+import threading
 from config import OUTDATED
 
 PWD = os.path.dirname(os.path.abspath(__file__))
 ROUTES_DB_FILE = f"{PWD}/flight_routes.sqb"
 
+# Applied to every connection. WAL allows the review scripts to read while
+# the matcher writes. synchronous=NORMAL is safe in WAL mode and avoids an
+# fsync per commit. A negative cache_size is given in KiB.
+_CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16384",
+    "PRAGMA temp_store=MEMORY",
+)
+_CACHED_STATEMENTS = 256
+
+_local = threading.local()
+
 db_connection = sqlite3.connect(ROUTES_DB_FILE)
+db_connection.execute("PRAGMA journal_mode=WAL")
 _cursor = db_connection.cursor()
 _cursor.execute(
     "SELECT count(name) FROM sqlite_master "
@@ -34,74 +48,152 @@ _sql_key_translation = {
 }
 
 
+def _get_connection() -> sqlite3.Connection:
+    """Returns the connection of the current thread, which is opened on first
+    use and reused afterwards so that prepared statements stay cached. A
+    forked process opens its own connection."""
+    connection = getattr(_local, "connection", None)
+    if connection is None or _local.pid != os.getpid():
+        connection = sqlite3.connect(
+            ROUTES_DB_FILE, cached_statements=_CACHED_STATEMENTS
+        )
+        connection.row_factory = sqlite3.Row
+        for _pragma in _CONNECTION_PRAGMAS:
+            connection.execute(_pragma)
+        _local.connection = connection
+        _local.pid = os.getpid()
+    return connection
+
+
+def close_connection() -> None:
+    """Closes the connection of the current thread, e.g. before a worker
+    thread terminates."""
+    connection = getattr(_local, "connection", None)
+    if connection is not None:
+        _local.connection = None
+        if _local.pid == os.getpid():
+            connection.close()
+
+
+# Sources of lower quality must not overwrite a route unless it is outdated
+# or has seen many errors. ValidFrom and Errors are kept as long as the
+# flight number and operator of the route do not change.
+_UPSERT_FLIGHTROUTE = (
+    "INSERT INTO flight_routes (Callsign, Route, Source, OperatorIcao, "
+    "OperatorIata, FlightNumber, Quality, Errors, UpdateTime, ValidFrom) "
+    "VALUES (:callsign, :route, :source, :operator_icao, :operator_iata, "
+    ":flight_number, :quality, 0, :utc, :utc) "
+    "ON CONFLICT (Callsign, Route) DO UPDATE SET "
+    "Source = excluded.Source, "
+    "OperatorIcao = excluded.OperatorIcao, "
+    "OperatorIata = excluded.OperatorIata, "
+    "FlightNumber = excluded.FlightNumber, "
+    "Quality = excluded.Quality, "
+    "UpdateTime = excluded.UpdateTime, "
+    "Errors = CASE WHEN FlightNumber IS excluded.FlightNumber "
+    "AND OperatorIata IS excluded.OperatorIata AND ValidFrom IS NOT NULL "
+    "AND NOT :reset_errors THEN Errors ELSE 0 END, "
+    "ValidFrom = CASE WHEN FlightNumber IS excluded.FlightNumber "
+    "AND OperatorIata IS excluded.OperatorIata AND ValidFrom IS NOT NULL "
+    "THEN ValidFrom ELSE excluded.ValidFrom END "
+    "WHERE NOT (IFNULL(Quality, 0) > excluded.Quality "
+    "AND UpdateTime >= :outdated AND IFNULL(Errors, 0) <= 10)"
+)
+_INCREASE_ERROR_COUNT = (
+    "UPDATE flight_routes SET Errors = Errors + 1 "
+    "WHERE Callsign=? AND Route=?"
+)
+
+_queued_writes = []
+_queue_lock = threading.Lock()
+
+
+def _flightroute_parameters(
+    flight: dict, quality: int, reset_errors: bool
+) -> dict:
+    return {
+        "callsign": flight["callsign"],
+        "route": flight["route"],
+        "source": flight["source"],
+        "operator_icao": flight["airline_icao"],
+        "operator_iata": flight["airline_iata"],
+        "flight_number": flight["flight_number"],
+        "quality": quality,
+        "reset_errors": reset_errors,
+        "utc": int(time.time()),
+        "outdated": OUTDATED,
+    }
+
+
 def set_checked_flightroute(
     flight: dict, quality: int = 0, reset_errors: bool = False
 ) -> bool:
-    utc = time.time()
-    old_flight = get_checked_flightroute(flight["callsign"], flight["route"])
-    valid_from = int(utc)
-    errors = 0
-    if old_flight is not None:
-        if old_flight["quality"] < quality:
-            # allow sources of better quality to overwrite
-            pass
-        elif old_flight["update_time"] < OUTDATED:
-            pass
-        elif old_flight["errors"] > 10:
-            # old record will be overwritten
-            pass
-        elif old_flight["quality"] > quality:
-            # Deny sources of lower quality to overwrite except for
-            # many errors or outdated data.
-            return False
-        if (
-            old_flight["flight_number"] == flight["flight_number"]
-            and old_flight["operator_iata"] == flight["airline_iata"]
-            and old_flight["valid_from"] is not None
-        ):
-            valid_from = old_flight["valid_from"]
-            if not reset_errors:
-                errors = old_flight["errors"]
-        logging.debug(
-            "updating flight in database: {} {}".format(
-                flight["callsign"], flight["route"]
-            )
-        )
-    else:
-        logging.info(
-            "added flight to database: {} {}".format(
-                flight["callsign"], flight["route"]
-            )
-        )
-    connection = sqlite3.connect(ROUTES_DB_FILE)
-    connection.row_factory = sqlite3.Row
+    connection = _get_connection()
     _cursor = connection.cursor()
     _cursor.execute(
-        "REPLACE INTO flight_routes (Callsign, Route, Source, OperatorIcao, "
-        "OperatorIata, FlightNumber, Quality, Errors, UpdateTime, ValidFrom) "
-        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-        (
-            flight["callsign"],
-            flight["route"],
-            flight["source"],
-            flight["airline_icao"],
-            flight["airline_iata"],
-            flight["flight_number"],
-            quality,
-            errors,
-            int(utc),
-            valid_from,
-        ),
+        _UPSERT_FLIGHTROUTE,
+        _flightroute_parameters(flight, quality, reset_errors),
     )
+    stored = _cursor.rowcount > 0
     _cursor.close()
     connection.commit()
-    connection.close()
-    return True
+    if stored:
+        logging.debug(
+            "stored flight in database: {} {}".format(
+                flight["callsign"], flight["route"]
+            )
+        )
+    return stored
+
+
+def queue_checked_flightroute(
+    flight: dict, quality: int = 0, reset_errors: bool = False
+) -> None:
+    """Like set_checked_flightroute, but the write is deferred until
+    flush_queued_writes() is called."""
+    _parameters = _flightroute_parameters(flight, quality, reset_errors)
+    with _queue_lock:
+        _queued_writes.append((_UPSERT_FLIGHTROUTE, _parameters))
+
+
+def queue_error_count_increase(callsign: str, route: str) -> None:
+    """Like increase_error_count, but the write is deferred until
+    flush_queued_writes() is called."""
+    with _queue_lock:
+        _queued_writes.append((_INCREASE_ERROR_COUNT, (callsign, route)))
+
+
+def flush_queued_writes() -> tuple[int, int]:
+    """Executes all queued writes in their queued order within a single
+    transaction. Returns the number of stored flight routes and of increased
+    error counts."""
+    global _queued_writes
+    with _queue_lock:
+        writes = _queued_writes
+        _queued_writes = []
+    if not writes:
+        return 0, 0
+    stored_routes = 0
+    increased_errors = 0
+    connection = _get_connection()
+    with connection:
+        _cursor = connection.cursor()
+        for _statement, _parameters in writes:
+            _cursor.execute(_statement, _parameters)
+            if _statement is _UPSERT_FLIGHTROUTE:
+                stored_routes += _cursor.rowcount
+            else:
+                increased_errors += _cursor.rowcount
+        _cursor.close()
+    logging.info(
+        f"flushed {len(writes)} queued writes: {stored_routes} flight routes "
+        f"stored, {increased_errors} error counts increased."
+    )
+    return stored_routes, increased_errors
 
 
 def get_checked_flightroute(callsign: str, route: str) -> dict:
-    connection = sqlite3.connect(ROUTES_DB_FILE)
-    connection.row_factory = sqlite3.Row
+    connection = _get_connection()
     _cursor = connection.cursor()
     _cursor.execute(
         "SELECT * from flight_routes WHERE Callsign=? AND Route=?",
@@ -109,7 +201,6 @@ def get_checked_flightroute(callsign: str, route: str) -> dict:
     )
     result = _cursor.fetchone()
     _cursor.close()
-    connection.close()
     if result is None:
         return None
     result = dict(result)
@@ -119,8 +210,7 @@ def get_checked_flightroute(callsign: str, route: str) -> dict:
 
 
 def get_flights_by_number(operator_iata: str, flight_number: int) -> list[dict]:
-    connection = sqlite3.connect(ROUTES_DB_FILE)
-    connection.row_factory = sqlite3.Row
+    connection = _get_connection()
     _cursor = connection.cursor()
     _cursor.execute(
         "SELECT * from flight_routes WHERE OperatorIata=? AND FlightNumber=?",
@@ -128,7 +218,6 @@ def get_flights_by_number(operator_iata: str, flight_number: int) -> list[dict]:
     )
     results = _cursor.fetchall()
     _cursor.close()
-    connection.close()
     if results is None:
         return []
     results = [dict(_row) for _row in results]
@@ -139,8 +228,7 @@ def get_flights_by_number(operator_iata: str, flight_number: int) -> list[dict]:
 
 
 def get_flights_by_callsign(callsign: str) -> list[dict]:
-    connection = sqlite3.connect(ROUTES_DB_FILE)
-    connection.row_factory = sqlite3.Row
+    connection = _get_connection()
     _cursor = connection.cursor()
     _cursor.execute(
         "SELECT * from flight_routes WHERE Callsign=? AND "
@@ -149,7 +237,6 @@ def get_flights_by_callsign(callsign: str) -> list[dict]:
     )
     results = _cursor.fetchall()
     _cursor.close()
-    connection.close()
     if results is None:
         return []
     results = [dict(_row) for _row in results]
@@ -160,8 +247,7 @@ def get_flights_by_callsign(callsign: str) -> list[dict]:
 
 
 def reset_error_count(callsign: str, route: str) -> None:
-    connection = sqlite3.connect(ROUTES_DB_FILE)
-    connection.row_factory = sqlite3.Row
+    connection = _get_connection()
     _cursor = connection.cursor()
     _cursor.execute(
         "UPDATE flight_routes SET Errors = 0 WHERE Callsign=? AND Route=?",
@@ -169,25 +255,18 @@ def reset_error_count(callsign: str, route: str) -> None:
     )
     _cursor.close()
     connection.commit()
-    connection.close()
 
 
 def increase_error_count(callsign: str, route: str) -> None:
-    connection = sqlite3.connect(ROUTES_DB_FILE)
-    connection.row_factory = sqlite3.Row
+    connection = _get_connection()
     _cursor = connection.cursor()
-    _cursor.execute(
-        "UPDATE flight_routes SET Errors = Errors + 1 "
-        "WHERE Callsign=? AND Route=?",
-        (callsign, route),
-    )
+    _cursor.execute(_INCREASE_ERROR_COUNT, (callsign, route))
     _cursor.close()
     connection.commit()
-    connection.close()
 
 
 def get_recent_callsigns(min_quality: int = 1, hours: float = 48) -> list:
-    connection = sqlite3.connect(ROUTES_DB_FILE)
+    connection = _get_connection()
     _cursor = connection.cursor()
     _cursor.execute(
         "SELECT DISTINCT Callsign FROM flight_routes "
@@ -196,7 +275,6 @@ def get_recent_callsigns(min_quality: int = 1, hours: float = 48) -> list:
     )
     results = _cursor.fetchall()
     _cursor.close()
-    connection.close()
     return [_row[0] for _row in results]
 
 
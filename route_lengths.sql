@@ -0,0 +1,10 @@
+CREATE TABLE "route_lengths" (
+	`Origin`	TEXT,
+	`Destination`	TEXT,
+	`OriginLatitude`	REAL,
+	`OriginLongitude`	REAL,
+	`DestinationLatitude`	REAL,
+	`DestinationLongitude`	REAL,
+	`Length`	REAL,
+	PRIMARY KEY(`Origin`, `Destination`)
+);
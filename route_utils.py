@@ -1,12 +1,33 @@
 import re
 import time
 import logging
+import pathlib
+import sqlite3
+from functools import lru_cache
 import numpy as np
 import arrow
 import pygeodesy.ellipsoidalVincenty as ev
 import pygeodesy.ellipsoidalExact as ee
 from airport_info import get_airport_info, get_airport_iata
 
+PWD = pathlib.Path(__file__).resolve().parent
+ROUTE_LENGTH_DB_FILE = PWD / "route_lengths.sqb"
+
+# WGS84 parameters and the convergence limits used by pygeodesy's
+# ellipsoidalVincenty.LatLon, so that the vectorized inverse below stops at
+# the same point as the per-pair code.
+_WGS84_A = 6378137.0
+_WGS84_F = 1 / 298.257223563
+_WGS84_B = _WGS84_A * (1 - _WGS84_F)
+_WGS84_E22 = (_WGS84_A / _WGS84_B) ** 2 - 1
+_VINCENTY_EPSILON = 1e-12
+_VINCENTY_ITERATIONS = 200
+_EPS = np.finfo(float).eps
+
+# Segment lengths keyed by (origin ICAO, destination ICAO), loaded on first
+# use from route_lengths.sqb.
+_route_lengths = None
+
 
 def convert_to_iata_route(route: str) -> str:
     icaos = route.split("-")
@@ -25,7 +46,39 @@ def check_route_airports(route: str, valid_airports: list = None) -> str | None:
     return route
 
 
+def _load_route_lengths() -> dict:
+    # The table is built by prepare_route_lengths.py. Without it, every
+    # segment length is computed on demand.
+    if not ROUTE_LENGTH_DB_FILE.exists():
+        logging.debug(f"{ROUTE_LENGTH_DB_FILE} not found.")
+        return {}
+    with sqlite3.connect(
+        f"file:{ROUTE_LENGTH_DB_FILE}?mode=ro", uri=True
+    ) as connection:
+        cursor = connection.cursor()
+        cursor.execute("SELECT Origin, Destination, Length FROM route_lengths")
+        results = cursor.fetchall()
+        cursor.close()
+    return {(_row[0], _row[1]): _row[2] for _row in results}
+
+
+def reload_route_lengths() -> None:
+    global _route_lengths
+    _route_lengths = _load_route_lengths()
+    _compute_single_route_length.cache_clear()
+
+
 def get_single_route_length(origin_icao, destination_icao):
+    if _route_lengths is None:
+        reload_route_lengths()
+    distance = _route_lengths.get((origin_icao, destination_icao))
+    if distance is None:
+        distance = _compute_single_route_length(origin_icao, destination_icao)
+    return distance
+
+
+@lru_cache(maxsize=4096)
+def _compute_single_route_length(origin_icao, destination_icao):
     origin = get_airport_info(origin_icao)
     destination = get_airport_info(destination_icao)
     try:
@@ -47,6 +100,201 @@ def get_single_route_length(origin_icao, destination_icao):
     return distance
 
 
+def _vincenty_inverse(lat1, lon1, lat2, lon2):
+    """Vectorized Vincenty inverse on WGS84 for 1-D float arrays.
+
+    Returns (distance, initial_bearing, final_bearing, converged). Rows that
+    did not converge (near-antipodal points) or contain NaN are left as NaN
+    with converged set to False.
+    """
+    f = _WGS84_F
+    tan1 = (1 - f) * np.tan(np.radians(lat1))
+    tan2 = (1 - f) * np.tan(np.radians(lat2))
+    c1 = 1 / np.sqrt(1 + tan1**2)
+    c2 = 1 / np.sqrt(1 + tan2**2)
+    s1 = tan1 * c1
+    s2 = tan2 * c2
+    c1c2, s1c2, c1s2, s1s2 = c1 * c2, s1 * c2, c1 * s2, s1 * s2
+    dl = np.radians((lon2 - lon1 + 180) % 360 - 180)
+    ll = dl.copy()
+    size = dl.size
+    ss = np.zeros(size)
+    cs = np.zeros(size)
+    sigma = np.zeros(size)
+    ca2 = np.zeros(size)
+    c2sm = np.zeros(size)
+    converged = np.zeros(size, dtype=bool)
+    coincident = np.zeros(size, dtype=bool)
+    active = np.flatnonzero(
+        np.isfinite(dl) & np.isfinite(s1) & np.isfinite(s2)
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for _ in range(_VINCENTY_ITERATIONS):
+            if active.size == 0:
+                break
+            sll = np.sin(ll[active])
+            cll = np.cos(ll[active])
+            _ss = np.hypot(c2[active] * sll, c1s2[active] - s1c2[active] * cll)
+            _cs = s1s2[active] + c1c2[active] * cll
+            _sigma = np.arctan2(_ss, _cs)
+            _sa = c1c2[active] * sll / _ss
+            _ca2 = 1 - _sa**2
+            _ca2[_ca2 < _EPS] = 0.0
+            _c2sm = np.where(_ca2 > 0, _cs - 2 * s1s2[active] / _ca2, 0.0)
+            _c = f * _ca2 / 16 * (4 + f * (4 - 3 * _ca2))
+            _ll = dl[active] + (1 - _c) * f * _sa * (
+                _sigma + _c * _ss * (_c2sm + _c * _cs * (2 * _c2sm**2 - 1))
+            )
+            ss[active] = _ss
+            cs[active] = _cs
+            sigma[active] = _sigma
+            ca2[active] = _ca2
+            c2sm[active] = _c2sm
+            # Coincident points end the iteration with zero distance, while
+            # antipodal points are ambiguous and left to the fallback.
+            _coincident = _ss < _EPS
+            coincident[active[_coincident & (_cs > 0)]] = True
+            _done = (
+                np.abs(_ll - ll[active]) < _VINCENTY_EPSILON
+            ) & ~_coincident
+            ll[active] = _ll
+            converged[active[_done]] = True
+            active = active[~(_done | _coincident)]
+    u2 = ca2 * _WGS84_E22
+    A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    c2sm2 = 2 * c2sm**2 - 1
+    delta_sigma = (
+        B
+        * ss
+        * (
+            c2sm
+            + B
+            / 4
+            * (c2sm2 * cs - B / 6 * c2sm * (4 * ss**2 - 3) * (2 * c2sm2 - 1))
+        )
+    )
+    distance = _WGS84_B * A * (sigma - delta_sigma)
+    sll = np.sin(ll)
+    cll = np.cos(ll)
+    initial_bearing = np.degrees(np.arctan2(c2 * sll, c1s2 - s1c2 * cll)) % 360
+    final_bearing = np.degrees(np.arctan2(c1 * sll, -s1c2 + c1s2 * cll)) % 360
+    distance[coincident] = 0.0
+    initial_bearing[coincident] = 0.0
+    final_bearing[coincident] = 0.0
+    converged |= coincident
+    distance[~converged] = np.nan
+    initial_bearing[~converged] = np.nan
+    final_bearing[~converged] = np.nan
+    return distance, initial_bearing, final_bearing, converged
+
+
+def geodesic_inverse_batch(lat1, lon1, lat2, lon2):
+    """Distance (m), initial and final bearing (degrees) between point arrays.
+
+    All arguments are broadcast against each other, so e.g. an (N, 1) array
+    of positions and a (1, M) array of airports yield (N, M) results. The
+    Vincenty iteration runs vectorized with pygeodesy's epsilon and iteration
+    limits; only rows that fail to converge are recomputed one by one with
+    ellipsoidalExact, as the per-pair code does. Results agree with
+    ev.LatLon.distanceTo3 within 1 mm and 1e-6 degrees. Rows with NaN input
+    yield NaN.
+    """
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(
+        *(
+            np.asarray(_value, dtype=float)
+            for _value in (lat1, lon1, lat2, lon2)
+        )
+    )
+    shape = lat1.shape
+    lat1, lon1, lat2, lon2 = (
+        np.ravel(_value) for _value in (lat1, lon1, lat2, lon2)
+    )
+    distance, initial_bearing, final_bearing, converged = _vincenty_inverse(
+        lat1, lon1, lat2, lon2
+    )
+    fallback = np.flatnonzero(
+        ~converged
+        & np.isfinite(lat1)
+        & np.isfinite(lon1)
+        & np.isfinite(lat2)
+        & np.isfinite(lon2)
+    )
+    if fallback.size > 0:
+        # this method is much slower and being used as fallback only
+        logging.warning(
+            f"geodesic_inverse_batch: {fallback.size} of {lat1.size} pairs "
+            "did not converge, using exact fallback."
+        )
+    for i in fallback:
+        (
+            distance[i],
+            initial_bearing[i],
+            final_bearing[i],
+        ) = ee.LatLon(
+            lat1[i], lon1[i]
+        ).distanceTo3(ee.LatLon(lat2[i], lon2[i]))
+    return (
+        distance.reshape(shape),
+        initial_bearing.reshape(shape),
+        final_bearing.reshape(shape),
+    )
+
+
+def route_geometry_batch(
+    latitudes,
+    longitudes,
+    origin_latitudes,
+    origin_longitudes,
+    destination_latitudes,
+    destination_longitudes,
+    headings=None,
+) -> dict:
+    """Vectorized geometry of single_route_check_simple.
+
+    Positions and route endpoints are broadcast against each other, so (N, 1)
+    positions and (1, M) routes give (N, M) arrays. Returns a dict of arrays
+    with the keys route_length, dist_origin, dist_destination,
+    bearing_from_origin, bearing_to_destination, deviation, deviation_ratio
+    and progress, plus error_angle if headings are given. Values match the
+    per-pair code within the tolerance of geodesic_inverse_batch.
+    """
+    route_length = geodesic_inverse_batch(
+        origin_latitudes,
+        origin_longitudes,
+        destination_latitudes,
+        destination_longitudes,
+    )[0]
+    dist_origin, _, bearing_from_origin = geodesic_inverse_batch(
+        origin_latitudes, origin_longitudes, latitudes, longitudes
+    )
+    dist_destination, bearing_to_destination, _ = geodesic_inverse_batch(
+        latitudes, longitudes, destination_latitudes, destination_longitudes
+    )
+    route_length = np.broadcast_to(route_length, dist_origin.shape)
+    deviation = dist_origin + dist_destination - route_length
+    with np.errstate(divide="ignore", invalid="ignore"):
+        progress = dist_origin / (dist_origin + dist_destination)
+        deviation_ratio = deviation / route_length
+    response = {
+        "route_length": route_length,
+        "dist_origin": dist_origin,
+        "dist_destination": dist_destination,
+        "bearing_from_origin": bearing_from_origin,
+        "bearing_to_destination": bearing_to_destination,
+        "deviation": deviation,
+        "deviation_ratio": deviation_ratio,
+        "progress": progress,
+    }
+    if headings is not None:
+        response["error_angle"] = np.abs(
+            (np.asarray(headings, dtype=float) - bearing_to_destination + 180)
+            % 360
+            - 180
+        )
+    return response
+
+
 def get_route_length(route):
     icaos = route.split("-")
     assert len(icaos) >= 2
@@ -219,6 +467,186 @@ def route_check_simple(position, route):
     return route_info[np.argmin(route_angle)]
 
 
+ROUTE_CHECK_DTYPE = np.dtype(
+    [
+        ("valid", bool),
+        ("check_failed", bool),
+        ("segment", np.int16),
+        ("route_length", np.float64),
+        ("deviation", np.float64),
+        ("error_angle", np.float64),
+        ("deviation_ratio", np.float64),
+        ("progress", np.float64),
+        ("dist_origin", np.float64),
+        ("dist_destination", np.float64),
+    ]
+)
+
+
+def _position_columns(positions) -> dict:
+    # Accepts either a sequence of position dicts as used by
+    # route_check_simple or a mapping of column name to array.
+    keys = (
+        "latitude",
+        "longitude",
+        "heading",
+        "vertical_rate",
+        "on_ground",
+    )
+    if isinstance(positions, dict):
+        columns = {_key: np.asarray(positions[_key]) for _key in keys}
+    else:
+        columns = {
+            _key: np.array([_position[_key] for _position in positions])
+            for _key in keys
+        }
+    for _key in keys[:4]:
+        columns[_key] = np.array(
+            [np.nan if _value is None else _value for _value in columns[_key]],
+            dtype=float,
+        )
+    columns["on_ground"] = columns["on_ground"].astype(bool)
+    return columns
+
+
+def _route_segments(routes: list) -> tuple:
+    # Splits routes into their segments. Returns the segment endpoint
+    # coordinates, a (routes, max_segments) index into them padded with -1
+    # and a mask of routes route_check_simple would reject with None.
+    coordinates = []
+    segment_index = []
+    route_valid = []
+    for _route in routes:
+        icaos = _route.split("-")
+        _indices = []
+        _valid = not (
+            len(icaos) < 2 or len(icaos) == 2 and icaos[0] == icaos[1]
+        )
+        for i in range(len(icaos) - 1 if _valid else 0):
+            origin = get_airport_info(icaos[i])
+            destination = get_airport_info(icaos[i + 1])
+            if None in (origin, destination) or origin == destination:
+                _valid = False
+                break
+            _indices.append(len(coordinates))
+            coordinates.append(
+                (
+                    origin["Latitude"],
+                    origin["Longitude"],
+                    destination["Latitude"],
+                    destination["Longitude"],
+                )
+            )
+        route_valid.append(_valid)
+        segment_index.append(_indices if _valid else [])
+    max_segments = max([len(_indices) for _indices in segment_index] + [1])
+    padded_index = np.full((len(routes), max_segments), -1, dtype=np.intp)
+    for j, _indices in enumerate(segment_index):
+        padded_index[j, : len(_indices)] = _indices
+    coordinates = np.array(coordinates, dtype=float).reshape(-1, 4)
+    return coordinates, padded_index, np.array(route_valid, dtype=bool)
+
+
+def route_check_batch(positions, routes: list) -> np.ndarray:
+    """Evaluates route_check_simple for every position against every route.
+
+    positions is a sequence of position dicts or a mapping of column arrays
+    (latitude, longitude, heading, vertical_rate, on_ground), routes a list
+    of route strings. Returns a (positions, routes) array of
+    ROUTE_CHECK_DTYPE. Entries where route_check_simple would return None
+    have valid set to False. For multi-segment routes, segment holds the
+    index of the segment selected by the rules of route_check_simple.
+    """
+    columns = _position_columns(positions)
+    coordinates, segment_index, route_valid = _route_segments(routes)
+    result = np.zeros(
+        (len(columns["latitude"]), len(routes)), ROUTE_CHECK_DTYPE
+    )
+    if result.size == 0 or coordinates.size == 0:
+        return result
+    geometry = route_geometry_batch(
+        columns["latitude"][:, None],
+        columns["longitude"][:, None],
+        coordinates[None, :, 0],
+        coordinates[None, :, 1],
+        coordinates[None, :, 2],
+        coordinates[None, :, 3],
+        headings=columns["heading"][:, None],
+    )
+    deviation = geometry["deviation"]
+    deviation_ratio = geometry["deviation_ratio"]
+    progress = geometry["progress"]
+    dist_origin = geometry["dist_origin"]
+    dist_destination = geometry["dist_destination"]
+    error_angle = geometry["error_angle"]
+    vertical_rate = columns["vertical_rate"][:, None]
+    # The same rules as in single_route_check_simple. As every branch of the
+    # elif chain there fails the check, the chain reduces to a logical or.
+    failed_in_air = (
+        (deviation > 265e3) & (deviation_ratio > 0.15)
+        | (deviation_ratio > 0.6)
+        | (0.12 < progress)
+        & (dist_origin > 81.5e3)
+        & (progress < 0.85)
+        & (dist_destination > 77e3)
+        & (error_angle > 61.5)
+        | (0.1 < progress)
+        & (dist_origin > 25e3)
+        & (progress < 0.85)
+        & (dist_destination > 41e3)
+        & (error_angle > 126)
+        | (progress < 0.2) & (vertical_rate < -5)
+        | (progress > 0.8) & (vertical_rate > 5.5)
+    )
+    failed_on_ground = np.minimum(dist_origin, dist_destination) > 5e3
+    check_failed = np.where(
+        columns["on_ground"][:, None], failed_on_ground, failed_in_air
+    )
+    # Gather the segments of each route into (positions, routes, segments)
+    # and select one segment per route as route_check_simple does.
+    padding = segment_index < 0
+    gathered_failed = np.where(padding, True, check_failed[:, segment_index])
+    gathered_deviation = np.where(padding, np.inf, deviation[:, segment_index])
+    gathered_angle = np.where(padding, np.inf, error_angle[:, segment_index])
+    ok_count = np.count_nonzero(~gathered_failed, axis=2)
+    first_ok = np.argmax(~gathered_failed, axis=2)
+    min_deviation = np.argmin(gathered_deviation, axis=2)
+    min_angle = np.argmin(gathered_angle, axis=2)
+    min_deviation_failed = np.take_along_axis(
+        gathered_failed, min_deviation[..., None], axis=2
+    )[..., 0]
+    segment = np.where(
+        ok_count == 1,
+        first_ok,
+        np.where(min_deviation_failed, min_angle, min_deviation),
+    )
+    selected = np.take_along_axis(
+        np.broadcast_to(segment_index, gathered_failed.shape),
+        segment[..., None],
+        axis=2,
+    )[..., 0]
+    rows = np.arange(result.shape[0])[:, None]
+    result["segment"] = segment
+    result["check_failed"] = check_failed[rows, selected]
+    for _key in (
+        "route_length",
+        "deviation",
+        "error_angle",
+        "deviation_ratio",
+        "progress",
+        "dist_origin",
+        "dist_destination",
+    ):
+        result[_key] = geometry[_key][rows, selected]
+    result["valid"] = (
+        route_valid[None, :]
+        & np.isfinite(columns["latitude"])[:, None]
+        & np.isfinite(columns["longitude"])[:, None]
+    )
+    result["check_failed"] &= result["valid"]
+    return result
+
+
 def combine_routes(route_a, route_b):
     _route_items_a = route_a.split("-")
     _route_items_b = route_b.split("-")
@@ -0,0 +1,197 @@
+import itertools
+import arrow
+import numpy as np
+import pandas as pd
+from airport_info import get_iata_airports
+
+# Columns of a normalized schedule. Airports are IATA codes, weekdays is a
+# bit mask with bit 0 for Monday. The validity dates are inclusive. The
+# local times are offsets from midnight of the schedule date, including
+# day offsets like the +1 of an arrival on the next day.
+SCHEDULE_COLUMNS = (
+    "airline_iata",
+    "airline_icao",
+    "flight_number",
+    "origin",
+    "destination",
+    "weekdays",
+    "valid_from",
+    "valid_until",
+    "departure_time",
+    "arrival_time",
+)
+
+
+def schedule_dates(utc: arrow.Arrow, days: int = 1) -> list[arrow.Arrow]:
+    """Returns the target dates of a schedule update, utc and the
+    following days."""
+    return [utc.shift(days=_day) for _day in range(days)]
+
+
+def dates_by_month(dates: list[arrow.Arrow]) -> list[list[arrow.Arrow]]:
+    """Splits dates into runs of the same month, for monthly schedules."""
+    return [
+        list(_dates)
+        for _, _dates in itertools.groupby(
+            dates, key=lambda _date: (_date.year, _date.month)
+        )
+    ]
+
+
+def describe_dates(dates: list[arrow.Arrow]) -> str:
+    if len(dates) == 1:
+        return dates[0].format("YYYY-MM-DD")
+    return (
+        f"{dates[0].format('YYYY-MM-DD')} to "
+        f"{dates[-1].format('YYYY-MM-DD')}"
+    )
+
+
+def drop_multi_segment_totals(flights: list[dict]) -> list[dict]:
+    """Drops the segment-0 records of flights which also have records with
+    higher segment numbers, keeping only the individual legs. The flights
+    have to belong to the same date."""
+    _multi_segment = {
+        (_flight["airline_iata"], _flight["flight_number"])
+        for _flight in flights
+        if _flight["segment_number"] > 0
+    }
+    return [
+        _flight
+        for _flight in flights
+        if _flight["segment_number"] != 0
+        or (_flight["airline_iata"], _flight["flight_number"])
+        not in _multi_segment
+    ]
+
+
+def weekday_mask(weekdays) -> int:
+    """Returns the bit mask of a collection of ISO weekday numbers."""
+    return sum(1 << (_day - 1) for _day in set(weekdays) if 1 <= _day <= 7)
+
+
+def _airports_frame(prefix: str) -> pd.DataFrame:
+    return pd.DataFrame(
+        get_iata_airports(),
+        columns=[prefix, f"{prefix}_icao", f"{prefix}_timezone"],
+    )
+
+
+def _utc_seconds(local_times: pd.Series, timezones: pd.Series) -> np.ndarray:
+    """Converts naive local times to UTC timestamps in seconds. Ambiguous
+    times are taken as daylight saving time and times skipped by a clock
+    change are read with the offset before it, as arrow does."""
+    seconds = np.empty(len(local_times), dtype=np.int64)
+    _groups = pd.Series(timezones.to_numpy()).groupby(timezones.to_numpy())
+    for _timezone, _group in _groups.indices.items():
+        _localized = pd.DatetimeIndex(local_times.iloc[_group]).tz_localize(
+            _timezone,
+            ambiguous=np.ones(len(_group), dtype=bool),
+            nonexistent=pd.Timedelta(hours=1),
+        )
+        seconds[_group] = _localized.as_unit("s").asi8
+    return seconds
+
+
+def expand_schedule(
+    schedule: pd.DataFrame,
+    first_date,
+    last_date=None,
+    shift_overnight: bool = False,
+) -> tuple[pd.DataFrame, set[str]]:
+    """Expands a normalized schedule to the flights operated on the dates
+    from first_date to last_date. Returns the flights with ICAO route and
+    departure and arrival as UTC timestamps, and the IATA codes not found
+    in the airport database. With shift_overnight, arrivals before the
+    departure are moved to the next day."""
+    _dates = pd.DataFrame(
+        {
+            "date": pd.date_range(
+                pd.Timestamp(first_date).normalize(),
+                pd.Timestamp(
+                    first_date if last_date is None else last_date
+                ).normalize(),
+                freq="D",
+            )
+        }
+    )
+    flights = (
+        schedule.loc[:, list(SCHEDULE_COLUMNS)]
+        .astype(
+            {
+                "departure_time": "timedelta64[s]",
+                "arrival_time": "timedelta64[s]",
+            }
+        )
+        .merge(_dates, how="cross")
+    )
+    _weekday_bits = np.left_shift(1, flights["date"].dt.dayofweek.to_numpy())
+    flights = flights[
+        (flights["valid_from"] <= flights["date"])
+        & (flights["date"] <= flights["valid_until"])
+        & (flights["weekdays"].to_numpy(dtype=np.int64) & _weekday_bits != 0)
+    ]
+    flights = flights.merge(
+        _airports_frame("origin"), on="origin", how="left"
+    ).merge(_airports_frame("destination"), on="destination", how="left")
+    unknown_airports = set(
+        flights.loc[flights["origin_icao"].isna(), "origin"]
+    ) | set(flights.loc[flights["destination_icao"].isna(), "destination"])
+    flights = flights[
+        flights["origin_timezone"].notna()
+        & flights["destination_timezone"].notna()
+    ].reset_index(drop=True)
+
+    departures = _utc_seconds(
+        flights["date"] + flights["departure_time"], flights["origin_timezone"]
+    )
+    _arrival_times = flights["date"] + flights["arrival_time"]
+    arrivals = _utc_seconds(_arrival_times, flights["destination_timezone"])
+    if shift_overnight:
+        _overnight = np.flatnonzero(arrivals < departures)
+        arrivals[_overnight] = _utc_seconds(
+            _arrival_times.iloc[_overnight] + pd.Timedelta(days=1),
+            flights["destination_timezone"].iloc[_overnight],
+        )
+    return (
+        pd.DataFrame(
+            {
+                "airline_iata": flights["airline_iata"],
+                "airline_icao": flights["airline_icao"],
+                "flight_number": flights["flight_number"].astype(np.int64),
+                "route": flights["origin_icao"]
+                + "-"
+                + flights["destination_icao"],
+                "date": flights["date"],
+                "departure": departures,
+                "arrival": arrivals,
+            }
+        ),
+        unknown_airports,
+    )
+
+
+def schedule_flights(flights: pd.DataFrame) -> list[dict]:
+    """Returns the flight documents of expanded schedule flights."""
+    _dates = flights["date"].dt.strftime("%Y%m%d")
+    return [
+        {
+            "_id": f"{_iata}_{_number}_{_route}_{_date}",
+            "airline_iata": _iata,
+            "airline_icao": _icao,
+            "flight_number": _number,
+            "route": _route,
+            "departure": _departure,
+            "arrival": _arrival,
+            "segment_number": 0,
+        }
+        for _iata, _icao, _number, _route, _date, _departure, _arrival in zip(
+            flights["airline_iata"].tolist(),
+            flights["airline_icao"].tolist(),
+            flights["flight_number"].tolist(),
+            flights["route"].tolist(),
+            _dates.tolist(),
+            flights["departure"].tolist(),
+            flights["arrival"].tolist(),
+        )
+    ]
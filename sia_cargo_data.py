@@ -3,7 +3,12 @@ import logging
 import pathlib
 import arrow
 import pandas as pd
-from airport_info import get_airport_info, get_airport_icao
+from schedule_utils import (
+    describe_dates,
+    expand_schedule,
+    schedule_dates,
+    schedule_flights,
+)
 import flight_data_source
 
 PWD = pathlib.Path(__file__).resolve().parent
@@ -30,110 +35,62 @@ _CARRIER_IATA = {
     "TR": "TR",
 }
 
+# Local times are HH:MM with an optional +N suffix for day offsets, e.g.
+# '08:00+1' means the next day, '14:00+3' means three days later.
+_TIME_PATTERN = r"^\s*(\d{1,2}):(\d{2})(?:\+(\d+))?\s*$"
+
 logger = logging.getLogger(pathlib.Path(__file__).name)
 
 
-def _parse_time(hhmm_str: str, date_str: str, timezone: str) -> arrow.Arrow:
-    """Parse a HH:MM time string into an Arrow UTC datetime.
-
-    The schedule uses an optional +N suffix to indicate day offsets, e.g.
-    '08:00+1' means the next day, '14:00+3' means three days later.
-    """
-    _hhmm = str(hhmm_str).strip()
-    _day_offset = 0
-    if "+" in _hhmm:
-        _hhmm, _offset = _hhmm.split("+", 1)
-        _day_offset = int(_offset)
-    _hh, _mm = _hhmm.split(":")
-    return arrow.get(f"{date_str}T{_hh}:{_mm}", tzinfo=timezone).shift(
-        days=_day_offset
+def _times(values: pd.Series) -> pd.Series:
+    """Convert HH:MM(+N) strings to offsets from midnight of the schedule
+    date, NaT for invalid values."""
+    _parts = values.astype(str).str.extract(_TIME_PATTERN).astype(float)
+    return (
+        pd.to_timedelta(_parts[0], unit="h")
+        + pd.to_timedelta(_parts[1], unit="min")
+        + pd.to_timedelta(_parts[2].fillna(0), unit="D")
     )
 
 
-def _operating_days(row: pd.Series) -> set[int]:
-    """Return a set of ISO weekday numbers (1=Mon … 7=Sun) on which this
-    row operates, based on the checkmark columns."""
-    _col_to_iso = {
-        "Mon": 1,
-        "Tue": 2,
-        "Wed": 3,
-        "Thu": 4,
-        "Fri": 5,
-        "Sat": 6,
-        "Sun": 7,
-    }
-    return {_col_to_iso[_col] for _col in _DAY_COLUMNS if row[_col] == "✓"}
+def _weekdays(df: pd.DataFrame) -> pd.Series:
+    """Return the weekday masks of the checkmark columns."""
+    masks = pd.Series(0, index=df.index, dtype="int64")
+    for _bit, _col in enumerate(_DAY_COLUMNS):
+        masks |= (df[_col] == "✓").astype("int64") * (1 << _bit)
+    return masks
 
 
 def _load_schedule(path: pathlib.Path) -> pd.DataFrame:
+    """Load the timetable into a normalized schedule."""
     df = pd.read_excel(path, header=_HEADER_ROW)
     # Trucking rows are road feeder services, not actual flights.
-    df = df[df["Aircraft Classification"] != "Trucking"].copy()
-    df = df[df["Carrier Code"].notna()].copy()
-    return df
-
-
-def _process_row(
-    row: pd.Series,
-    utc: arrow.Arrow,
-    unknown_airports: set[str],
-) -> dict | None:
-    carrier_code = row["Carrier Code"]
-    airline_icao = _CARRIER_ICAO.get(carrier_code)
-    airline_iata = _CARRIER_IATA.get(carrier_code)
-    if airline_icao is None:
-        logger.warning(f"Unknown carrier code: {carrier_code}")
-        return None
-
-    if not str(row["Flight No"]).isdigit():
-        return None
-    flight_number = int(row["Flight No"])
-
-    origin_iata = row["Origin"]
-    destination_iata = row["Destination"]
-    origin_icao = get_airport_icao(origin_iata)
-    destination_icao = get_airport_icao(destination_iata)
-
-    if origin_icao is None:
-        unknown_airports.add(origin_iata)
-        return None
-    if destination_icao is None:
-        unknown_airports.add(destination_iata)
-        return None
-
-    origin_info = get_airport_info(origin_icao)
-    destination_info = get_airport_info(destination_icao)
-    if origin_info is None or destination_info is None:
-        return None
-
+    df = df[df["Aircraft Classification"] != "Trucking"]
+    df = df[df["Carrier Code"].notna()]
+    _known = df["Carrier Code"].isin(list(_CARRIER_ICAO))
+    for _carrier_code in df.loc[~_known, "Carrier Code"].unique().tolist():
+        logger.warning(f"Unknown carrier code: {_carrier_code}")
+    df = df[_known & df["Flight No"].astype(str).str.isdigit()]
     # Validity dates are strings in DD-MMM-YYYY format.
-    _validity_from = arrow.get(row["Validity From"], "DD-MMM-YYYY")
-    _validity_to = arrow.get(row["Validity To"], "DD-MMM-YYYY").ceil("day")
-    if not _validity_from <= utc <= _validity_to:
-        return None
-
-    if utc.isoweekday() not in _operating_days(row):
-        return None
-
-    _date = utc.format("YYYY-MM-DD")
-    _departure = _parse_time(
-        str(row["Dep. Time"]), _date, origin_info["Timezone"]
-    )
-    _arrival = _parse_time(
-        str(row["Arr. Time"]), _date, destination_info["Timezone"]
+    schedule = pd.DataFrame(
+        {
+            "airline_iata": df["Carrier Code"].map(_CARRIER_IATA),
+            "airline_icao": df["Carrier Code"].map(_CARRIER_ICAO),
+            "flight_number": df["Flight No"].astype("int64"),
+            "origin": df["Origin"],
+            "destination": df["Destination"],
+            "weekdays": _weekdays(df),
+            "valid_from": pd.to_datetime(
+                df["Validity From"], format="%d-%b-%Y", errors="coerce"
+            ),
+            "valid_until": pd.to_datetime(
+                df["Validity To"], format="%d-%b-%Y", errors="coerce"
+            ),
+            "departure_time": _times(df["Dep. Time"]),
+            "arrival_time": _times(df["Arr. Time"]),
+        }
     )
-
-    _route = f"{origin_icao}-{destination_icao}"
-    return {
-        "_id": f"{airline_iata}_{flight_number}_{_route}_{utc.format('YYYYMMDD')}",
-        "airline_iata": airline_iata,
-        "airline_icao": airline_icao,
-        "flight_number": flight_number,
-        "route": _route,
-        "departure": int(_departure.timestamp()),
-        "arrival": int(_arrival.timestamp()),
-        "segment_number": 0,
-    }
+    return schedule.dropna()
 
 
 class Airline(flight_data_source.FlightDataSource):
@@ -141,33 +98,33 @@ class Airline(flight_data_source.FlightDataSource):
         super().__init__("SIACargo", category="airlines")
         self._schedule_file = schedule_file
 
-    def update_data(self, utc=None) -> None:
+    def update_data(self, utc=None, days: int = 1) -> None:
         if utc is None:
             _utc = arrow.utcnow()
         else:
             _utc = arrow.get(utc)
-
-        _df = _load_schedule(self._schedule_file)
-        _unknown_airports: set[str] = set()
-        _flights = []
-
-        for _, _row in _df.iterrows():
-            _flight = _process_row(_row, _utc, _unknown_airports)
-            if _flight is None:
-                continue
-            _flights.append(_flight)
+        _dates = schedule_dates(_utc, days)
+
+        _expanded, _unknown_airports = expand_schedule(
+            flight_data_source.load_cached_schedule(
+                self._schedule_file, _load_schedule
+            ),
+            _dates[0].naive,
+            _dates[-1].naive,
+        )
+        _flights = schedule_flights(_expanded)
 
         for _iata in sorted(_unknown_airports):
             logger.warning(f"Unknown airport IATA: {_iata}")
 
-        _stored = 0
-        for _flight in _flights:
-            self.update_flight(_flight)
-            _stored += 1
+        _counts = flight_data_source.UpsertCounts.sum(
+            self.update_flights(_flights)
+        )
 
         logger.info(
-            f"SIA Cargo: stored {_stored} flights for "
-            f"{_utc.format('YYYY-MM-DD')}."
+            f"SIA Cargo: stored {_counts.flights} flights for "
+            f"{describe_dates(_dates)} ({_counts.upserted} new, "
+            f"{_counts.modified} modified)."
         )
 
 
@@ -183,6 +140,12 @@ if __name__ == "__main__":
         default=None,
         help="Target date in YYYY-MM-DD format (default: tomorrow UTC).",
     )
+    parser.add_argument(
+        "--days",
+        type=int,
+        default=1,
+        help="Number of days to import from the target date (default: 1).",
+    )
     parser.add_argument(
         "--file",
         default=str(SCHEDULE_FILE),
@@ -194,4 +157,4 @@ if __name__ == "__main__":
     )
     logger.info(f"Targeting date: {_target.format('YYYY-MM-DD')}")
     airline = Airline(schedule_file=pathlib.Path(args.file))
-    airline.update_data(_target)
+    airline.update_data(_target, days=args.days)
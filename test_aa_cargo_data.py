@@ -5,6 +5,8 @@ import tempfile
 import arrow
 import pytest
 from unittest.mock import patch
+import flight_data_source
+from flight_data_source import UpsertCounts
 from aa_cargo_data import (
     _parse_date,
     _parse_dow,
@@ -13,6 +15,14 @@ from aa_cargo_data import (
     Airline,
 )
 
+
+@pytest.fixture(autouse=True)
+def schedule_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        flight_data_source, "SCHEDULE_CACHE_DIRECTORY", tmp_path / "cache"
+    )
+
+
 # ---------------------------------------------------------------------------
 # CSV fixture helpers
 # ---------------------------------------------------------------------------
@@ -41,7 +51,20 @@ def _write_csv(tmp_path: pathlib.Path, content: str) -> pathlib.Path:
     return _f
 
 
-def _run_update(csv_content: str, utc: arrow.Arrow) -> list[dict]:
+def _capture(stored: list):
+    """Returns an update_flights replacement appending to stored."""
+
+    def _update_flights(flights):
+        _flights = list(flights)
+        stored.extend(_flights)
+        return [UpsertCounts(len(_flights), 0, 0, len(_flights))]
+
+    return _update_flights
+
+
+def _run_update(
+    csv_content: str, utc: arrow.Arrow, days: int = 1
+) -> list[dict]:
     stored = []
     airline = Airline()
     with tempfile.TemporaryDirectory() as _d:
@@ -52,9 +75,9 @@ def _run_update(csv_content: str, utc: arrow.Arrow) -> list[dict]:
         _p.write_text(csv_content, encoding="utf-8-sig")
         with patch("aa_cargo_data.PWD", pathlib.Path(_d)):
             with patch.object(
-                airline, "update_flight", side_effect=stored.append
+                airline, "update_flights", side_effect=_capture(stored)
             ):
-                airline.update_data(utc)
+                airline.update_data(utc, days=days)
     return stored
 
 
@@ -230,13 +253,51 @@ def test_flight_id_format():
     assert _id == "AA_100_KJFK-EGLL_20260504"
 
 
+def test_date_range_stores_each_operating_day():
+    stored = _run_update(
+        _make_csv(_ROW_JFK_LHR, _ROW_CLT_CDG_MON, _ROW_DFW_NRT), _MON, days=7
+    )
+    assert sorted(_f["_id"] for _f in stored) == sorted(
+        [f"AA_100_KJFK-EGLL_202605{_day:02d}" for _day in range(4, 11)]
+        + ["AA_786_KCLT-LFPG_20260504"]
+        + [f"AA_61_KDFW-RJAA_202605{_day:02d}" for _day in range(4, 7)]
+    )
+
+
+def test_date_range_matches_single_days():
+    _csv = _make_csv(_ROW_JFK_LHR, _ROW_DFW_NRT, _ROW_OVERNIGHT)
+    stored = _run_update(_csv, _MON, days=5)
+    expected = []
+    for _day in range(5):
+        expected.extend(_run_update(_csv, _MON.shift(days=_day)))
+    assert sorted(stored, key=lambda _f: _f["_id"]) == sorted(
+        expected, key=lambda _f: _f["_id"]
+    )
+
+
+def test_date_range_reads_each_monthly_file(caplog, tmp_path):
+    (tmp_path / "ConfirmedFSMay2026.csv").write_text(
+        _make_csv(_ROW_JFK_LHR), encoding="utf-8-sig"
+    )
+    airline = Airline()
+    stored = []
+    with caplog.at_level(logging.WARNING, logger="aa_cargo_data.py"):
+        with patch("aa_cargo_data.PWD", tmp_path):
+            with patch.object(
+                airline, "update_flights", side_effect=_capture(stored)
+            ):
+                airline.update_data(arrow.get("2026-05-30T12:00:00"), days=3)
+    assert sorted(_f["_id"][-8:] for _f in stored) == ["20260530", "20260531"]
+    assert any("ConfirmedFSJun2026" in _r.message for _r in caplog.records)
+
+
 def test_missing_file_logs_warning(caplog, tmp_path):
     airline = Airline()
     stored = []
     with caplog.at_level(logging.WARNING, logger="aa_cargo_data.py"):
         with patch("aa_cargo_data.PWD", tmp_path):
             with patch.object(
-                airline, "update_flight", side_effect=stored.append
+                airline, "update_flights", side_effect=_capture(stored)
             ):
                 airline.update_data(_MON)
     assert stored == []
@@ -1,4 +1,6 @@
 import math
+from unittest.mock import patch
+import numpy as np
 import pytest
 from airport_info import (
     get_airport_iata,
@@ -7,7 +9,11 @@ from airport_info import (
     get_airport_label,
     get_closest_airport,
     get_closest_airports,
+    get_airports_within,
     get_distance,
+    get_nearest_airports,
+    get_nearest_airports_batch,
+    reload_airport_data,
 )
 
 # ---------------------------------------------------------------------------
@@ -217,3 +223,100 @@ def test_get_closest_airport_distant_location_returns_nearest():
     result = get_closest_airport(0.0, -30.0)
     assert isinstance(result, dict)
     assert result["Distance"] > 1_000_000
+
+
+# ---------------------------------------------------------------------------
+# get_nearest_airports
+# ---------------------------------------------------------------------------
+
+
+def test_get_nearest_airports_eddg_first():
+    results = get_nearest_airports(52.1347, 7.6848, k=3)
+    assert len(results) == 3
+    assert results[0]["ICAO"] == "EDDG"
+    distances = [_item["Distance"] for _item in results]
+    assert distances == sorted(distances)
+
+
+def test_get_nearest_airports_beyond_latitude_band():
+    """Unlike get_closest_airports, the nearest airport is found even if it
+    is more than 1 degree of latitude away."""
+    assert get_closest_airports(89.5, 0.0) == []
+    results = get_nearest_airports(89.5, 0.0, k=2)
+    assert len(results) == 2
+    for _item in results:
+        assert _item["Latitude"] < 88.5
+
+
+def test_get_nearest_airports_iata_only():
+    for _item in get_nearest_airports(52.1347, 7.6848, k=4, iata_only=True):
+        assert len(_item["IATA"]) == 3
+
+
+# ---------------------------------------------------------------------------
+# get_airports_within
+# ---------------------------------------------------------------------------
+
+
+def test_get_airports_within_radius():
+    results = get_airports_within(52.1347, 7.6848, 300_000)
+    icaos = [_item["ICAO"] for _item in results]
+    assert icaos[0] == "EDDG"
+    assert "EDDF" in icaos
+    for _item in results:
+        assert _item["Distance"] <= 300_000
+
+
+def test_get_airports_within_small_radius_excludes_others():
+    results = get_airports_within(52.1347, 7.6848, 1_000)
+    assert [_item["ICAO"] for _item in results] == ["EDDG"]
+
+
+# ---------------------------------------------------------------------------
+# get_nearest_airports_batch
+# ---------------------------------------------------------------------------
+
+
+def test_get_nearest_airports_batch_matches_single_queries():
+    latitudes = np.array([52.1347, 50.0264, -16.466, 0.0])
+    longitudes = np.array([7.6848, 8.5431, 179.340, -30.0])
+    icaos, distances = get_nearest_airports_batch(latitudes, longitudes)
+    for _lat, _lon, _icao, _distance in zip(
+        latitudes, longitudes, icaos, distances
+    ):
+        nearest = get_nearest_airports(_lat, _lon)[0]
+        assert _icao == nearest["ICAO"]
+        assert _distance == pytest.approx(nearest["Distance"], abs=1.0)
+
+
+def test_get_nearest_airports_batch_nan_position():
+    icaos, distances = get_nearest_airports_batch(
+        [np.nan, 52.1347], [7.0, 7.6848]
+    )
+    assert icaos[0] is None
+    assert math.isnan(distances[0])
+    assert icaos[1] == "EDDG"
+
+
+# ---------------------------------------------------------------------------
+# airport table
+# ---------------------------------------------------------------------------
+
+
+def test_airport_table_matches_database_queries():
+    for icao in ("EDDG", "EDDF", "EDWO", "NFNL", "ZZZZ"):
+        result = get_airport_info(icao)
+        iata = get_airport_iata(icao)
+        with patch("airport_info.USE_AIRPORT_TABLE", False):
+            assert get_airport_info(icao) == result
+            assert get_airport_iata(icao) == iata
+    for iata in ("FMO", "FRA", "NYC"):
+        icao = get_airport_icao(iata)
+        with patch("airport_info.USE_AIRPORT_TABLE", False):
+            assert get_airport_icao(iata) == icao
+
+
+def test_reload_airport_data():
+    reload_airport_data()
+    assert get_airport_info("EDDG")["IATA"] == "FMO"
+    assert get_airport_icao("FRA") == "EDDF"
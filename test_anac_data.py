@@ -3,6 +3,7 @@ import arrow
 import pytest
 from unittest.mock import patch
 from anac_data import Agency, _fetch_schedule
+from flight_data_source import UpsertCounts
 
 # ---------------------------------------------------------------------------
 # Sample CSV rows derived from the real ANAC feed structure.
@@ -97,13 +98,24 @@ _ROW_OVERNIGHT = (
 )
 
 
+def _capture(stored: list):
+    """Returns an update_flights replacement appending to stored."""
+
+    def _update_flights(flights):
+        _flights = list(flights)
+        stored.extend(_flights)
+        return [UpsertCounts(len(_flights), 0, 0, len(_flights))]
+
+    return _update_flights
+
+
 def _make_csv(*rows: str) -> str:
     """Build a mock CSV response with the metadata header and data rows."""
     lines = ["Importante: Horários em UTC", _HEADER] + list(rows)
     return "\n".join(lines)
 
 
-def _run_update(csv_text: str, utc: arrow.Arrow) -> list[dict]:
+def _run_update(csv_text: str, utc: arrow.Arrow, days: int = 1) -> list[dict]:
     """Run Agency.update_data with a mocked _fetch_schedule and capture stored flights."""
     import csv as csv_module
 
@@ -111,8 +123,10 @@ def _run_update(csv_text: str, utc: arrow.Arrow) -> list[dict]:
     stored = []
     agency = Agency()
     with patch("anac_data._fetch_schedule", return_value=rows):
-        with patch.object(agency, "update_flight", side_effect=stored.append):
-            agency.update_data(utc)
+        with patch.object(
+            agency, "update_flights", side_effect=_capture(stored)
+        ):
+            agency.update_data(utc, days=days)
     return stored
 
 
@@ -210,6 +224,55 @@ def test_segment_zero_stored_when_only_segment():
     assert stored[0]["segment_number"] == 0
 
 
+def test_segment_zero_filtered_per_date():
+    """Segment 1 on Monday does not hide segment 0 on other dates."""
+    _seg0_daily = _ROW_GLO_SEG0.replace("1;0;0;0;0;0;0;", "1;2;3;4;5;6;7;")
+    stored = _run_update(
+        _make_csv(_seg0_daily, _ROW_GLO_SEG1), _MONDAY, days=3
+    )
+    assert sorted((_f["_id"][-8:], _f["segment_number"]) for _f in stored) == [
+        ("20260406", 1),
+        ("20260407", 0),
+        ("20260408", 0),
+    ]
+
+
+# ---------------------------------------------------------------------------
+# Date ranges
+# ---------------------------------------------------------------------------
+
+
+def test_date_range_stores_each_operating_day():
+    stored = _run_update(
+        _make_csv(_ROW_AAL_GRU_MIA, _ROW_GLO_SEG1), _MONDAY, days=7
+    )
+    _daily = sorted(
+        (_f for _f in stored if _f["airline_icao"] == "AAL"),
+        key=lambda _f: _f["departure"],
+    )
+    assert len(_daily) == 7
+    assert [_f["_id"][-8:] for _f in _daily] == [
+        f"202604{_day:02d}" for _day in range(6, 13)
+    ]
+    assert all(
+        _later["departure"] - _earlier["departure"] == 86400
+        for _earlier, _later in zip(_daily, _daily[1:])
+    )
+    # The Monday-only flight operates once in the week.
+    assert len(stored) == 8
+
+
+def test_date_range_matches_single_days():
+    _csv = _make_csv(_ROW_AAL_GRU_MIA, _ROW_GLO_SEG0, _ROW_GLO_SEG1)
+    stored = _run_update(_csv, _MONDAY, days=7)
+    expected = []
+    for _day in range(7):
+        expected.extend(_run_update(_csv, _MONDAY.shift(days=_day)))
+    assert sorted(stored, key=lambda _f: _f["_id"]) == sorted(
+        expected, key=lambda _f: _f["_id"]
+    )
+
+
 # ---------------------------------------------------------------------------
 # Timestamps
 # ---------------------------------------------------------------------------
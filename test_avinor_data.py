@@ -1,12 +1,19 @@
+import io
 import logging
+import random
+from itertools import permutations
 import arrow
 import pymongo
 import pytest
+import requests
 from unittest.mock import patch, MagicMock
 from avinor_data import (
     Airport,
+    _Feed,
     _get_date_and_time,
+    _mark_redundant,
     _status_codes,
+    fetch_airport_feeds,
     request_airport_data,
 )
 from route_utils import get_route_length
@@ -386,6 +393,131 @@ def test_request_airport_data_route_length_reasonable():
     assert 1050 < km < 1300
 
 
+# ---------------------------------------------------------------------------
+# fetch_airport_feeds — conditional requests via a mocked session
+# ---------------------------------------------------------------------------
+
+
+def _make_stream_response(status_code: int, xml: str = "", headers=None):
+    mock = MagicMock()
+    mock.__enter__.return_value = mock
+    mock.status_code = status_code
+    mock.headers = headers or {}
+    mock.raw = io.BytesIO(xml.encode("iso-8859-1"))
+    return mock
+
+
+_BGO_XML = _wrap(
+    "BGO",
+    _flight_xml(1, "SK", "SK267", "D", "2026-04-06T12:20:00Z", "D", "OSL"),
+)
+
+
+def test_fetch_airport_feeds_parses_stream():
+    session = MagicMock()
+    session.get.return_value = _make_stream_response(
+        200, _BGO_XML, {"ETag": '"abc"', "Last-Modified": "Mon"}
+    )
+    feeds = fetch_airport_feeds(["BGO"], {}, session=session)
+    with patch(
+        "avinor_data.requests.get", return_value=_make_response(_BGO_XML)
+    ):
+        expected = list(request_airport_data("BGO"))
+    assert feeds["BGO"] == _Feed('"abc"', "Mon", expected)
+    assert session.get.call_args.kwargs["headers"] == {}
+
+
+def test_fetch_airport_feeds_skips_unchanged_feed():
+    session = MagicMock()
+    session.get.return_value = _make_stream_response(304)
+    cached = _Feed('"abc"', "Mon", [{"_id": "cached"}])
+    feeds = fetch_airport_feeds(["BGO"], {"BGO": cached}, session=session)
+    assert feeds["BGO"] is cached
+    assert session.get.call_args.kwargs["headers"] == {
+        "If-None-Match": '"abc"',
+        "If-Modified-Since": "Mon",
+    }
+
+
+def test_fetch_airport_feeds_keeps_cached_feed_on_error():
+    session = MagicMock()
+    session.get.side_effect = requests.ConnectionError("down")
+    cached = _Feed(None, None, [{"_id": "cached"}])
+    feeds = fetch_airport_feeds(
+        ["BGO", "OSL"], {"BGO": cached}, session=session
+    )
+    assert feeds == {"BGO": cached}
+
+
+# ---------------------------------------------------------------------------
+# _mark_redundant — synthetic rotations against the former pairwise check
+# ---------------------------------------------------------------------------
+
+_NORWEGIAN_ICAOS = (
+    "ENGM ENBR ENZV ENVA ENTC ENBO ENSG ENFL ENSD ENRO ENML ENKR ENHF ENAT "
+    "ENSB ENEV ENAN ENBN ENSS ENVD ENHV ENMS ENST ENRA ENLK ENBV ENDU"
+).split()
+
+
+def _mark_redundant_pairwise(flights) -> None:
+    for _flight1, _flight2 in permutations(flights, 2):
+        if _flight2["route"] == _flight1["route"]:
+            pass
+        elif _flight2["route"].startswith(_flight1["route"]):
+            _flight1["redundant"] = True
+        elif _flight2["route"].endswith(_flight1["route"]):
+            _flight1["redundant"] = True
+        elif _flight1["route"] in _flight2["route"]:
+            _flight1["redundant"] = True
+
+
+def _rotation_routes(rng: random.Random) -> set[str]:
+    """Routes of one flight number as listed by the airports of a rotation:
+    each airport shows the flight from an earlier and to a later stop."""
+    _stops = rng.sample(_NORWEGIAN_ICAOS, rng.randint(2, 9))
+    if rng.random() < 0.2:
+        # Rotations returning to their first airport.
+        _stops.append(_stops[0])
+    routes = set()
+    for _position in range(len(_stops)):
+        if _position > 0:
+            _begin = rng.randrange(_position)
+            routes.add("-".join(_stops[_begin : _position + 1]))
+        if _position < len(_stops) - 1:
+            _end = rng.randrange(_position + 1, len(_stops))
+            routes.add("-".join(_stops[_position : _end + 1]))
+    return routes
+
+
+def test_mark_redundant_matches_pairwise_check():
+    rng = random.Random(22)
+    for _ in range(2000):
+        routes = _rotation_routes(rng)
+        if rng.random() < 0.3:
+            routes |= _rotation_routes(rng)
+        flights = [{"route": _route} for _route in sorted(routes)]
+        expected = [dict(_flight) for _flight in flights]
+        _mark_redundant(flights)
+        _mark_redundant_pairwise(expected)
+        assert flights == expected
+
+
+def test_mark_redundant_keeps_distinct_routes():
+    flights = [
+        {"route": "ENBR-ENSG-ENFL"},
+        {"route": "ENBR-ENSG"},
+        {"route": "ENSG-ENFL"},
+        {"route": "ENFL-ENSG"},
+    ]
+    _mark_redundant(flights)
+    assert [_flight.get("redundant") for _flight in flights] == [
+        None,
+        True,
+        True,
+        None,
+    ]
+
+
 # ---------------------------------------------------------------------------
 # Smoke test against live MongoDB (requires update_data to have been run)
 # ---------------------------------------------------------------------------
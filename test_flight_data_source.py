@@ -0,0 +1,317 @@
+import logging
+import random
+import numpy as np
+import pandas as pd
+import pymongo
+import pytest
+import flight_data_source
+from flight_data_source import (
+    ACTIVE_FLIGHT_PROJECTION,
+    ACTIVE_WINDOW_INDEX,
+    VERSIONS_DATABASE,
+    FlightDataSource,
+    UpsertCounts,
+    _ActiveFlightIndex,
+    _active_index_filter,
+    _active_window,
+    _flight_update,
+    _query_active_index,
+    load_cached_schedule,
+)
+from route_utils import estimate_max_flight_duration
+
+_ROUTE_LENGTHS = {"EDDF-KJFK": 6_200_000, "EDDF-EDDH": 410_000}
+_UTC = 1_700_000_000
+
+
+@pytest.fixture(autouse=True)
+def route_lengths(monkeypatch):
+    monkeypatch.setattr(
+        flight_data_source, "get_route_length", _ROUTE_LENGTHS.__getitem__
+    )
+
+
+def _reference_active(flight, utc) -> bool:
+    """The former server-side query window followed by the Python check."""
+    _departure = flight.get("departure")
+    _arrival = flight.get("arrival")
+    if not (
+        _departure is not None and utc - 24 * 3600 < _departure < utc + 300
+    ) and not (
+        _arrival is not None and utc - 300 < _arrival < utc + 24 * 3600
+    ):
+        return False
+    _duration = estimate_max_flight_duration(_ROUTE_LENGTHS[flight["route"]])
+    if _departure is not None and _arrival is not None:
+        return _departure < utc < _arrival
+    elif _departure is not None:
+        return _departure + _duration > utc
+    return _arrival - _duration < utc
+
+
+def _random_flight(rng: random.Random) -> dict:
+    flight = {"_id": rng.random(), "route": rng.choice(list(_ROUTE_LENGTHS))}
+    _departure = _UTC + rng.randint(-30000, 3000)
+    if rng.random() < 0.7:
+        flight["departure"] = _departure
+    if rng.random() < 0.7:
+        flight["arrival"] = _departure + rng.randint(3000, 30000)
+    return flight
+
+
+# ---------------------------------------------------------------------------
+# _active_window
+# ---------------------------------------------------------------------------
+
+
+def test_active_window_matches_reference():
+    rng = random.Random(19)
+    for _ in range(1000):
+        _flight = _random_flight(rng)
+        _window = _active_window(_flight)
+        for _utc in range(_UTC - 600, _UTC + 601, 60):
+            _active = _window is not None and _window[0] < _utc < _window[1]
+            assert _active == _reference_active(_flight, _utc), _flight
+
+
+def test_active_window_without_times():
+    assert _active_window({"route": "EDDF-KJFK"}) is None
+
+
+# ---------------------------------------------------------------------------
+# _flight_update
+# ---------------------------------------------------------------------------
+
+
+def test_flight_update_stores_window():
+    flight = {"_id": "a", "route": "EDDF-EDDH", "departure": 10, "arrival": 20}
+    assert _flight_update(flight) == {
+        "$set": dict(flight, active_from=10, active_until=20)
+    }
+    assert "active_from" not in flight
+
+
+def test_flight_update_redundant_removes_window():
+    flight = {"_id": "a", "route": "EDDF-EDDH", "departure": 10}
+    flight["redundant"] = True
+    update = _flight_update(flight)
+    assert update["$set"] == flight
+    assert set(update["$unset"]) == {"active_from", "active_until"}
+
+
+# ---------------------------------------------------------------------------
+# _query_active_index
+# ---------------------------------------------------------------------------
+
+
+def test_query_active_index_matches_scan():
+    rng = np.random.default_rng(20)
+    starts = np.sort(rng.uniform(0, 100000, 2000))
+    ends = starts + rng.exponential(3000, 2000)
+    index = _ActiveFlightIndex(
+        version=0,
+        since=0,
+        starts=starts,
+        ends=ends,
+        max_length=float((ends - starts).max()),
+        flights=[{"_id": _i} for _i in range(2000)],
+    )
+    for _utc in rng.uniform(-1000, 110000, 200):
+        expected = np.flatnonzero((starts < _utc) & (_utc < ends)).tolist()
+        flights = _query_active_index(index, _utc)
+        assert [_flight["_id"] for _flight in flights] == expected
+    flights = _query_active_index(index, 50000)
+    flights[0]["callsign"] = "DLH400"
+    assert "callsign" not in _query_active_index(index, 50000)[0]
+
+
+# ---------------------------------------------------------------------------
+# load_cached_schedule
+# ---------------------------------------------------------------------------
+
+
+# Paths parsed by _load_schedule().
+_loads = []
+
+
+def _load_schedule(path, month: int = 4) -> pd.DataFrame:
+    _loads.append(path)
+    _lines = path.read_text().splitlines()
+    return pd.DataFrame(
+        {
+            "origin": [_line.split("-")[0] for _line in _lines],
+            "flight_number": np.arange(len(_lines), dtype=np.int64),
+            "valid_from": pd.Timestamp(f"2026-{month:02d}-01"),
+            "departure_time": pd.Timedelta(hours=25, minutes=5),
+        }
+    )
+
+
+def test_load_cached_schedule_hit_and_miss(tmp_path, caplog):
+    _loads.clear()
+    path = tmp_path / "schedule.csv"
+    path.write_text("FRA-JFK\nHAM-FRA\n")
+    cache = tmp_path / "cache"
+    with caplog.at_level(logging.INFO, logger="flight_data_source"):
+        expected = load_cached_schedule(
+            path, _load_schedule, 4, cache_directory=cache
+        )
+        schedule = load_cached_schedule(
+            path, _load_schedule, 4, cache_directory=cache
+        )
+    assert len(_loads) == 1
+    pd.testing.assert_frame_equal(
+        schedule, expected, check_dtype=False, check_index_type=False
+    )
+    assert schedule["departure_time"].dtype.kind == "m"
+    assert schedule["origin"].tolist() == ["FRA", "HAM"]
+    _messages = [_r.message for _r in caplog.records]
+    assert any("cache miss" in _message for _message in _messages)
+    assert any("cache hit" in _message for _message in _messages)
+
+
+def test_load_cached_schedule_keyed_by_content_and_arguments(tmp_path):
+    _loads.clear()
+    path = tmp_path / "schedule.csv"
+    cache = tmp_path / "cache"
+    path.write_text("FRA-JFK\n")
+    load_cached_schedule(path, _load_schedule, 4, cache_directory=cache)
+    load_cached_schedule(path, _load_schedule, 5, cache_directory=cache)
+    path.write_text("HAM-FRA\n")
+    schedule = load_cached_schedule(
+        path, _load_schedule, 5, cache_directory=cache
+    )
+    assert len(_loads) == 3
+    assert schedule["origin"].tolist() == ["HAM"]
+    # Entries of replaced schedule files are removed.
+    assert len(list(cache.glob("schedule.csv.*.npz"))) == 1
+
+
+def test_load_cached_schedule_ignores_broken_cache(tmp_path):
+    _loads.clear()
+    path = tmp_path / "schedule.csv"
+    cache = tmp_path / "cache"
+    path.write_text("FRA-JFK\n")
+    load_cached_schedule(path, _load_schedule, cache_directory=cache)
+    for _cache_file in cache.glob("*.npz"):
+        _cache_file.write_bytes(b"broken")
+    schedule = load_cached_schedule(
+        path, _load_schedule, cache_directory=cache
+    )
+    assert len(_loads) == 2
+    assert schedule["origin"].tolist() == ["FRA"]
+
+
+def test_load_cached_schedule_uncacheable_columns(tmp_path):
+    path = tmp_path / "schedule.csv"
+    path.write_text("FRA-JFK\n")
+    cache = tmp_path / "cache"
+
+    def _load(path):
+        return pd.DataFrame({"origin": ["FRA", None]})
+
+    schedule = load_cached_schedule(path, _load, cache_directory=cache)
+    assert schedule["origin"].isna().tolist() == [False, True]
+    assert not cache.exists()
+
+
+# ---------------------------------------------------------------------------
+# MongoDB
+# ---------------------------------------------------------------------------
+
+
+@pytest.fixture
+def data_source():
+    client = pymongo.MongoClient(
+        "mongodb://localhost:27017/", serverSelectionTimeoutMS=1000
+    )
+    try:
+        client.admin.command("ping")
+    except pymongo.errors.ServerSelectionTimeoutError:
+        pytest.skip("MongoDB not available")
+    versions = client[VERSIONS_DATABASE]["versions"]
+    client.drop_database("test_flight_data_source")
+    versions.delete_many({"_id": {"$regex": "^test_flight_data_source\\."}})
+    yield FlightDataSource("Test", category="test_flight_data_source")
+    client.drop_database("test_flight_data_source")
+    versions.delete_many({"_id": {"$regex": "^test_flight_data_source\\."}})
+    client.close()
+
+
+def _index_names(plan) -> set[str]:
+    if isinstance(plan, dict):
+        names = {plan["indexName"]} if "indexName" in plan else set()
+        if plan.get("stage") == "COLLSCAN":
+            names.add("COLLSCAN")
+        for _value in plan.values():
+            names.update(_index_names(_value))
+        return names
+    if isinstance(plan, list):
+        return set().union(*(_index_names(_item) for _item in plan))
+    return set()
+
+
+def test_get_active_flights(data_source):
+    rng = random.Random(20)
+    flights = [_random_flight(rng) for _ in range(500)]
+    for _flight in flights[::7]:
+        _flight["redundant"] = True
+    counts = data_source.update_flights(flights, chunk_size=100)
+    assert UpsertCounts.sum(counts) == UpsertCounts(500, 0, 0, 500)
+    active = data_source.get_active_flights(_UTC)
+    assert {_flight["_id"] for _flight in active} == {
+        _flight["_id"]
+        for _flight in flights
+        if "redundant" not in _flight and _reference_active(_flight, _UTC)
+    }
+    for _flight in active:
+        assert set(_flight) <= set(ACTIVE_FLIGHT_PROJECTION) | {"_id"}
+
+
+def test_get_active_flights_uses_partial_index(data_source):
+    rng = random.Random(21)
+    data_source.update_flights(_random_flight(rng) for _ in range(500))
+    plan = data_source.mycol.find(
+        _active_index_filter(_UTC), ACTIVE_FLIGHT_PROJECTION
+    ).explain()["queryPlanner"]["winningPlan"]
+    assert _index_names(plan) == {ACTIVE_WINDOW_INDEX}
+
+
+def test_backfill_active_windows(data_source):
+    data_source.mycol.insert_many(
+        [
+            {"_id": 1, "route": "EDDF-KJFK", "departure": _UTC - 60},
+            {"_id": 2, "route": "EDDF-KJFK", "arrival": _UTC, "redundant": 1},
+            {"_id": 3, "route": "EDDF-KJFK"},
+        ]
+    )
+    assert data_source.backfill_active_windows() == 1
+    assert [_f["_id"] for _f in data_source.get_active_flights(_UTC)] == [1]
+    assert data_source.backfill_active_windows() == 0
+
+
+def test_get_active_flights_served_from_cache(data_source, monkeypatch):
+    data_source.update_flight(
+        {"_id": 1, "route": "EDDF-KJFK", "departure": _UTC - 60}
+    )
+    assert len(data_source.get_active_flights(_UTC)) == 1
+    monkeypatch.setattr(data_source.mycol, "find", None)
+    monkeypatch.setattr(data_source._versions, "find_one", None)
+    assert len(data_source.get_active_flights(_UTC + 60)) == 1
+
+
+def test_get_active_flights_reloads_on_new_version(data_source, monkeypatch):
+    assert data_source.get_active_flights(_UTC) == []
+    writer = FlightDataSource("Test", category="test_flight_data_source")
+    writer.update_flights(
+        [{"_id": 1, "route": "EDDF-KJFK", "departure": _UTC - 60}]
+    )
+    assert data_source.get_active_flights(_UTC) == []
+    monkeypatch.setattr(flight_data_source, "VERSION_CHECK_INTERVAL", 0.0)
+    data_source._next_version_check = 0.0
+    assert len(data_source.get_active_flights(_UTC)) == 1
+    # Unchanged flights do not invalidate the caches.
+    writer.update_flights(
+        [{"_id": 1, "route": "EDDF-KJFK", "departure": _UTC - 60}]
+    )
+    assert writer._get_version() == 1
@@ -0,0 +1,176 @@
+import json
+from unittest.mock import MagicMock
+import numpy as np
+import pytest
+from opensky_positions import (
+    COLUMNAR_POSITIONS_KEY,
+    POSITIONS_KEY,
+    PositionTable,
+    _position_delta,
+    decode_positions,
+    encode_positions,
+    load_position_table,
+)
+from route_utils import route_check_batch, route_check_simple
+
+
+def _position(callsign: str, **kwargs) -> dict:
+    position = {
+        "utc": 1700000000,
+        "latitude": 51.0,
+        "longitude": 8.0,
+        "altitude": 10000.0,
+        "heading": 270.5,
+        "icao24": "3c6444",
+        "vertical_rate": 0.0,
+        "velocity": 230.0,
+        "time_position": 1700000000,
+        "on_ground": False,
+        "category": 0,
+        "flight_level": 328,
+        "sensors": [],
+        "registration": "DAIBL",
+        "callsign": callsign,
+        "operator_icao": callsign[:3],
+        "callsign_number": (
+            int(callsign[3:]) if callsign[3:].isdigit() else None
+        ),
+    }
+    position.update(kwargs)
+    return position
+
+
+POSITIONS = {
+    "DLH400": _position("DLH400"),
+    "DLH4AB": _position("DLH4AB", heading=90.0, icao24="3c6555"),
+    "BAW1": _position("BAW1", altitude=None, on_ground=True),
+}
+for _position_data in POSITIONS.values():
+    if _position_data["on_ground"]:
+        del _position_data["flight_level"]
+del POSITIONS["DLH4AB"]["registration"]
+
+
+# ---------------------------------------------------------------------------
+# encode_positions / decode_positions
+# ---------------------------------------------------------------------------
+
+
+def test_decode_positions_columns():
+    columns, states_time = decode_positions(
+        encode_positions(POSITIONS, 1700000005)
+    )
+    assert states_time == 1700000005
+    assert columns["latitude"].dtype == np.float64
+    assert columns["callsign"].tolist() == [b"DLH400", b"DLH4AB", b"BAW1"]
+    assert np.isnan(columns["altitude"][2])
+    assert np.isnan(columns["callsign_number"][1])
+    assert columns["on_ground"].tolist() == [False, False, True]
+
+
+def test_decode_positions_does_not_copy():
+    data = encode_positions(POSITIONS, 1700000005)
+    columns, _ = decode_positions(data)
+    for _array in columns.values():
+        assert _array.base is not None
+        assert not _array.flags.writeable
+
+
+def test_decode_positions_empty_snapshot():
+    columns, states_time = decode_positions(encode_positions({}, 1))
+    assert states_time == 1
+    assert len(columns["latitude"]) == 0
+
+
+def test_decode_positions_invalid_data_raises():
+    data = bytearray(encode_positions(POSITIONS, 1))
+    data[:4] = b"JSON"
+    with pytest.raises(ValueError):
+        decode_positions(bytes(data))
+
+
+# ---------------------------------------------------------------------------
+# PositionTable
+# ---------------------------------------------------------------------------
+
+
+def test_position_table_rebuilds_position_dicts():
+    table = PositionTable.from_positions(POSITIONS, 1700000005)
+    assert len(table) == 3
+    assert list(table) == ["DLH400", "DLH4AB", "BAW1"]
+    assert "DLH400" in table
+    assert "DLH401" not in table
+    for _callsign, _position in POSITIONS.items():
+        expected = {k: v for k, v in _position.items() if k != "sensors"}
+        assert table[_callsign] == expected
+    assert isinstance(table["DLH400"]["callsign_number"], int)
+
+
+def test_position_table_take_matches_route_check_simple():
+    table = PositionTable.from_positions(POSITIONS, 1700000005)
+    callsigns = ["DLH400", "DLH4AB"]
+    results = route_check_batch(table.take(callsigns), ["EDDF-EDDG"])[:, 0]
+    for _callsign, _result in zip(callsigns, results):
+        expected = route_check_simple(table[_callsign], "EDDF-EDDG")
+        assert _result["check_failed"] == expected["check_failed"]
+
+
+def test_position_table_merged_applies_delta():
+    table = PositionTable.from_positions(POSITIONS, 1700000005)
+    moved = _position("DLH400", latitude=52.0)
+    delta = PositionTable.from_positions(
+        {"DLH400": moved, "EWG1": _position("EWG1")}, 1700000010
+    )
+    merged = table.merged(delta, ["BAW1"])
+    assert merged.states_time == 1700000010
+    assert set(merged) == {"DLH400", "DLH4AB", "EWG1"}
+    assert merged["DLH400"]["latitude"] == 52.0
+    assert merged["DLH4AB"] == table["DLH4AB"]
+
+
+# ---------------------------------------------------------------------------
+# _position_delta
+# ---------------------------------------------------------------------------
+
+
+def test_position_delta_changed_and_removed():
+    positions = {
+        "DLH400": dict(POSITIONS["DLH400"], sensors=[1, 2]),
+        "DLH4AB": dict(POSITIONS["DLH4AB"], heading=95.0),
+        "EWG1": _position("EWG1"),
+    }
+    changed, removed = _position_delta(POSITIONS, positions)
+    assert set(changed) == {"DLH4AB", "EWG1"}
+    assert removed == ["BAW1"]
+
+
+# ---------------------------------------------------------------------------
+# load_position_table
+# ---------------------------------------------------------------------------
+
+
+def test_load_position_table_prefers_columnar_snapshot():
+    connection = MagicMock()
+    connection.get.side_effect = {
+        COLUMNAR_POSITIONS_KEY: encode_positions(POSITIONS, 5),
+    }.get
+    table = load_position_table(connection)
+    assert table.states_time == 5
+    assert set(table) == set(POSITIONS)
+
+
+def test_load_position_table_falls_back_to_json():
+    snapshot = {"positions": POSITIONS, "states_time": 7}
+    connection = MagicMock()
+    connection.get.side_effect = {
+        POSITIONS_KEY: json.dumps(snapshot).encode(),
+    }.get
+    table = load_position_table(connection)
+    assert table.states_time == 7
+    assert table["BAW1"]["on_ground"] is True
+
+
+def test_load_position_table_without_snapshot():
+    connection = MagicMock()
+    connection.get.return_value = None
+    assert load_position_table(connection) is None
@@ -0,0 +1,286 @@
+import random
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+import pytest
+import opensky_utils
+from opensky_utils import (
+    RegistrationResolver,
+    RegistrationStore,
+    validated_callsign,
+    validated_position,
+    validated_positions,
+)
+
+STATES_TIME = 1700000100
+
+
+@pytest.fixture(autouse=True)
+def submitted_icao24s(monkeypatch):
+    """Records the icao24s submitted to the registration resolver instead of
+    requesting them from the OpenSky metadata API."""
+    submitted = []
+    monkeypatch.setattr(
+        opensky_utils.registration_resolver, "submit", submitted.append
+    )
+    return submitted
+
+
+@pytest.fixture
+def redis_connection(monkeypatch):
+    connection = MagicMock()
+    connection.sismember.return_value = False
+    monkeypatch.setattr(opensky_utils, "redis_connection", connection)
+    return connection
+
+
+def _response(status_code: int, registration=None, headers=None):
+    response = MagicMock(status_code=status_code, headers=headers or {})
+    response.json.return_value = {"registration": registration}
+    return response
+
+
+def _state(**kwargs) -> SimpleNamespace:
+    state = {
+        "icao24": "3c6444",
+        "callsign": "DLH400  ",
+        "time_position": STATES_TIME - 5,
+        "latitude": 51.0,
+        "longitude": 8.0,
+        "baro_altitude": 10000.0,
+        "on_ground": False,
+        "velocity": 230.0,
+        "true_track": 270.5,
+        "vertical_rate": 0.0,
+        "sensors": None,
+        "category": 0,
+    }
+    state.update(kwargs)
+    return SimpleNamespace(**state)
+
+
+def _random_state(rng: random.Random) -> SimpleNamespace:
+    def _maybe_none(value):
+        return None if rng.random() < 0.05 else value
+
+    operator = rng.choice(["DLH", "BAW", "EWG", "dlh", "D1H", "N12"])
+    number = rng.randint(0, 9999)
+    suffix = rng.choice(
+        [f"{number}", f"0{number}", f"{number % 100}AB", f"{number}A", " "]
+    )
+    callsign = operator + suffix
+    return _state(
+        icao24=rng.choice(["3c6444", "3c6555", "4ca123", "abcdef"]),
+        callsign=_maybe_none(callsign + " " * rng.randint(0, 3)),
+        time_position=_maybe_none(STATES_TIME - rng.randint(0, 90)),
+        latitude=_maybe_none(rng.uniform(-90, 90)),
+        longitude=_maybe_none(rng.uniform(-180, 180)),
+        baro_altitude=_maybe_none(rng.uniform(-100, 19000)),
+        on_ground=_maybe_none(rng.random() < 0.2),
+        velocity=_maybe_none(rng.uniform(0, 300)),
+        true_track=_maybe_none(rng.uniform(0, 360)),
+        vertical_rate=_maybe_none(rng.uniform(-20, 20)),
+        sensors=rng.choice([None, [1, 2]]),
+        category=_maybe_none(rng.randint(0, 7)),
+    )
+
+
+def _expected_positions(states, max_age=60, **kwargs) -> dict:
+    positions = {}
+    for _state in states:
+        position = validated_position(_state, **kwargs)
+        if position is None:
+            continue
+        if STATES_TIME - position["time_position"] > max_age:
+            continue
+        positions[position["callsign"]] = position
+    return positions
+
+
+# ---------------------------------------------------------------------------
+# validated_callsign
+# ---------------------------------------------------------------------------
+
+
+def test_validated_callsign_removes_leading_zeros():
+    assert validated_callsign("dlh0400 ") == {
+        "callsign": "DLH400",
+        "operator_icao": "DLH",
+        "callsign_number": 400,
+    }
+    assert validated_callsign("DLH0") is None
+    assert (
+        validated_callsign("DLH4AB", allow_alphanumerical_callsign=False)
+        is None
+    )
+
+
+# ---------------------------------------------------------------------------
+# validated_positions
+# ---------------------------------------------------------------------------
+
+
+def test_validated_positions_single_state():
+    positions = validated_positions([_state()], STATES_TIME)
+    assert positions == {"DLH400": validated_position(_state())}
+    assert positions["DLH400"]["flight_level"] == 328
+    assert positions["DLH400"]["sensors"] == []
+
+
+def test_validated_positions_filters():
+    states = [
+        _state(callsign="DLH0"),
+        _state(callsign="BAW1", latitude=None),
+        _state(callsign="BAW2", on_ground=True, baro_altitude=None),
+        _state(callsign="BAW3", baro_altitude=18500.0),
+        _state(callsign="BAW4", time_position=STATES_TIME - 61),
+        _state(callsign="BAW5", time_position=STATES_TIME - 60),
+    ]
+    assert list(validated_positions(states, STATES_TIME)) == ["BAW5"]
+    positions = validated_positions(
+        states, STATES_TIME, allow_on_ground=True, max_age=None
+    )
+    assert list(positions) == ["BAW2", "BAW4", "BAW5"]
+    assert "flight_level" not in positions["BAW2"]
+
+
+def test_validated_positions_empty():
+    assert validated_positions([], STATES_TIME) == {}
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {},
+        {"allow_on_ground": True},
+        {"allow_numerical_callsign": False},
+        {"allow_alphanumerical_callsign": False},
+        {"accepted_operators": ["DLH", "EWG"]},
+        {"use_registration": False},
+    ],
+)
+def test_validated_positions_matches_validated_position(kwargs):
+    rng = random.Random(42)
+    states = [_random_state(rng) for _ in range(2000)]
+    positions = validated_positions(states, STATES_TIME, **kwargs)
+    expected = _expected_positions(states, **kwargs)
+    assert len(expected) > 50
+    assert positions == expected
+    assert list(positions) == list(expected)
+
+
+def test_validated_positions_submits_unknown_icao24(
+    submitted_icao24s, monkeypatch
+):
+    monkeypatch.setattr(
+        opensky_utils, "icao24_to_registration", RegistrationStore()
+    )
+    states = [_state(icao24="ffffff")]
+    position = validated_positions(states, STATES_TIME)["DLH400"]
+    assert "registration" not in position
+    assert submitted_icao24s == ["ffffff"]
+    opensky_utils.icao24_to_registration.update({"ffffff": "DAIBL"})
+    position = validated_positions(states, STATES_TIME)["DLH400"]
+    assert position["registration"] == "DAIBL"
+    assert submitted_icao24s == ["ffffff"]
+
+
+# ---------------------------------------------------------------------------
+# update_icao24s_from_redis
+# ---------------------------------------------------------------------------
+
+
+def test_update_icao24s_from_redis_merges_new_entries(
+    redis_connection, monkeypatch
+):
+    store = RegistrationStore({"3c6444": "DAIBL"})
+    monkeypatch.setattr(opensky_utils, "icao24_to_registration", store)
+    monkeypatch.setattr(opensky_utils, "_icao24s_stream", None)
+    entry = ("2-0", {"icao24": "3c6555", "registration": "DAIBM"})
+    redis_connection.pipeline().execute.side_effect = [
+        [{"last-generated-id": "1-0", "entries-added": 1}, {"4ca123": "E"}],
+        [{"entries-added": 2}, [entry]],
+        [{"entries-added": 2}, []],
+    ]
+    for _ in range(3):
+        opensky_utils.update_icao24s_from_redis()
+    assert redis_connection.pipeline().hgetall.call_count == 1
+    assert redis_connection.pipeline().xrange.call_args.kwargs == {
+        "min": "(2-0"
+    }
+    assert dict(store) == {"3c6444": "DAIBL", "4ca123": "E", "3c6555": "DAIBM"}
+
+
+def test_update_icao24s_from_redis_rereads_trimmed_updates(
+    redis_connection, monkeypatch
+):
+    store = RegistrationStore()
+    monkeypatch.setattr(opensky_utils, "icao24_to_registration", store)
+    monkeypatch.setattr(opensky_utils, "_icao24s_stream", ("1-0", 1))
+    entry = ("3-0", {"icao24": "3c6555", "registration": "DAIBM"})
+    redis_connection.pipeline().execute.side_effect = [
+        [{"entries-added": 3}, [entry]],
+        [{"last-generated-id": "3-0", "entries-added": 3}, {"4ca123": "E"}],
+    ]
+    opensky_utils.update_icao24s_from_redis()
+    assert dict(store) == {"4ca123": "E"}
+    assert opensky_utils._icao24s_stream == ("3-0", 3)
+
+
+# ---------------------------------------------------------------------------
+# RegistrationResolver
+# ---------------------------------------------------------------------------
+
+
+def test_registration_resolver_retries_with_backoff(redis_connection):
+    resolver = RegistrationResolver(rate_limit=1000, backoff=0)
+    resolver._session = MagicMock()
+    resolver._session.get.side_effect = [
+        _response(429, headers={"Retry-After": "0"}),
+        _response(503),
+        _response(200, "D-AIBL"),
+    ]
+    assert resolver._resolve("3c6444") is True
+    assert resolver._session.get.call_count == 3
+    assert resolver._session.get.call_args.kwargs["timeout"] == 10.0
+    redis_connection.pipeline().hset.assert_called_once_with(
+        "icao24s", "3c6444", "DAIBL"
+    )
+
+
+def test_registration_resolver_gives_up(redis_connection):
+    resolver = RegistrationResolver(rate_limit=1000, max_retries=2, backoff=0)
+    resolver._session = MagicMock()
+    resolver._session.get.side_effect = (
+        opensky_utils.requests.exceptions.ConnectTimeout
+    )
+    assert resolver._resolve("3c6444") is False
+    assert resolver._session.get.call_count == 3
+    redis_connection.sadd.assert_not_called()
+
+
+def test_registration_resolver_marks_unknown(redis_connection):
+    resolver = RegistrationResolver(rate_limit=1000)
+    resolver._session = MagicMock()
+    resolver._session.get.return_value = _response(404)
+    assert resolver._resolve("3c6444") is True
+    redis_connection.sadd.assert_called_once_with("unknown_icao24s", "3c6444")
+    redis_connection.sismember.return_value = True
+    assert resolver._resolve("3c6444") is True
+    assert resolver._session.get.call_count == 1
+
+
+def test_registration_resolver_resolves_in_background(
+    redis_connection, monkeypatch
+):
+    session = MagicMock()
+    session.get.return_value = _response(200, "D-AIBL")
+    monkeypatch.setattr(opensky_utils.requests, "Session", lambda: session)
+    resolver = RegistrationResolver(workers=2, rate_limit=1000)
+    for _icao24 in ["3c6444", "3c6444", "3c6555"]:
+        resolver.submit(_icao24)
+    resolver.join()
+    assert len(resolver) == 0
+    assert session.get.call_count == 2
+    resolver.submit("3c6444")
+    resolver.join()
+    assert session.get.call_count == 2
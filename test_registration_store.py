@@ -0,0 +1,70 @@
+import random
+import pytest
+from registration_store import RegistrationStore
+
+REGISTRATIONS = {
+    "3c6444": "DAIBL",
+    "4ca123": "EIDCL",
+    "a1b2c3": "N12345",
+    "000001": "ÖEABC",
+    # Invalid icao24s are kept in the overlay.
+    "22222": "HBASA",
+    "3C6555": "DABCD",
+}
+
+
+# ---------------------------------------------------------------------------
+# RegistrationStore
+# ---------------------------------------------------------------------------
+
+
+def test_registration_store_mapping():
+    store = RegistrationStore(REGISTRATIONS)
+    assert len(store) == len(REGISTRATIONS)
+    assert dict(store) == REGISTRATIONS
+    assert store["000001"] == "ÖEABC"
+    assert store.get("3c6555") is None
+    assert "22222" in store
+    with pytest.raises(KeyError):
+        store["ffffff"]
+
+
+def test_registration_store_update_and_compact():
+    store = RegistrationStore(REGISTRATIONS)
+    store.update({"3c6444": "DAIBM", "ffffff": "GABCD"})
+    expected = dict(REGISTRATIONS, **{"3c6444": "DAIBM", "ffffff": "GABCD"})
+    assert dict(store) == expected
+    assert len(store) == len(expected)
+    store.compact()
+    assert dict(store) == expected
+    assert len(store) == len(expected)
+
+
+def test_registration_store_get_many():
+    rng = random.Random(1)
+    registrations = {
+        f"{rng.randrange(1 << 24):06x}": f"N{_i}" for _i in range(5000)
+    }
+    store = RegistrationStore(registrations)
+    store.update({"3c6444": "DAIBL", "3C6444": "DAIBM"})
+    registrations.update({"3c6444": "DAIBL", "3C6444": "DAIBM"})
+    icao24s = list(registrations)[::7] + [
+        "3C6444",
+        "ffffff0",
+        "",
+        "zzzzzz",
+        "ä00000",
+    ]
+    assert store.get_many(icao24s) == [
+        registrations.get(_icao24) for _icao24 in icao24s
+    ]
+    assert store.get_many([]) == []
+    assert RegistrationStore().get_many(["3c6444"]) == [None]
+
+
+def test_registration_store_save_and_load(tmp_path):
+    store = RegistrationStore(REGISTRATIONS)
+    store.save(tmp_path / "registrations.npz")
+    loaded = RegistrationStore.load(tmp_path / "registrations.npz")
+    assert dict(loaded) == REGISTRATIONS
+    assert loaded.get_many(["000001", "22222"]) == ["ÖEABC", "HBASA"]
@@ -0,0 +1,143 @@
+import sqlite3
+import pytest
+import route_info
+from config import OUTDATED
+from route_info import (
+    flush_queued_writes,
+    get_checked_flightroute,
+    increase_error_count,
+    queue_checked_flightroute,
+    queue_error_count_increase,
+    set_checked_flightroute,
+)
+
+
+@pytest.fixture(autouse=True)
+def routes_db(tmp_path, monkeypatch):
+    """Redirects route_info to an empty flight_routes database."""
+    db_file = tmp_path / "flight_routes.sqb"
+    with sqlite3.connect(db_file) as connection:
+        with open(
+            route_info.PWD + "/flight_routes.sql", encoding="utf-8"
+        ) as f:
+            connection.executescript(f.read())
+    route_info.close_connection()
+    monkeypatch.setattr(route_info, "ROUTES_DB_FILE", str(db_file))
+    yield db_file
+    route_info.close_connection()
+
+
+def _flight(**kwargs) -> dict:
+    flight = {
+        "callsign": "DLH400",
+        "route": "EDDF-KJFK",
+        "source": "test",
+        "airline_icao": "DLH",
+        "airline_iata": "LH",
+        "flight_number": 400,
+    }
+    flight.update(kwargs)
+    return flight
+
+
+def _execute(db_file, query: str, parameters=()) -> None:
+    with sqlite3.connect(db_file) as connection:
+        connection.execute(query, parameters)
+
+
+# ---------------------------------------------------------------------------
+# set_checked_flightroute
+# ---------------------------------------------------------------------------
+
+
+def test_set_checked_flightroute_inserts_new_route():
+    assert set_checked_flightroute(_flight(), quality=3) is True
+    result = get_checked_flightroute("DLH400", "EDDF-KJFK")
+    assert result["quality"] == 3
+    assert result["errors"] == 0
+    assert result["valid_from"] == result["update_time"]
+    assert result["operator_iata"] == "LH"
+
+
+def test_set_checked_flightroute_lower_quality_denied():
+    assert set_checked_flightroute(_flight(source="good"), quality=5)
+    assert set_checked_flightroute(_flight(source="bad"), quality=1) is False
+    assert get_checked_flightroute("DLH400", "EDDF-KJFK")["source"] == "good"
+
+
+def test_set_checked_flightroute_equal_or_higher_quality_allowed():
+    assert set_checked_flightroute(_flight(), quality=3)
+    assert set_checked_flightroute(_flight(source="same"), quality=3)
+    assert set_checked_flightroute(_flight(source="better"), quality=5)
+    result = get_checked_flightroute("DLH400", "EDDF-KJFK")
+    assert result["source"] == "better"
+    assert result["quality"] == 5
+
+
+def test_set_checked_flightroute_outdated_route_overwritten(routes_db):
+    assert set_checked_flightroute(_flight(), quality=5)
+    _execute(
+        routes_db, "UPDATE flight_routes SET UpdateTime=?", (OUTDATED - 1,)
+    )
+    assert set_checked_flightroute(_flight(source="new"), quality=0)
+    assert get_checked_flightroute("DLH400", "EDDF-KJFK")["quality"] == 0
+
+
+def test_set_checked_flightroute_many_errors_overwritten():
+    assert set_checked_flightroute(_flight(), quality=5)
+    for _ in range(11):
+        increase_error_count("DLH400", "EDDF-KJFK")
+    assert set_checked_flightroute(_flight(source="new"), quality=0)
+    result = get_checked_flightroute("DLH400", "EDDF-KJFK")
+    assert result["source"] == "new"
+    # The flight number is unchanged, so the errors are kept.
+    assert result["errors"] == 11
+
+
+def test_set_checked_flightroute_keeps_valid_from_and_errors(routes_db):
+    assert set_checked_flightroute(_flight(), quality=3)
+    _execute(routes_db, "UPDATE flight_routes SET ValidFrom=1000")
+    increase_error_count("DLH400", "EDDF-KJFK")
+    assert set_checked_flightroute(_flight(), quality=3)
+    result = get_checked_flightroute("DLH400", "EDDF-KJFK")
+    assert result["valid_from"] == 1000
+    assert result["errors"] == 1
+    assert set_checked_flightroute(_flight(), quality=3, reset_errors=True)
+    result = get_checked_flightroute("DLH400", "EDDF-KJFK")
+    assert result["valid_from"] == 1000
+    assert result["errors"] == 0
+
+
+def test_set_checked_flightroute_new_flight_number_resets(routes_db):
+    assert set_checked_flightroute(_flight(), quality=3)
+    _execute(routes_db, "UPDATE flight_routes SET ValidFrom=1000")
+    increase_error_count("DLH400", "EDDF-KJFK")
+    assert set_checked_flightroute(_flight(flight_number=402), quality=3)
+    result = get_checked_flightroute("DLH400", "EDDF-KJFK")
+    assert result["valid_from"] != 1000
+    assert result["errors"] == 0
+    assert result["flight_number"] == 402
+
+
+# ---------------------------------------------------------------------------
+# queued writes
+# ---------------------------------------------------------------------------
+
+
+def test_queued_writes_deferred_until_flush():
+    queue_checked_flightroute(_flight(), quality=3)
+    queue_error_count_increase("DLH400", "EDDF-KJFK")
+    assert get_checked_flightroute("DLH400", "EDDF-KJFK") is None
+    assert flush_queued_writes() == (1, 1)
+    assert get_checked_flightroute("DLH400", "EDDF-KJFK")["errors"] == 1
+    assert flush_queued_writes() == (0, 0)
+
+
+def test_queued_writes_apply_quality_rules():
+    queue_checked_flightroute(_flight(source="good"), quality=5)
+    queue_checked_flightroute(_flight(source="bad"), quality=1)
+    queue_checked_flightroute(_flight(callsign="DLH9AB"), quality=1)
+    queue_error_count_increase("DLH1", "EDDF-KJFK")
+    assert flush_queued_writes() == (2, 0)
+    assert get_checked_flightroute("DLH400", "EDDF-KJFK")["source"] == "good"
+    assert get_checked_flightroute("DLH9AB", "EDDF-KJFK") is not None
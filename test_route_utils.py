@@ -203,3 +203,187 @@ def test_route_check_simple_wrong_route_fails():
     result = route_check_simple(_POS_CRUISE.copy(), "ESSA-EDDF")
     assert result is not None
     assert result["check_failed"] is True
+
+
+# ---------------------------------------------------------------------------
+# geodesic_inverse_batch and route_geometry_batch
+# ---------------------------------------------------------------------------
+
+import numpy as np
+import pygeodesy.ellipsoidalVincenty as ev
+from airport_info import get_airport_info
+from route_utils import geodesic_inverse_batch, route_geometry_batch
+
+_PAIRS = [
+    (52.3086, 4.7639, 59.6519, 17.9186),
+    (56.088, 11.779, 59.6519, 17.9186),
+    (50.0333, 8.5706, 40.6398, -73.7789),
+    (-16.466, 179.340, -16.691, -179.877),
+    (0.0, 0.0, 0.0, 90.0),
+]
+
+
+def test_geodesic_inverse_batch_matches_vincenty():
+    lat1, lon1, lat2, lon2 = np.array(_PAIRS).T
+    distance, initial, final = geodesic_inverse_batch(lat1, lon1, lat2, lon2)
+    for i, _pair in enumerate(_PAIRS):
+        expected = ev.LatLon(*_pair[:2]).distanceTo3(ev.LatLon(*_pair[2:]))
+        assert distance[i] == pytest.approx(expected[0], abs=1e-3)
+        assert initial[i] == pytest.approx(expected[1], abs=1e-6)
+        assert final[i] == pytest.approx(expected[2], abs=1e-6)
+
+
+def test_geodesic_inverse_batch_coincident_points():
+    distance, initial, final = geodesic_inverse_batch(52.0, 7.0, 52.0, 7.0)
+    assert distance == 0.0
+    assert initial == 0.0
+    assert final == 0.0
+
+
+def test_geodesic_inverse_batch_near_antipodal_uses_fallback():
+    """Vincenty does not converge here, the exact fallback must step in."""
+    distance, _, _ = geodesic_inverse_batch(0.0, 0.0, 0.5, 179.7)
+    assert 19.9e6 < distance < 20.1e6
+
+
+def test_geodesic_inverse_batch_broadcasts():
+    distance, _, _ = geodesic_inverse_batch(
+        np.array([[52.0], [53.0]]), 7.0, np.array([[50.0, 51.0]]), 8.0
+    )
+    assert distance.shape == (2, 2)
+    assert distance[0, 1] == pytest.approx(
+        geodesic_inverse_batch(52.0, 7.0, 51.0, 8.0)[0]
+    )
+
+
+def test_geodesic_inverse_batch_nan_input():
+    distance, initial, _ = geodesic_inverse_batch(np.nan, 7.0, 52.0, 7.0)
+    assert np.isnan(distance)
+    assert np.isnan(initial)
+
+
+def test_route_geometry_batch_matches_single_route_check():
+    origin = get_airport_info("EHAM")
+    destination = get_airport_info("ESSA")
+    positions = [_POS_NEAR_AMSTERDAM, _POS_CRUISE, _POS_NEAR_STOCKHOLM]
+    result = route_geometry_batch(
+        [_p["latitude"] for _p in positions],
+        [_p["longitude"] for _p in positions],
+        origin["Latitude"],
+        origin["Longitude"],
+        destination["Latitude"],
+        destination["Longitude"],
+        headings=[_p["heading"] for _p in positions],
+    )
+    for i, _position in enumerate(positions):
+        expected = single_route_check_simple(_position.copy(), "EHAM-ESSA")
+        for _key in (
+            "route_length",
+            "dist_origin",
+            "dist_destination",
+            "deviation",
+        ):
+            assert result[_key][i] == pytest.approx(expected[_key], abs=1e-3)
+        for _key in ("progress", "deviation_ratio", "error_angle"):
+            assert result[_key][i] == pytest.approx(expected[_key], abs=1e-6)
+
+
+# ---------------------------------------------------------------------------
+# route_check_batch
+# ---------------------------------------------------------------------------
+
+from route_utils import route_check_batch
+
+_BATCH_POSITIONS = [
+    _POS_NEAR_AMSTERDAM,
+    _POS_CRUISE,
+    _POS_NEAR_STOCKHOLM,
+    _POS_DEVIATED,
+]
+_BATCH_ROUTES = [
+    "EHAM-ESSA",
+    "ESSA-EHAM",
+    "ESSA-EDDF",
+    "EDDF-EHAM-ESSA",
+    "EHAM-EHAM",
+    "EHAM-ZZZZ",
+]
+
+
+def test_route_check_batch_shape():
+    result = route_check_batch(_BATCH_POSITIONS, _BATCH_ROUTES)
+    assert result.shape == (len(_BATCH_POSITIONS), len(_BATCH_ROUTES))
+
+
+def test_route_check_batch_matches_route_check_simple():
+    result = route_check_batch(_BATCH_POSITIONS, _BATCH_ROUTES)
+    for i, _position in enumerate(_BATCH_POSITIONS):
+        for j, _route in enumerate(_BATCH_ROUTES):
+            expected = route_check_simple(_position.copy(), _route)
+            if expected is None:
+                assert not result[i, j]["valid"]
+                continue
+            assert result[i, j]["valid"]
+            assert (
+                bool(result[i, j]["check_failed"]) == expected["check_failed"]
+            )
+            assert result[i, j]["deviation"] == pytest.approx(
+                expected["deviation"], abs=1e-3
+            )
+            assert result[i, j]["progress"] == pytest.approx(
+                expected["progress"], abs=1e-6
+            )
+
+
+def test_route_check_batch_selects_current_segment():
+    """The cruise position is on the second segment of EDDF-EHAM-ESSA."""
+    result = route_check_batch([_POS_CRUISE], ["EDDF-EHAM-ESSA"])
+    assert result[0, 0]["segment"] == 1
+    assert not result[0, 0]["check_failed"]
+
+
+def test_route_check_batch_on_ground_rule():
+    on_ground = dict(_POS_NEAR_AMSTERDAM, on_ground=True, vertical_rate=None)
+    far_on_ground = dict(_POS_CRUISE, on_ground=True, vertical_rate=None)
+    result = route_check_batch([on_ground, far_on_ground], ["EHAM-ESSA"])
+    assert not result[0, 0]["check_failed"]
+    assert result[1, 0]["check_failed"]
+
+
+def test_route_check_batch_empty_positions():
+    result = route_check_batch([], ["EHAM-ESSA"])
+    assert result.shape == (0, 1)
+
+
+def test_route_check_batch_column_input():
+    columns = {
+        _key: [_position[_key] for _position in _BATCH_POSITIONS]
+        for _key in (
+            "latitude",
+            "longitude",
+            "heading",
+            "vertical_rate",
+            "on_ground",
+        )
+    }
+    from_columns = route_check_batch(columns, _BATCH_ROUTES)
+    from_dicts = route_check_batch(_BATCH_POSITIONS, _BATCH_ROUTES)
+    assert (from_columns["check_failed"] == from_dicts["check_failed"]).all()
+
+
+# ---------------------------------------------------------------------------
+# segment length table
+# ---------------------------------------------------------------------------
+
+from unittest.mock import patch
+
+
+def test_get_single_route_length_uses_segment_table():
+    with patch("route_utils._route_lengths", {("EDDG", "EDDF"): 123.0}):
+        assert get_single_route_length("EDDG", "EDDF") == 123.0
+
+
+def test_get_single_route_length_table_miss_is_computed():
+    computed = get_single_route_length("EDDG", "EDDF")
+    with patch("route_utils._route_lengths", {}):
+        assert get_single_route_length("EDDG", "EDDF") == computed
@@ -0,0 +1,258 @@
+import random
+import arrow
+import pandas as pd
+from airport_info import get_airport_icao, get_airport_info
+from schedule_utils import (
+    SCHEDULE_COLUMNS,
+    dates_by_month,
+    describe_dates,
+    drop_multi_segment_totals,
+    expand_schedule,
+    schedule_dates,
+    schedule_flights,
+    weekday_mask,
+)
+
+_AIRPORTS = ["JFK", "LHR", "FRA", "SIN", "NRT", "LAX", "GRU"]
+
+
+def _schedule_row(origin: str, destination: str, **kwargs) -> dict:
+    row = {
+        "airline_iata": "UA",
+        "airline_icao": "UAL",
+        "flight_number": 900,
+        "origin": origin,
+        "destination": destination,
+        "weekdays": weekday_mask(range(1, 8)),
+        "valid_from": pd.Timestamp("2026-03-01"),
+        "valid_until": pd.Timestamp("2026-11-30"),
+        "departure_time": pd.Timedelta(hours=22, minutes=20),
+        "arrival_time": pd.Timedelta(hours=6, minutes=45),
+    }
+    row.update(kwargs)
+    return row
+
+
+def _schedule(rows: list[dict]) -> pd.DataFrame:
+    return pd.DataFrame(rows, columns=list(SCHEDULE_COLUMNS))
+
+
+def _local_timestamp(date: arrow.Arrow, offset, iata: str) -> int:
+    _timezone = get_airport_info(get_airport_icao(iata))["Timezone"]
+    _local = date.shift(seconds=int(offset.total_seconds()))
+    return arrow.get(_local.naive, tzinfo=_timezone).int_timestamp
+
+
+def _reference(rows: list[dict], dates: list[arrow.Arrow]) -> dict:
+    """The former per-row expansion with arrow."""
+    flights = {}
+    for _row in rows:
+        for _date in dates:
+            if not (
+                _row["valid_from"]
+                <= pd.Timestamp(_date.naive)
+                <= _row["valid_until"]
+            ):
+                continue
+            if not _row["weekdays"] & (1 << (_date.isoweekday() - 1)):
+                continue
+            _departure = _local_timestamp(
+                _date, _row["departure_time"], _row["origin"]
+            )
+            _arrival = _local_timestamp(
+                _date, _row["arrival_time"], _row["destination"]
+            )
+            _route = "-".join(
+                get_airport_icao(_iata)
+                for _iata in (_row["origin"], _row["destination"])
+            )
+            _id = (
+                f"{_row['airline_iata']}_{_row['flight_number']}_{_route}_"
+                f"{_date.format('YYYYMMDD')}"
+            )
+            flights[_id] = (_departure, _arrival)
+    return flights
+
+
+# ---------------------------------------------------------------------------
+# schedule_dates / dates_by_month
+# ---------------------------------------------------------------------------
+
+
+def test_schedule_dates_by_month():
+    dates = schedule_dates(arrow.get("2026-04-29T12:00:00"), 4)
+    assert [_date.format("YYYY-MM-DD HH") for _date in dates] == [
+        "2026-04-29 12",
+        "2026-04-30 12",
+        "2026-05-01 12",
+        "2026-05-02 12",
+    ]
+    assert [len(_dates) for _dates in dates_by_month(dates)] == [2, 2]
+    assert describe_dates(dates) == "2026-04-29 to 2026-05-02"
+    assert describe_dates(dates[:1]) == "2026-04-29"
+
+
+# ---------------------------------------------------------------------------
+# drop_multi_segment_totals
+# ---------------------------------------------------------------------------
+
+
+def test_drop_multi_segment_totals():
+    flights = [
+        {"airline_iata": "LH", "flight_number": 8160, "segment_number": 0},
+        {"airline_iata": "LH", "flight_number": 8160, "segment_number": 1},
+        {"airline_iata": "LH", "flight_number": 8160, "segment_number": 2},
+        {"airline_iata": "LH", "flight_number": 8400, "segment_number": 0},
+    ]
+    assert drop_multi_segment_totals(flights) == flights[1:]
+
+
+# ---------------------------------------------------------------------------
+# weekday_mask
+# ---------------------------------------------------------------------------
+
+
+def test_weekday_mask():
+    assert weekday_mask({1, 3, 5}) == 0b10101
+    assert weekday_mask([7, 7, 0, 8]) == 0b1000000
+    assert weekday_mask([]) == 0
+
+
+# ---------------------------------------------------------------------------
+# expand_schedule
+# ---------------------------------------------------------------------------
+
+
+def test_expand_schedule_matches_arrow_reference():
+    rng = random.Random(23)
+    rows = []
+    for _i in range(200):
+        _origin, _destination = rng.sample(_AIRPORTS, 2)
+        _valid_from = pd.Timestamp("2026-03-01") + pd.Timedelta(
+            days=rng.randint(0, 250)
+        )
+        rows.append(
+            _schedule_row(
+                _origin,
+                _destination,
+                flight_number=_i,
+                weekdays=rng.randint(1, 127),
+                valid_from=_valid_from,
+                valid_until=_valid_from
+                + pd.Timedelta(days=rng.randint(0, 30)),
+                departure_time=pd.Timedelta(minutes=rng.randrange(0, 1440)),
+                arrival_time=pd.Timedelta(minutes=rng.randrange(0, 2880)),
+            )
+        )
+    # Dates around the daylight saving time changes in 2026, including
+    # local times skipped or repeated by the clock change.
+    rows.append(
+        _schedule_row("JFK", "LHR", departure_time=pd.Timedelta(hours=2.5))
+    )
+    rows.append(
+        _schedule_row("LHR", "JFK", arrival_time=pd.Timedelta(hours=1.5))
+    )
+    for _first, _last in [
+        ("2026-03-06", "2026-03-10"),
+        ("2026-03-27", "2026-03-31"),
+        ("2026-10-23", "2026-11-03"),
+        ("2026-06-01", "2026-09-30"),
+    ]:
+        flights, unknown_airports = expand_schedule(
+            _schedule(rows), _first, _last
+        )
+        assert unknown_airports == set()
+        _dates = list(
+            arrow.Arrow.range(
+                "day", arrow.get(_first).naive, arrow.get(_last).naive
+            )
+        )
+        expected = _reference(rows, _dates)
+        assert {
+            _flight["_id"]: (_flight["departure"], _flight["arrival"])
+            for _flight in schedule_flights(flights)
+        } == expected
+
+
+def test_expand_schedule_single_date_filters_weekday_and_validity():
+    rows = [
+        _schedule_row("JFK", "LHR", flight_number=1),
+        # Monday only, 2026-04-06 is a Monday.
+        _schedule_row("JFK", "LHR", flight_number=2, weekdays=0b1),
+        _schedule_row("JFK", "LHR", flight_number=3, weekdays=0b10),
+        _schedule_row(
+            "JFK",
+            "LHR",
+            flight_number=4,
+            valid_until=pd.Timestamp("2026-04-05"),
+        ),
+        _schedule_row(
+            "JFK",
+            "LHR",
+            flight_number=5,
+            valid_from=pd.Timestamp("2026-04-06"),
+            valid_until=pd.Timestamp("2026-04-06"),
+        ),
+    ]
+    flights, _ = expand_schedule(
+        _schedule(rows), arrow.get("2026-04-06").naive
+    )
+    assert sorted(flights["flight_number"].tolist()) == [1, 2, 5]
+    assert set(flights["route"]) == {"KJFK-EGLL"}
+
+
+def test_expand_schedule_unknown_airports():
+    rows = [
+        _schedule_row("JFK", "LHR", flight_number=1),
+        _schedule_row("XXX", "LHR", flight_number=2),
+        _schedule_row("JFK", "YYY", flight_number=3),
+    ]
+    flights, unknown_airports = expand_schedule(_schedule(rows), "2026-04-06")
+    assert unknown_airports == {"XXX", "YYY"}
+    assert flights["flight_number"].tolist() == [1]
+
+
+def test_expand_schedule_shift_overnight():
+    rows = [_schedule_row("JFK", "LHR")]
+    flights, _ = expand_schedule(_schedule(rows), "2026-04-06")
+    # 22:20 EDT and 06:45 BST on the same date.
+    assert (
+        flights["departure"][0] == arrow.get("2026-04-07T02:20Z").int_timestamp
+    )
+    assert (
+        flights["arrival"][0] == arrow.get("2026-04-06T05:45Z").int_timestamp
+    )
+    flights, _ = expand_schedule(
+        _schedule(rows), "2026-04-06", shift_overnight=True
+    )
+    assert (
+        flights["arrival"][0] == arrow.get("2026-04-07T05:45Z").int_timestamp
+    )
+
+
+def test_expand_schedule_empty():
+    flights, unknown_airports = expand_schedule(_schedule([]), "2026-04-06")
+    assert len(flights) == 0
+    assert unknown_airports == set()
+    assert schedule_flights(flights) == []
+
+
+# ---------------------------------------------------------------------------
+# schedule_flights
+# ---------------------------------------------------------------------------
+
+
+def test_schedule_flights_documents():
+    flights, _ = expand_schedule(
+        _schedule([_schedule_row("FRA", "SIN", flight_number=7)]),
+        "2026-04-06",
+        "2026-04-07",
+    )
+    documents = schedule_flights(flights)
+    assert [_flight["_id"] for _flight in documents] == [
+        "UA_7_EDDF-WSSS_20260406",
+        "UA_7_EDDF-WSSS_20260407",
+    ]
+    assert all(type(_flight["departure"]) is int for _flight in documents)
+    assert all(type(_flight["flight_number"]) is int for _flight in documents)
+    assert documents[0]["segment_number"] == 0
@@ -4,17 +4,27 @@ import pathlib
 import tempfile
 import arrow
 import openpyxl
+import pandas as pd
 import pytest
 from unittest.mock import patch
+import flight_data_source
+from flight_data_source import UpsertCounts
 from united_cargo_data import (
+    _clock_times,
+    _int_times,
     _operating_days,
-    _parse_int_time,
-    _parse_time_obj,
-    _process_widebody_row,
-    _process_simple_row,
+    _weekdays,
     Airline,
 )
 
+
+@pytest.fixture(autouse=True)
+def schedule_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        flight_data_source, "SCHEDULE_CACHE_DIRECTORY", tmp_path / "cache"
+    )
+
+
 # ---------------------------------------------------------------------------
 # XLSX fixture helpers
 # ---------------------------------------------------------------------------
@@ -94,12 +104,27 @@ def _make_xlsx(
     return _path
 
 
-def _run_update(xlsx_path: pathlib.Path, utc: arrow.Arrow) -> list[dict]:
+def _capture(stored: list):
+    """Returns an update_flights replacement appending to stored."""
+
+    def _update_flights(flights):
+        _flights = list(flights)
+        stored.extend(_flights)
+        return [UpsertCounts(len(_flights), 0, 0, len(_flights))]
+
+    return _update_flights
+
+
+def _run_update(
+    xlsx_path: pathlib.Path, utc: arrow.Arrow, days: int = 1
+) -> list[dict]:
     stored = []
     airline = Airline()
     with patch("united_cargo_data.PWD", xlsx_path.parent):
-        with patch.object(airline, "update_flight", side_effect=stored.append):
-            airline.update_data(utc)
+        with patch.object(
+            airline, "update_flights", side_effect=_capture(stored)
+        ):
+            airline.update_data(utc, days=days)
     return stored
 
 
@@ -120,33 +145,35 @@ def test_operating_days_subset():
     assert _operating_days(135) == {1, 3, 5}
 
 
+def test_weekdays_masks():
+    result = _weekdays(pd.Series([1234567, 135, "1 3", None, 7.0]))
+    assert result.tolist() == [0b1111111, 0b10101, 0, 0, 0b1000000]
+
+
 # ---------------------------------------------------------------------------
-# _parse_int_time
+# _int_times
 # ---------------------------------------------------------------------------
 
 
-def test_parse_int_time_basic():
-    result = _parse_int_time(1430, "2026-04-06", "America/New_York")
-    assert result.hour == 14
-    assert result.minute == 30
+def test_int_times_basic():
+    result = _int_times(pd.Series([1430]))
+    assert result[0] == pd.Timedelta(hours=14, minutes=30)
 
 
-def test_parse_int_time_zero_padded():
-    result = _parse_int_time(545, "2026-04-06", "Europe/London")
-    assert result.hour == 5
-    assert result.minute == 45
+def test_int_times_zero_padded():
+    result = _int_times(pd.Series([545]))
+    assert result[0] == pd.Timedelta(hours=5, minutes=45)
 
 
 # ---------------------------------------------------------------------------
-# _parse_time_obj
+# _clock_times
 # ---------------------------------------------------------------------------
 
 
-def test_parse_time_obj_basic():
-    _t = datetime.time(9, 30)
-    result = _parse_time_obj(_t, "2026-04-06", "America/Chicago")
-    assert result.hour == 9
-    assert result.minute == 30
+def test_clock_times_basic():
+    result = _clock_times(pd.Series([datetime.time(9, 30), "n/a"]))
+    assert result[0] == pd.Timedelta(hours=9, minutes=30)
+    assert pd.isna(result[1])
 
 
 # ---------------------------------------------------------------------------
@@ -252,6 +279,16 @@ def test_widebody_overnight_arrival_shifted():
     assert stored[0]["arrival"] > stored[0]["departure"]
 
 
+def test_widebody_times_converted_to_utc():
+    _path = _make_xlsx([_WB_ROW_DAILY], [], [])
+    stored = _run_update(_path, _MON)
+    # 19:30 EDT at JFK, 07:55 BST at LHR on the next day.
+    assert (
+        stored[0]["departure"] == arrow.get("2026-04-06T23:30Z").int_timestamp
+    )
+    assert stored[0]["arrival"] == arrow.get("2026-04-07T06:55Z").int_timestamp
+
+
 def test_widebody_flight_id_format():
     _path = _make_xlsx([_WB_ROW_DAILY], [], [])
     stored = _run_update(_path, _MON)
@@ -324,13 +361,29 @@ def test_both_widebody_and_narrowbody_combined():
     assert len(stored) == 2
 
 
+def test_date_range_matches_single_days():
+    _path = _make_xlsx(
+        [_WB_ROW_DAILY, _WB_ROW_MON_ONLY, _WB_ROW_SHORT_VALIDITY],
+        [_NB_ROW_DAILY, _NB_ROW_THU_ONLY],
+        [],
+    )
+    stored = _run_update(_path, _MON, days=7)
+    expected = []
+    for _day in range(7):
+        expected.extend(_run_update(_path, _MON.shift(days=_day)))
+    assert len(stored) == 7 + 1 + 1 + 7 + 1
+    assert sorted(stored, key=lambda _f: _f["_id"]) == sorted(
+        expected, key=lambda _f: _f["_id"]
+    )
+
+
 def test_missing_file_logs_warning(caplog, tmp_path):
     airline = Airline()
     stored = []
     with caplog.at_level(logging.WARNING, logger="united_cargo_data.py"):
         with patch("united_cargo_data.PWD", tmp_path):
             with patch.object(
-                airline, "update_flight", side_effect=stored.append
+                airline, "update_flights", side_effect=_capture(stored)
             ):
                 airline.update_data(_MON)
     assert stored == []
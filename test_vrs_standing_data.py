@@ -0,0 +1,144 @@
+import os
+import sqlite3
+import pytest
+import vrs_standing_data
+from vrs_standing_data import (
+    get_airline_airports,
+    get_airline_routes,
+    get_flight_route,
+    refresh_database,
+)
+
+ROUTES = [
+    ("DLH400", "DLH", "EDDF-KJFK"),
+    ("DLH401", "DLH", "KJFK-EDDF"),
+    ("DLH402", "DLH", "EDDF-KJFK"),
+    ("BAW1", "BAW", "EGLL-KJFK"),
+]
+
+
+def _write_routes(db_file, routes) -> None:
+    with sqlite3.connect(db_file) as connection:
+        connection.execute("DELETE FROM flight_routes")
+        connection.executemany(
+            "INSERT INTO flight_routes(Callsign, OperatorIcao, Route) "
+            "VALUES(?, ?, ?)",
+            routes,
+        )
+
+
+@pytest.fixture(autouse=True)
+def routes_db(tmp_path, monkeypatch):
+    """Redirects vrs_standing_data to a temporary vrs_routes database."""
+    db_file = tmp_path / "vrs_routes.sqb"
+    with sqlite3.connect(db_file) as connection:
+        with open(
+            vrs_standing_data.PWD / "vrs_routes.sql", encoding="utf-8"
+        ) as f:
+            connection.executescript(f.read())
+    _write_routes(db_file, ROUTES)
+    monkeypatch.setattr(vrs_standing_data, "ROUTES_DB_FILE", db_file)
+    monkeypatch.setattr(
+        vrs_standing_data, "STAGING_DB_FILE", tmp_path / "vrs_routes_new.sqb"
+    )
+    monkeypatch.setattr(vrs_standing_data, "ROUTES_CSV_DIR", tmp_path / "csv")
+    monkeypatch.setattr(vrs_standing_data, "_route_index", None)
+    return db_file
+
+
+def _write_csv(tmp_path, name: str, rows: list[str]) -> None:
+    csv_file = tmp_path / "csv" / name
+    csv_file.parent.mkdir(parents=True, exist_ok=True)
+    csv_file.write_text(
+        "\ufeffCallsign,Code,Number,AirlineCode,AirportCodes\n"
+        + "".join(_row + "\n" for _row in rows),
+        encoding="utf-8",
+    )
+
+
+def _stored_routes(db_file) -> list[tuple]:
+    with sqlite3.connect(db_file) as connection:
+        return sorted(
+            connection.execute(
+                "SELECT Callsign, OperatorIcao, Route, SourceFile "
+                "FROM flight_routes"
+            ).fetchall()
+        )
+
+
+# ---------------------------------------------------------------------------
+# route index
+# ---------------------------------------------------------------------------
+
+
+def test_get_flight_route():
+    assert get_flight_route("DLH400") == "EDDF-KJFK"
+    assert get_flight_route("DLH9") is None
+
+
+def test_get_airline_routes():
+    assert get_airline_routes("DLH") == ["EDDF-KJFK", "KJFK-EDDF"]
+    assert get_airline_routes("EWG") == []
+    routes = get_airline_routes("BAW")
+    routes.append("EGLL-EDDF")
+    assert get_airline_routes("BAW") == ["EGLL-KJFK"]
+
+
+def test_get_airline_airports():
+    assert get_airline_airports("BAW") == {"EGLL", "KJFK"}
+    assert get_airline_airports("EWG") == frozenset()
+
+
+def test_route_index_reloaded_after_rewrite(routes_db, monkeypatch):
+    assert get_flight_route("BAW1") == "EGLL-KJFK"
+    _write_routes(routes_db, [("BAW1", "BAW", "EGLL-KBOS")])
+    _stat = os.stat(routes_db)
+    os.utime(routes_db, ns=(_stat.st_atime_ns, _stat.st_mtime_ns + 10**9))
+    # Not checked again within the check interval.
+    assert get_flight_route("BAW1") == "EGLL-KJFK"
+    monkeypatch.setattr(vrs_standing_data, "_next_check", 0.0)
+    assert get_flight_route("BAW1") == "EGLL-KBOS"
+    assert get_airline_routes("DLH") == []
+
+
+# ---------------------------------------------------------------------------
+# refresh_database
+# ---------------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_refresh_database_rebuilds(tmp_path, routes_db, workers):
+    _write_csv(
+        tmp_path,
+        "D/DLH-all.csv",
+        [
+            "DLH0400,DLH,0400,DLH,EDDF-KJFK",
+            "DLH400,DLH,400,DLH,EDDF-KEWR",
+            "DLH0,DLH,0,DLH,EDDF-KJFK",
+            "DLH401,DLH,401,DLH,EDDF-XX",
+        ],
+    )
+    _write_csv(tmp_path, "E/EWG-all.csv", ["DLH400,DLH,400,EWG,EDDL-LEPA"])
+    refresh_database(workers=workers)
+    assert _stored_routes(routes_db) == [
+        ("DLH400", "EWG", "EDDL-LEPA", "E/EWG-all.csv")
+    ]
+    assert get_flight_route("DLH400") == "EDDL-LEPA"
+    assert not (tmp_path / "vrs_routes_new.sqb").exists()
+
+
+def test_refresh_database_incremental(tmp_path, routes_db):
+    _write_csv(tmp_path, "B/BAW-all.csv", ["BAW1,BAW,1,BAW,EGLL-KJFK"])
+    _write_csv(tmp_path, "D/DLH-all.csv", ["DLH400,DLH,400,DLH,EDDF-KJFK"])
+    _write_csv(tmp_path, "E/EWG-all.csv", ["EWG1,EWG,1,EWG,EDDL-LEPA"])
+    refresh_database(workers=1)
+    _write_csv(tmp_path, "D/DLH-all.csv", ["DLH401,DLH,401,DLH,KJFK-EDDF"])
+    (tmp_path / "csv" / "E" / "EWG-all.csv").unlink()
+    with sqlite3.connect(routes_db) as connection:
+        # Rows of unchanged files are not imported again.
+        connection.execute("UPDATE flight_routes SET Route='EGLL-KBOS'")
+    refresh_database(incremental=True, workers=1)
+    assert _stored_routes(routes_db) == [
+        ("BAW1", "BAW", "EGLL-KBOS", "B/BAW-all.csv"),
+        ("DLH401", "DLH", "KJFK-EDDF", "D/DLH-all.csv"),
+    ]
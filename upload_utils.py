@@ -7,7 +7,7 @@ import requests
 
 from opensky_utils import validated_callsign
 from route_utils import check_route_airports, convert_to_iata_route
-from vrs_standing_data import get_airline_routes
+from vrs_standing_data import get_airline_airports
 
 logger = logging.getLogger(__name__)
 
@@ -73,14 +73,7 @@ def set_route(
             return None
         operator = callsign_info["operator_icao"]
         route_upper = route.upper()
-        airline_routes = get_airline_routes(operator)
-        airline_airports = list(
-            {
-                airport
-                for _route in airline_routes
-                for airport in _route.split("-")
-            }
-        )
+        airline_airports = get_airline_airports(operator)
         if check_route_airports(route_upper, airline_airports) is None:
             logger.debug(f"{callsign}: {route} did not pass route check.")
             return None
@@ -2,6 +2,13 @@ CREATE TABLE "flight_routes" (
   `Callsign` TEXT, 
   `OperatorIcao` TEXT, 
   `Route` TEXT, 
+  `SourceFile` TEXT, 
   PRIMARY KEY (`Callsign`)
 );
+CREATE TABLE "source_files" (
+  `FileName` TEXT, 
+  `Hash` TEXT, 
+  PRIMARY KEY (`FileName`)
+);
 CREATE INDEX `idx_OperatorIcao` ON "flight_routes" (`OperatorIcao`);
+CREATE INDEX `idx_SourceFile` ON "flight_routes" (`SourceFile`);
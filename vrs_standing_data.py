@@ -1,110 +1,343 @@
 #!venv/bin/python3
+import io
+import os
+import argparse
+import functools
+import time
 import pathlib
 import glob
 import csv
+import hashlib
 import sqlite3
 import logging
 import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
 from opensky_utils import validated_callsign
 
 PWD = pathlib.Path(__file__).resolve().parent
 ROUTES_DB_FILE = PWD / "vrs_routes.sqb"
+STAGING_DB_FILE = PWD / "vrs_routes_new.sqb"
+ROUTES_CSV_DIR = PWD / "../standing-data/routes/schema-01"
 
 logger = logging.getLogger(__name__)
 
 valid_route = re.compile(r"^([A-Z]{2}[A-Z0-9]{2}-){1,}[A-Z]{2}[A-Z0-9]{2}$")
 
+# Minimum interval in seconds between checks whether vrs_routes.sqb has
+# been rewritten.
+_CHECK_INTERVAL = 1.0
 
-def _ensure_schema(db_connection: sqlite3.Connection) -> None:
-    _cursor = db_connection.cursor()
-    _cursor.execute(
-        "SELECT count(name) FROM sqlite_master "
-        "WHERE type='table' AND name='flight_routes'"
-    )
-    if _cursor.fetchone()[0] == 0:
-        with open(PWD / "vrs_routes.sql", encoding="utf-8") as f:
-            db_connection.executescript(f.read())
-    _cursor.close()
 
+class _RouteIndex(NamedTuple):
+    # (mtime, size, inode) of the database file the index was loaded from.
+    signature: tuple
+    routes: dict[str, str]
+    airline_routes: dict[str, tuple[str, ...]]
+    airline_airports: dict[str, frozenset[str]]
 
-def refresh_database() -> None:
-    csv_files = glob.glob(
-        str(PWD / "../standing-data/routes/schema-01/*/*.csv")
-    )
-    if not csv_files:
-        logger.warning(
-            "No VRS route CSV files found — standing-data checkout missing "
-            f"or not at expected path relative to {PWD}."
+
+# In-memory copy of vrs_routes.sqb. It is replaced as a whole on reload, so
+# readers always see a consistent index without locking.
+_route_index = None
+_next_check = 0.0
+
+
+def _schema_statements() -> tuple[list[str], list[str]]:
+    """Returns the statements of vrs_routes.sql creating tables and those
+    creating indexes."""
+    with open(PWD / "vrs_routes.sql", encoding="utf-8") as f:
+        _statements = [
+            _statement.strip() for _statement in f.read().split(";")
+        ]
+    tables = []
+    indexes = []
+    for _statement in _statements:
+        if _statement.upper().startswith("CREATE INDEX"):
+            indexes.append(_statement)
+        elif _statement:
+            tables.append(_statement)
+    return tables, indexes
+
+
+def _hash_csv_file(file_name: str) -> tuple[str, str]:
+    with open(file_name, "rb") as _f:
+        return file_name, hashlib.sha1(_f.read()).hexdigest()
+
+
+def _parse_csv_file(file_name: str) -> tuple[str, str, list[tuple], int]:
+    """Returns the file name, content hash, valid (callsign, operator ICAO,
+    route) rows and number of skipped rows of a VRS route file."""
+    with open(file_name, "rb") as _f:
+        _data = _f.read()
+    _reader = csv.reader(io.StringIO(_data.decode("utf-8-sig")))
+    _header = next(_reader, [])
+    _callsign_column = _header.index("Callsign")
+    _operator_column = _header.index("AirlineCode")
+    _route_column = _header.index("AirportCodes")
+    rows = []
+    skipped = 0
+    for _row in _reader:
+        _callsign_info = validated_callsign(_row[_callsign_column])
+        if _callsign_info is None or not valid_route.match(
+            _row[_route_column]
+        ):
+            skipped += 1
+            continue
+        rows.append(
+            (
+                _callsign_info["callsign"],
+                _row[_operator_column],
+                _row[_route_column],
+            )
         )
-        return
+    return file_name, hashlib.sha1(_data).hexdigest(), rows, skipped
 
-    logger.info(f"Processing {len(csv_files)} VRS route files.")
-    _inserted = 0
-    _skipped = 0
 
-    with sqlite3.connect(ROUTES_DB_FILE) as db_connection:
-        _ensure_schema(db_connection)
-        _cursor = db_connection.cursor()
+# Rows of later files replace those of earlier files, as files are imported
+# in sorted order.
+_UPSERT_ROUTE = (
+    "INSERT INTO flight_routes(Callsign, OperatorIcao, Route, SourceFile) "
+    "VALUES(?, ?, ?, ?) ON CONFLICT(Callsign) DO UPDATE SET "
+    "OperatorIcao=excluded.OperatorIcao, Route=excluded.Route, "
+    "SourceFile=excluded.SourceFile "
+    "WHERE excluded.SourceFile >= flight_routes.SourceFile"
+)
 
-        for _file_name in csv_files:
-            with open(_file_name, encoding="utf-8-sig") as _csv_file:
-                _reader = csv.DictReader(_csv_file)
-                for _row in _reader:
-                    _callsign_info = validated_callsign(_row["Callsign"])
-                    if _callsign_info is None:
-                        _skipped += 1
-                        continue
-                    if not valid_route.match(_row["AirportCodes"]):
-                        _skipped += 1
-                        continue
-                    _cursor.execute(
-                        "REPLACE INTO flight_routes("
-                        "Callsign, OperatorIcao, Route) VALUES(?, ?, ?)",
-                        (
-                            _callsign_info["callsign"],
-                            _row["AirlineCode"],
-                            _row["AirportCodes"],
-                        ),
-                    )
-                    _inserted += 1
 
-        _cursor.close()
-        db_connection.commit()
-        db_connection.execute("VACUUM")
+def _import_csv_files(
+    db_connection: sqlite3.Connection,
+    map_function,
+    file_names: list[str],
+) -> tuple[int, int]:
+    """Streams the rows of the files into the database as they are parsed
+    and returns the numbers of imported and skipped rows."""
+    imported = 0
+    skipped = 0
+    for _file_name, _hash, _rows, _skipped in map_function(
+        _parse_csv_file, file_names
+    ):
+        _source_file = os.path.relpath(_file_name, ROUTES_CSV_DIR)
+        db_connection.executemany(
+            _UPSERT_ROUTE, (_row + (_source_file,) for _row in _rows)
+        )
+        db_connection.execute(
+            "REPLACE INTO source_files(FileName, Hash) VALUES(?, ?)",
+            (_source_file, _hash),
+        )
+        imported += len(_rows)
+        skipped += _skipped
+    return imported, skipped
 
-    logger.info(f"Done: {_inserted} routes inserted, {_skipped} skipped.")
 
+def _rebuild_database(map_function, csv_files: list[str]) -> tuple[int, int]:
+    """Imports all files into a new database, which then replaces
+    vrs_routes.sqb."""
+    tables, indexes = _schema_statements()
+    STAGING_DB_FILE.unlink(missing_ok=True)
+    db_connection = sqlite3.connect(STAGING_DB_FILE, isolation_level=None)
+    try:
+        # The staging database is discarded if the import fails.
+        db_connection.execute("PRAGMA journal_mode=OFF")
+        db_connection.execute("PRAGMA synchronous=OFF")
+        db_connection.execute("BEGIN")
+        for _statement in tables:
+            db_connection.execute(_statement)
+        result = _import_csv_files(db_connection, map_function, csv_files)
+        for _statement in indexes:
+            db_connection.execute(_statement)
+        db_connection.execute("COMMIT")
+    finally:
+        db_connection.close()
+    os.replace(STAGING_DB_FILE, ROUTES_DB_FILE)
+    return result
 
-def get_flight_route(callsign: str) -> str | None:
-    with sqlite3.connect(
-        f"file:{ROUTES_DB_FILE}?mode=ro", uri=True
-    ) as connection:
+
+def _has_source_files(db_file: pathlib.Path) -> bool:
+    if not db_file.exists():
+        return False
+    with sqlite3.connect(f"file:{db_file}?mode=ro", uri=True) as connection:
         _cursor = connection.cursor()
         _cursor.execute(
-            "SELECT Route FROM flight_routes WHERE Callsign=?", (callsign,)
+            "SELECT count(name) FROM sqlite_master "
+            "WHERE type='table' AND name='source_files'"
         )
-        result = _cursor.fetchone()
+        result = _cursor.fetchone()[0] > 0
         _cursor.close()
-    if result is not None:
-        return result[0]
+    return result
 
 
-def get_airline_routes(operator_icao: str) -> list[str]:
+def _update_database(map_function, csv_files: list[str]) -> tuple[int, int]:
+    """Re-imports only the files whose content hash differs from the one
+    stored at their last import and removes the rows of deleted files. A
+    callsign replaced by a row of a changed or deleted file is only
+    restored from other files by a full rebuild."""
+    _source_files = {
+        os.path.relpath(_file_name, ROUTES_CSV_DIR): _file_name
+        for _file_name in csv_files
+    }
+    _hashes = {
+        os.path.relpath(_file_name, ROUTES_CSV_DIR): _hash
+        for _file_name, _hash in map_function(_hash_csv_file, csv_files)
+    }
+    with sqlite3.connect(ROUTES_DB_FILE) as db_connection:
+        _cursor = db_connection.cursor()
+        _cursor.execute("SELECT FileName, Hash FROM source_files")
+        _stored = dict(_cursor.fetchall())
+        _cursor.close()
+        _outdated = sorted(
+            _source_file
+            for _source_file in set(_stored) | set(_hashes)
+            if _stored.get(_source_file) != _hashes.get(_source_file)
+        )
+        logger.info(f"{len(_outdated)} VRS route files changed.")
+        if not _outdated:
+            return 0, 0
+        db_connection.executemany(
+            "DELETE FROM flight_routes WHERE SourceFile=?",
+            ((_source_file,) for _source_file in _outdated),
+        )
+        db_connection.executemany(
+            "DELETE FROM source_files WHERE FileName=?",
+            ((_source_file,) for _source_file in _outdated),
+        )
+        result = _import_csv_files(
+            db_connection,
+            map_function,
+            [
+                _source_files[_source_file]
+                for _source_file in _outdated
+                if _source_file in _source_files
+            ],
+        )
+        db_connection.commit()
+    return result
+
+
+def _refresh(map_function, csv_files: list[str], incremental: bool):
+    if incremental and _has_source_files(ROUTES_DB_FILE):
+        return _update_database(map_function, csv_files)
+    return _rebuild_database(map_function, csv_files)
+
+
+def refresh_database(incremental: bool = False, workers=None) -> None:
+    """Rebuilds vrs_routes.sqb from the standing-data route files, which
+    are parsed by a pool of worker processes. With incremental, only the
+    files changed since the last refresh are imported again."""
+    csv_files = sorted(glob.glob(str(ROUTES_CSV_DIR / "*/*.csv")))
+    if not csv_files:
+        logger.warning(
+            "No VRS route CSV files found — standing-data checkout missing "
+            f"or not at expected path relative to {PWD}."
+        )
+        return
+
+    workers = workers or os.cpu_count() or 1
+    logger.info(
+        f"Processing {len(csv_files)} VRS route files ({workers} workers)."
+    )
+    _start = time.monotonic()
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as _executor:
+            _imported, _skipped = _refresh(
+                functools.partial(_executor.map, chunksize=16),
+                csv_files,
+                incremental,
+            )
+    else:
+        _imported, _skipped = _refresh(map, csv_files, incremental)
+    logger.info(
+        f"Done: {_imported} routes imported, {_skipped} skipped "
+        f"({time.monotonic() - _start:.1f}s)."
+    )
+    reload_route_data()
+
+
+def _file_signature() -> tuple:
+    _stat = os.stat(ROUTES_DB_FILE)
+    return _stat.st_mtime_ns, _stat.st_size, _stat.st_ino
+
+
+def _load_route_index() -> _RouteIndex:
+    signature = _file_signature()
     with sqlite3.connect(
         f"file:{ROUTES_DB_FILE}?mode=ro", uri=True
     ) as connection:
         _cursor = connection.cursor()
         _cursor.execute(
-            "SELECT DISTINCT Route FROM flight_routes WHERE OperatorIcao=?",
-            (operator_icao,),
+            "SELECT Callsign, OperatorIcao, Route FROM flight_routes"
         )
-        result = _cursor.fetchall()
+        _rows = _cursor.fetchall()
         _cursor.close()
-    if result:
-        return [_row[0] for _row in result]
-    return []
+    routes = {}
+    _airline_routes = {}
+    for _callsign, _operator_icao, _route in _rows:
+        routes[_callsign] = _route
+        _airline_routes.setdefault(_operator_icao, {})[_route] = None
+    airline_routes = {
+        _operator_icao: tuple(_routes)
+        for _operator_icao, _routes in _airline_routes.items()
+    }
+    airline_airports = {
+        _operator_icao: frozenset(
+            _airport for _route in _routes for _airport in _route.split("-")
+        )
+        for _operator_icao, _routes in airline_routes.items()
+    }
+    return _RouteIndex(signature, routes, airline_routes, airline_airports)
+
+
+def _get_route_index() -> _RouteIndex:
+    global _route_index, _next_check
+    _index = _route_index
+    _now = time.monotonic()
+    if _index is None:
+        _index = _route_index = _load_route_index()
+        _next_check = _now + _CHECK_INTERVAL
+    elif _now >= _next_check:
+        _next_check = _now + _CHECK_INTERVAL
+        if _file_signature() != _index.signature:
+            logger.info(f"{ROUTES_DB_FILE.name} changed, reloading.")
+            _index = _route_index = _load_route_index()
+    return _index
+
+
+def reload_route_data() -> None:
+    """Reloads the in-memory route index. It is also reloaded automatically
+    within a second after vrs_routes.sqb has been rewritten."""
+    global _route_index, _next_check
+    _route_index = _load_route_index()
+    _next_check = time.monotonic() + _CHECK_INTERVAL
+
+
+def get_flight_route(callsign: str) -> str | None:
+    return _get_route_index().routes.get(callsign)
+
+
+def get_airline_routes(operator_icao: str) -> list[str]:
+    return list(_get_route_index().airline_routes.get(operator_icao, ()))
+
+
+def get_airline_airports(operator_icao: str) -> frozenset[str]:
+    """Returns all airports of the routes of an operator."""
+    return _get_route_index().airline_airports.get(operator_icao, frozenset())
 
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
-    refresh_database()
+    parser = argparse.ArgumentParser(
+        description="Build vrs_routes.sqb from the standing-data routes."
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only import the files changed since the last refresh",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="number of parsing processes (default: number of CPUs)",
+    )
+    args = parser.parse_args()
+    refresh_database(incremental=args.incremental, workers=args.workers)